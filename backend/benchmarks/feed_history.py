@@ -0,0 +1,81 @@
+"""
+Shows the feed latency as finished events pile up, for the full feed and
+for the status=upcoming,ongoing feed served from the time index.
+
+Inserts rows, point DATABASE_URL at a scratch database.
+
+Usage (from backend/):
+    DATABASE_URL=mysql+pymysql://... python benchmarks/feed_history.py [--current 500] [--history 0,10000,50000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from app import create_app
+from models import db, User
+from bulk_import import import_events
+from cache import response_cache
+
+app = create_app()
+
+def make_records(count: int, past: bool, rng: random.Random):
+    now = datetime.now()
+    for row in range(count):
+        if past:
+            start = now - timedelta(days = rng.randint(2, 3 * 365))
+        else:
+            start = now + timedelta(days = rng.randint(-1, 60))
+        yield row, {
+            "title": f"Fair {row}",
+            "description": "Benchmark event",
+            "start_time": start.isoformat(timespec = "minutes"),
+            "end_time": (start + timedelta(hours = rng.randint(2, 30))).isoformat(timespec = "minutes"),
+            "color": "#1abc9c",
+            "geometry": {"type": "Point", "coordinates": [rng.uniform(20, 30), rng.uniform(43, 48)]}
+        }, None
+
+def time_feed(client, path: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        response_cache.clear()
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return statistics.median(timings) * 1000, len(response.get_json())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--current", type = int, default = 500)
+    parser.add_argument("--history", default = "0,10000,50000")
+    parser.add_argument("--runs", type = int, default = 5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        owner = User(first_name = "Bench", last_name = "Owner", email = f"bench{time.time_ns()}@example.com",
+                     password_hash = "-", birthday = date(1990, 1, 1))
+        db.session.add(owner)
+        db.session.commit()
+        import_events(make_records(args.current, False, rng), owner.id)
+
+        print(f"{'history':>8} {'full ms':>9} {'events':>7} {'current ms':>11} {'events':>7}")
+        inserted = 0
+        for history in (int(value) for value in args.history.split(",")):
+            import_events(make_records(history - inserted, True, rng), owner.id)
+            inserted = history
+
+            full_ms, full_count = time_feed(client, "/get_events", args.runs)
+            current_ms, current_count = time_feed(client, "/get_events?status=upcoming,ongoing", args.runs)
+            print(f"{history:>8} {full_ms:>9.1f} {full_count:>7} {current_ms:>11.1f} {current_count:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compares building the event feed from the WKB geometry against the
+precomputed GeoJSON stored on the event.
+
+Usage (from backend/):
+    python benchmarks/geojson_feed.py [events] [vertices]
+"""
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from flask import Flask
+from geoalchemy2.shape import to_shape
+from shapely.geometry import Point, Polygon, LineString, mapping
+from models import Event
+from raw_json import RawJSONProvider
+
+json = RawJSONProvider(Flask(__name__))
+
+def make_events(count: int, vertices: int) -> list:
+    rng = random.Random(42)
+    events = []
+    for event_id in range(count):
+        lon, lat = rng.uniform(20, 30), rng.uniform(43, 48)
+        kind = event_id % 3
+        if kind == 0:
+            geom = Point(lon, lat)
+        elif kind == 1:
+            ring = [
+                (lon + 0.01 * math.cos(2 * math.pi * i / vertices), lat + 0.01 * math.sin(2 * math.pi * i / vertices))
+                for i in range(vertices)
+            ]
+            geom = Polygon(ring)
+        else:
+            geom = LineString([(lon + 0.001 * i, lat + 0.0005 * rng.random()) for i in range(vertices)])
+
+        event = Event(
+            id = event_id, owner_id = 1, title = "Fair", description = "Benchmark event",
+            start_time = datetime(2026, 1, 1), end_time = datetime(2026, 1, 2),
+            created_at = datetime(2026, 1, 1), color = "#1abc9c"
+        )
+        event.set_geometry(geom)
+        events.append(event)
+    return events
+
+def wkb_to_dict(event: Event) -> dict:
+    # Event.to_dict before the GeoJSON was precomputed.
+    return {
+        "id": event.id,
+        "owner_id": event.owner_id,
+        "title": event.title,
+        "description": event.description,
+        "start_time": event.start_time.isoformat(),
+        "end_time": event.end_time.isoformat(),
+        "created_at": event.created_at.isoformat(),
+        "geometry": mapping(to_shape(event.geometry)),
+        "color": event.color
+    }
+
+def timed(build, events: list, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        json.dumps([build(event) for event in events])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    vertices = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    events = make_events(count, vertices)
+
+    results = {
+        "wkb (to_shape + mapping)": timed(wkb_to_dict, events),
+        "precomputed geojson": timed(lambda event: event.to_dict(), events),
+        "precomputed simplified": timed(lambda event: event.to_dict(simplified = True), events),
+    }
+
+    baseline = results["wkb (to_shape + mapping)"]
+    print(f"{count} events, {vertices} vertices per polygon/line")
+    for name, seconds in results.items():
+        print(f"  {name:<28} {seconds * 1000:8.1f} ms  x{baseline / seconds:.1f}")
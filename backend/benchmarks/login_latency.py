@@ -0,0 +1,98 @@
+"""
+Measures /login latency under concurrent clients, with the password
+hashing pool settings taken from the environment (PASSWORD_HASH_*).
+
+Runs the real app on a throwaway SQLite database through the Flask test
+client. Logins rejected with 503 are counted apart.
+
+Usage (from backend/):
+    python benchmarks/login_latency.py [--clients 1,8,32] [--logins 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "login.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_PATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from app import create_app
+from models import db, User
+from passwords import password_hasher
+
+app = create_app()
+
+PASSWORD = "fair-finder-password"
+
+def setup(users: int):
+    with app.app_context():
+        User.__table__.create(db.engine)
+        password_hash = password_hasher.hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {"first_name": "Bench", "last_name": str(i), "email": f"bench{i}@example.com",
+             "password_hash": password_hash, "birthday": date(1990, 1, 1)}
+            for i in range(users)
+        ])
+        db.session.commit()
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+def run(clients: int, logins: int) -> dict:
+    latencies = []
+    rejected = []
+    lock = threading.Lock()
+
+    def client(number: int):
+        test_client = app.test_client()
+        for _ in range(logins):
+            start = time.perf_counter()
+            response = test_client.post("/login", json = {"email": f"bench{number}@example.com", "password": PASSWORD})
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 503:
+                    rejected.append(elapsed)
+                else:
+                    assert response.status_code == 200, response.get_data(as_text = True)
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target = client, args = (number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "clients": clients,
+        "ok": len(latencies),
+        "rejected": len(rejected),
+        "logins_per_sec": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default = "1,8,32")
+    parser.add_argument("--logins", type = int, default = 20)
+    args = parser.parse_args()
+
+    clients = [int(value) for value in args.clients.split(",")]
+    setup(max(clients))
+
+    with app.app_context():
+        print(f"method {password_hasher.method}, {password_hasher.max_workers} workers, queue {password_hasher.max_queue}")
+    print(f"{'clients':>8} {'ok':>6} {'503':>6} {'login/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for count in clients:
+        row = run(count, args.logins)
+        print(f"{row['clients']:>8} {row['ok']:>6} {row['rejected']:>6} {row['logins_per_sec']:>9.1f} {row['p50']:>8.1f} {row['p99']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures requests/sec of the production server across worker counts.
+
+Starts gunicorn with each worker count, hammers one endpoint from a thread
+pool and prints a row per run. Uses the database configured through
+DATABASE_URL, so load some data first.
+
+Usage (from backend/):
+    python benchmarks/serve_load.py [--workers 1,2,4] [--threads 4]
+        [--path /get_events] [--clients 32] [--duration 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout = 1).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start")
+
+def hammer(url: str, duration: float) -> list:
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            urllib.request.urlopen(url, timeout = 30).read()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+    return latencies, errors
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+def run(workers: int, args) -> dict:
+    port = args.port
+    env = dict(os.environ, WEB_CONCURRENCY = str(workers), THREADS = str(args.threads),
+               BIND = f"127.0.0.1:{port}", ACCESS_LOG = "")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:create_app()"],
+        cwd = SRC, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{args.path}"
+        wait_ready(url)
+
+        with ThreadPoolExecutor(args.clients) as pool:
+            results = list(pool.map(lambda _: hammer(url, args.duration), range(args.clients)))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for client, _ in results for latency in client]
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "rps": len(latencies) / args.duration,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default = "1,2,4")
+    parser.add_argument("--threads", type = int, default = 4)
+    parser.add_argument("--path", default = "/get_events")
+    parser.add_argument("--clients", type = int, default = 32)
+    parser.add_argument("--duration", type = float, default = 10)
+    parser.add_argument("--port", type = int, default = 8091)
+    args = parser.parse_args()
+
+    print(f"{args.path}, {args.clients} clients, {args.threads} threads per worker")
+    print(f"{'workers':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in (int(value) for value in args.workers.split(",")):
+        row = run(workers, args)
+        print(f"{row['workers']:>8} {row['requests']:>9} {row['errors']:>7} {row['rps']:>9.1f} {row['p50']:>8.1f} {row['p99']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Reproducible backend benchmark: seeds a database with synthetic users,
+events and participations (see synthetic.py), drives the real app through
+the Flask test client and prints throughput and latency percentiles as
+JSON, so runs on different commits can be compared.
+
+Uses DATABASE_URL when set (point it at a scratch MySQL database, rows are
+inserted). Otherwise a throwaway SQLite database with the SpatiaLite
+extension (SPATIALITE_LIBRARY_PATH, see GeoAlchemy2) is created.
+
+Usage (from backend/):
+    python benchmarks/suite.py [--users 2000] [--events 1000] [--requests 200] [--cold] [--output result.json]
+    python benchmarks/suite.py --scenarios get_events,get_event
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from geoalchemy2 import load_spatialite
+from sqlalchemy import event
+from app import create_app, create_access_token
+from models import db, User, Event
+from cache import response_cache
+import synthetic
+
+app = create_app()
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+class Scenario:
+    """
+    One endpoint under test. request(client, rng) sends one request and
+    returns the response.
+    """
+
+    def __init__(self, name: str, request, expected = (200,)):
+        self.name = name
+        self.request = request
+        self.expected = expected
+
+def scenarios(event_ids: list, users: list) -> dict:
+    """
+    Args:
+        users = [(user id, email)] of the synthetic users.
+    """
+
+    tokens = {}
+    def auth(rng):
+        user_id = rng.choice(users)[0]
+        if user_id not in tokens:
+            tokens[user_id] = create_access_token(user_id)
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    return {scenario.name: scenario for scenario in (
+        Scenario("get_events", lambda client, rng: client.get("/get_events")),
+        Scenario("get_events_upcoming", lambda client, rng: client.get("/get_events?status=upcoming,ongoing")),
+        Scenario("get_event", lambda client, rng: client.get(f"/get_event?event_id={rng.choice(event_ids)}")),
+        Scenario("participants", lambda client, rng: client.get(f"/get_event_part/{rng.choice(event_ids)}")),
+        Scenario("participants_page", lambda client, rng: client.get(f"/get_event_part/{rng.choice(event_ids)}?limit=50")),
+        Scenario("post_participation", lambda client, rng: client.post(
+            "/post_participation",
+            json = {"event_id": rng.choice(event_ids), "status": rng.choice(["Going", "Interested", "Not going"])},
+            headers = auth(rng)
+        )),
+        Scenario("login", lambda client, rng: client.post(
+            "/login", json = {"email": rng.choice(users)[1], "password": synthetic.PASSWORD}
+        ))
+    )}
+
+def run(scenario: Scenario, client, requests: int, warmup: int, cold: bool, seed: int) -> dict:
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        scenario.request(client, rng)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        if cold:
+            response_cache.clear()
+        start = time.perf_counter()
+        response = scenario.request(client, rng)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code not in scenario.expected:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd = BENCH_DIR, capture_output = True, text = True, check = True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def setup_database(args) -> dict:
+    if db.engine.dialect.name == "sqlite":
+        event.listen(db.engine, "connect", load_spatialite)
+    db.create_all()
+    return synthetic.generate(args.users, args.events, args.participations, args.seed)
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type = int, default = 2000)
+    parser.add_argument("--events", type = int, default = 1000)
+    parser.add_argument("--participations", type = int, default = 20, help = "mean participations per event")
+    parser.add_argument("--requests", type = int, default = 200, help = "requests per scenario")
+    parser.add_argument("--warmup", type = int, default = 10)
+    parser.add_argument("--scenarios", help = "comma separated, all by default")
+    parser.add_argument("--cold", action = "store_true", help = "clear the response cache before every request")
+    parser.add_argument("--seed", type = int, default = 42)
+    parser.add_argument("--output", help = "also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    client = app.test_client()
+    with app.app_context():
+        seeded = setup_database(args)
+        database = db.engine.dialect.name
+        event_ids = [event_id for (event_id,) in db.session.query(Event.id).order_by(Event.id)]
+        users = db.session.query(User.id, User.email).filter(User.email.like("bench%@example.com")).order_by(User.id).all()
+
+    available = scenarios(event_ids, users)
+    names = args.scenarios.split(",") if args.scenarios else list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (available: {', '.join(available)})")
+
+    report = {
+        "commit": git_commit(),
+        "database": database,
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "seeded": seeded,
+        "scenarios": {}
+    }
+    for name in names:
+        report["scenarios"][name] = run(available[name], client, args.requests, args.warmup, args.cold, args.seed)
+
+    text = json.dumps(report, indent = 2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
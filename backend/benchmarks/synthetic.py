@@ -0,0 +1,126 @@
+"""
+Synthetic data for the benchmarks: users with a realistic age and gender
+mix, events with Point/Polygon/LineString geometries around Romania and
+participations with a realistic status mix.
+
+The same seed always gives the same rows, so runs on different commits
+measure the same database. Run inside an app context.
+"""
+import math
+import random
+from datetime import date, datetime, timedelta
+
+from geoalchemy2.shape import from_shape
+from shapely.geometry import Point, Polygon, LineString
+from models import db, User, Event, Participation, SRID, geojson_variants
+from event_stats import rebuild_stats
+from passwords import password_hasher
+
+PASSWORD = "fair-finder-password"
+# (min age, max age, weight), includes some minors, who are left out of the age stats.
+AGE_MIX = ((14, 17, 4), (18, 24, 30), (25, 34, 32), (35, 44, 18), (45, 75, 16))
+GENDER_MIX = (("M", 46), ("F", 46), ("N", 8))
+STATUS_MIX = (("Interested", 50), ("Going", 35), ("Not going", 15))
+# Share of Point, Polygon and LineString events.
+GEOMETRY_MIX = (("Point", 60), ("Polygon", 25), ("LineString", 15))
+COLORS = ("#1abc9c", "#3498db", "#9b59b6", "#e67e22", "#e74c3c")
+BATCH = 1000
+
+def _pick(rng: random.Random, mix: tuple):
+    # The last field of a mix entry is its weight, the rest is the value.
+    values = [item[0] if len(item) == 2 else item[:-1] for item in mix]
+    return rng.choices(values, [item[-1] for item in mix])[0]
+
+def email(user_number: int) -> str:
+    return f"bench{user_number}@example.com"
+
+def make_geometry(rng: random.Random, kind: str, vertices: int = 12):
+    lon, lat = rng.uniform(20.5, 29.5), rng.uniform(43.8, 48.1)
+    if kind == "Point":
+        return Point(lon, lat)
+    if kind == "Polygon":
+        radius = rng.uniform(0.002, 0.02)
+        return Polygon([
+            (lon + radius * math.cos(2 * math.pi * i / vertices), lat + radius * math.sin(2 * math.pi * i / vertices))
+            for i in range(vertices)
+        ])
+    return LineString([(lon + 0.002 * i, lat + 0.001 * rng.uniform(-1, 1)) for i in range(vertices)])
+
+def _users(rng: random.Random, count: int, password_hash: str, today: date):
+    for number in range(count):
+        min_age, max_age = _pick(rng, AGE_MIX)
+        birthday = today - timedelta(days = rng.randint(min_age * 365 + 1, max_age * 365 + 300))
+        yield {
+            "first_name": "Bench",
+            "last_name": str(number),
+            "email": email(number),
+            "password_hash": password_hash,
+            "birthday": birthday,
+            "gender": _pick(rng, GENDER_MIX),
+            "created_at": datetime.now()
+        }
+
+def _events(rng: random.Random, count: int, user_ids: list, now: datetime):
+    for number in range(count):
+        geom = make_geometry(rng, _pick(rng, GEOMETRY_MIX))
+        geojson, geojson_simplified = geojson_variants(geom)
+        start = now + timedelta(hours = rng.randint(-24 * 30, 24 * 60))
+        yield {
+            "owner_id": rng.choice(user_ids),
+            "title": f"Fair {number}",
+            "description": "Synthetic benchmark event",
+            "start_time": start,
+            "end_time": start + timedelta(hours = rng.randint(2, 72)),
+            "created_at": now,
+            "geometry": from_shape(geom, srid = SRID),
+            "geojson": geojson,
+            "geojson_simplified": geojson_simplified,
+            "color": rng.choice(COLORS)
+        }
+
+def _participations(rng: random.Random, event_ids: list, user_ids: list, per_event: int):
+    for event_id in event_ids:
+        # Popularity is skewed, a few events draw most of the participants.
+        count = min(len(user_ids), int(rng.paretovariate(1.5) * per_event / 3))
+        for user_id in rng.sample(user_ids, count):
+            yield {"user_id": user_id, "event_id": event_id, "status": _pick(rng, STATUS_MIX)}
+
+def _insert(table, rows) -> int:
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            db.session.execute(table.insert(), batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        inserted += len(batch)
+    db.session.commit()
+    return inserted
+
+def generate(users: int, events: int, participations_per_event: int, seed: int = 42) -> dict:
+    """
+    Inserts the synthetic rows and builds the event stats.
+
+    Every user has the password PASSWORD and the email email(number).
+
+    Returns:
+        {"users": int, "events": int, "participations": int}
+    """
+
+    rng = random.Random(seed)
+    now = datetime.now().replace(minute = 0, second = 0, microsecond = 0)
+    # One hash for everyone, hashing is what /login measures, not the seeding.
+    password_hash = password_hasher.hash(PASSWORD)
+
+    report = {"users": _insert(User.__table__, _users(rng, users, password_hash, now.date()))}
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    report["events"] = _insert(Event.__table__, _events(rng, events, user_ids, now))
+    event_ids = [event_id for (event_id,) in db.session.query(Event.id).order_by(Event.id)]
+    report["participations"] = _insert(
+        Participation.__table__, _participations(rng, event_ids, user_ids, participations_per_event)
+    )
+    rebuild_stats()
+    return report
@@ -0,0 +1,77 @@
+import json
+from datetime import datetime
+from sqlalchemy import insert, select, delete
+from models import db
+from models import Event, Participation, EventStats, ArchivedEvent, ArchivedParticipation
+from event_stats import load_counters, counters_to_dict, empty_counters
+from spatial import event_index
+from text_search import text_index
+from nearest import nearest_index
+from density import centroid_index
+from cache import response_cache
+from live import live_hub
+
+def archive_events(before: datetime, batch_size: int = 1000) -> int:
+    """
+    Moves the events that ended before a date, with their participations,
+    to the archive tables, so the hot tables only hold current events.
+
+    Each batch is copied and deleted in one transaction, which also bumps
+    the "all" change log scope: the caches and indexes of every process
+    drop the archived events.
+
+    The archive tables are created by init-db or migration 9.
+
+    Returns:
+        The number of events archived.
+    """
+
+    archived = 0
+    while True:
+        events = Event.query.filter(Event.end_time < before)\
+            .order_by(Event.end_time, Event.id).limit(batch_size).all()
+        if not events:
+            break
+
+        event_ids = [event.id for event in events]
+        counters = load_counters(events)
+        db.session.execute(insert(ArchivedEvent), [
+            {
+                "id": event.id,
+                "owner_id": event.owner_id,
+                "title": event.title,
+                "description": event.description,
+                "start_time": event.start_time,
+                "end_time": event.end_time,
+                "created_at": event.created_at,
+                "geojson": event.geojson or json.dumps(event.geometry_geojson()),
+                "color": event.color,
+                "stats": json.dumps(counters_to_dict(counters.get(event.id, empty_counters())))
+            }
+            for event in events
+        ])
+
+        columns = ["id", "user_id", "event_id", "status"]
+        db.session.execute(insert(ArchivedParticipation).from_select(
+            columns,
+            select(*[getattr(Participation, column) for column in columns])
+                .where(Participation.event_id.in_(event_ids))
+        ))
+
+        # Explicit deletes, SQLite does not enforce the ON DELETE CASCADE.
+        db.session.execute(delete(Participation).where(Participation.event_id.in_(event_ids)))
+        db.session.execute(delete(EventStats).where(EventStats.event_id.in_(event_ids)))
+        db.session.execute(delete(Event).where(Event.id.in_(event_ids)))
+        response_cache.invalidate("all")
+        db.session.commit()
+        db.session.expunge_all()
+        archived += len(event_ids)
+
+    if archived:
+        event_index.invalidate()
+        centroid_index.invalidate()
+        text_index.invalidate()
+        nearest_index.invalidate()
+        live_hub.publish("reload", {"archived": archived})
+        db.session.commit()
+    return archived
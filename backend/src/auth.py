@@ -1,24 +1,88 @@
 from functools import wraps
 from flask import request, jsonify
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
 import jwt
+from cache import MemoryCache
+from models import db, User
+from state import app_local
+
+SECRET_KEY = "SECRET_KEY"
+# Share of rejected requests that get logged, the counts cover all of them.
+LOG_SAMPLE_RATE = float(os.environ.get("AUTH_LOG_SAMPLE_RATE", 0.01))
+
+logger = logging.getLogger(__name__)
+
+# Verified token payloads by token digest, each kept for the TTL at most and never past the token's exp.
+token_cache = app_local("token_cache", lambda: MemoryCache(max_entries = 4096, ttl = 60))
+
+_rejections = {}
+_rejections_lock = threading.Lock()
+
+def _log_rejection(reason: str):
+    with _rejections_lock:
+        _rejections[reason] = _rejections.get(reason, 0) + 1
+        total = _rejections[reason]
+
+    if random.random() < LOG_SAMPLE_RATE:
+        logger.info("auth rejected", extra = {
+            "reason": reason,
+            "path": request.path,
+            "rejected_total": total
+        })
+
+def verify_token(token: str) -> dict:
+    """
+    Returns the payload of a token, decoding it only the first time it is seen.
+
+    Raises:
+        jwt.InvalidTokenError if the token is invalid or expired.
+    """
+
+    key = hashlib.blake2b(token.encode(), digest_size = 16).hexdigest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    # Checked again after the cache TTL, and never past the token's exp.
+    ttl = token_cache.ttl
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(key, payload, ttl)
+    return payload
+
+def current_user():
+    """
+    Returns the User of the authenticated request, loaded at most once per request.
+    """
+
+    # Kept on the request, an app context (tests, CLI) may span several requests.
+    if not hasattr(request, "current_user"):
+        request.current_user = db.session.get(User, request.user_id)
+    return request.current_user
 
-SECRET_KEY = "SECRET_KEY" 
 def login_required(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         auth_header = request.headers.get("Authorization")
         if not auth_header:
-            print("missing")
+            _log_rejection("missing")
             return jsonify({"error": "Missing token"}), 401
-        
+
         try:
             token = auth_header.split(" ")[1]
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            data = verify_token(token)
             request.user_id = data["user_id"]
         except Exception:
-            print("WTF")
+            _log_rejection("invalid")
             return jsonify({"error": "Invalid token"}), 401
-        
+
         return f(*args, **kwargs)
 
     return wrapper
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import has_request_context, url_for
+from PIL import Image, ImageOps
+from state import app_local
+
+AVATAR_FOLDER = os.environ.get("AVATAR_FOLDER", "uploads/avatars")
+# Participant lists use the small size, the profile page the large one.
+SMALL = 64
+LARGE = 256
+SIZES = (SMALL, LARGE)
+# Extension: (Pillow format, save options)
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True})
+}
+# Pillow format: extension of the original kept beside the thumbnails.
+ALLOWED_FORMATS = {"PNG": "png", "JPEG": "jpg", "GIF": "gif", "WEBP": "webp"}
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+Image.MAX_IMAGE_PIXELS = 40_000_000
+_DIGEST = re.compile(r"^[0-9a-f]{32}$")
+
+class UploadTooLarge(ValueError):
+    pass
+
+def thumbnail_name(digest: str, size: int, ext: str = "webp") -> str:
+    return f"{digest}_{size}.{ext}"
+
+def original_name(digest: str, ext: str) -> str:
+    return f"{digest}_orig.{ext}"
+
+def is_digest(value: str) -> bool:
+    return bool(value) and _DIGEST.match(value) is not None
+
+def avatar_url(profile_picture, size: int = LARGE):
+    """
+    Returns the URL of an avatar thumbnail.
+
+    Args:
+        profile_picture = the content hash stored on the user. Full URLs
+            of avatars uploaded before thumbnails existed are returned as is.
+    """
+
+    if not is_digest(profile_picture):
+        return profile_picture
+
+    filename = thumbnail_name(profile_picture, size)
+    if has_request_context():
+        return url_for("api.uploaded_file", filename = filename, _external = True)
+    return f"/uploads/avatars/{filename}"
+
+class AvatarPipeline:
+    """
+    Stores uploaded avatars under the hash of their content and renders the
+    thumbnails on a background thread pool.
+
+    The upload is only spooled, hashed and sniffed on the request thread.
+    Identical uploads share their files and are rendered once. The original
+    is kept as <digest>_orig.<ext>, served until the thumbnails exist (they
+    may be rendered by another worker process).
+    """
+
+    def __init__(self, folder: str, max_workers: int = 2):
+        self.folder = folder
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix = "avatar")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.folder, filename)
+
+    def is_ready(self, digest: str) -> bool:
+        return all(
+            os.path.exists(self.path(thumbnail_name(digest, size, ext)))
+            for size in SIZES for ext in FORMATS
+        )
+
+    def original(self, digest: str):
+        """
+        Returns the file name of the original upload of a digest, None if there is none.
+        """
+
+        for ext in ALLOWED_FORMATS.values():
+            filename = original_name(digest, ext)
+            if os.path.exists(self.path(filename)):
+                return filename
+        return None
+
+    def submit(self, stream) -> str:
+        """
+        Spools an upload to disk and queues its thumbnails.
+
+        Returns:
+            The content hash of the upload.
+
+        Raises:
+            UploadTooLarge above MAX_UPLOAD_BYTES, ValueError if it is not an image.
+        """
+
+        os.makedirs(self.folder, exist_ok = True)
+        digest = hashlib.blake2b(digest_size = 16)
+        fd, upload_path = tempfile.mkstemp(dir = self.folder, suffix = ".upload")
+        try:
+            size = 0
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: stream.read(READ_CHUNK), b""):
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_BYTES:
+                        raise UploadTooLarge(f"Avatar larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            # Reads the header only, the pixels are decoded by the worker.
+            try:
+                with Image.open(upload_path) as img:
+                    ext = ALLOWED_FORMATS[img.format]
+            except Exception:
+                raise ValueError("Invalid image file.")
+        except Exception:
+            os.remove(upload_path)
+            raise
+
+        digest = digest.hexdigest()
+        with self._lock:
+            if digest in self._pending or self.is_ready(digest):
+                os.remove(upload_path)
+            else:
+                original_path = self.path(original_name(digest, ext))
+                os.replace(upload_path, original_path)
+                self._pending[digest] = self._executor.submit(self._render, original_path, digest)
+        return digest
+
+    def wait(self, digest: str, timeout: float = 10) -> bool:
+        """
+        Waits for the thumbnails of a digest if this process is rendering them.
+
+        Returns:
+            True if they are ready. False while another process renders
+            them, or when rendering failed or is still running after timeout.
+        """
+
+        with self._lock:
+            future = self._pending.get(digest)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                # Timed out, or failed and reported to the on_failure callback.
+                pass
+        return self.is_ready(digest)
+
+    def on_failure(self, digest: str, callback):
+        """
+        Calls callback(digest) if rendering the thumbnails of a digest fails,
+        at once if it already failed. Runs on the render thread.
+        """
+
+        with self._lock:
+            future = self._pending.get(digest)
+        if future is None:
+            # The original is removed when rendering fails.
+            if not self.is_ready(digest) and self.original(digest) is None:
+                callback(digest)
+            return
+        future.add_done_callback(lambda done: callback(digest) if done.exception() is not None else None)
+
+    def _render(self, original_path: str, digest: str):
+        try:
+            with Image.open(original_path) as img:
+                # Lets JPEG decode at a reduced scale instead of full size.
+                img.draft("RGB", (LARGE * 2, LARGE * 2))
+                img = ImageOps.exif_transpose(img)
+                if img.mode in ("RGBA", "LA", "P"):
+                    img = img.convert("RGBA")
+                    background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+                    img = Image.alpha_composite(background, img)
+                img = img.convert("RGB")
+
+                for size in sorted(SIZES, reverse = True):
+                    thumb = ImageOps.fit(img, (size, size), Image.Resampling.LANCZOS)
+                    for ext, (fmt, options) in FORMATS.items():
+                        self._save(thumb, thumbnail_name(digest, size, ext), fmt, options)
+        except Exception:
+            # A later upload of the same content renders it again.
+            os.remove(original_path)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def _save(self, img, filename: str, fmt: str, options: dict):
+        # Written aside and renamed, so readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir = self.folder, suffix = ".tmp")
+        with os.fdopen(fd, "wb") as out:
+            img.save(out, fmt, **options)
+        os.replace(tmp_path, self.path(filename))
+
+avatar_pipeline = app_local(
+    "avatar_pipeline", lambda: AvatarPipeline(AVATAR_FOLDER, int(os.environ.get("AVATAR_WORKERS", 2)))
+)
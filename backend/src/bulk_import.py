@@ -0,0 +1,326 @@
+import codecs
+import json
+import re
+import numpy as np
+import shapely
+from datetime import datetime
+from geoalchemy2.elements import WKBElement
+from shapely.geometry import shape
+from sqlalchemy import insert, select, literal
+from sqlalchemy.exc import SQLAlchemyError
+from models import db
+from models import Event, EventStats, SRID, GEOMETRY_TYPES, geojson_variants
+from utils import validate_post_request, PostFields
+from spatial import event_index
+from text_search import text_index
+from nearest import nearest_index
+from density import centroid_index
+from cache import response_cache
+from live import live_hub
+
+NDJSON = "ndjson"
+FEATURE_COLLECTION = "geojson"
+
+READ_CHUNK = 64 * 1024
+BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 1000
+
+_FEATURES = re.compile(r'"features"\s*:\s*\[')
+_LENGTHS = {
+    column: Event.__table__.c[column].type.length
+    for column in ("title", "description", "color")
+}
+
+def _iter_text(stream):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        data = stream.read(READ_CHUNK)
+        if not data:
+            tail = decoder.decode(b"", final = True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data)
+
+def _iter_ndjson(chunks):
+    buffer = ""
+    row = 0
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            row += 1
+            yield row, line
+    if buffer:
+        yield row + 1, buffer
+
+def iter_ndjson(stream):
+    """
+    Yields (row, record, error) for every non blank line of an NDJSON stream.
+    """
+
+    for row, line in _iter_ndjson(_iter_text(stream)):
+        if not line.strip():
+            continue
+        try:
+            yield row, json.loads(line), None
+        except ValueError as e:
+            yield row, None, f"Invalid JSON: {e}"
+
+def iter_feature_collection(stream):
+    """
+    Yields (row, feature, None) for the features of a GeoJSON FeatureCollection,
+    decoding them one at a time instead of loading the whole document.
+
+    Raises:
+        ValueError if the document is not a FeatureCollection or is truncated.
+    """
+
+    decoder = json.JSONDecoder()
+    chunks = _iter_text(stream)
+    buffer = ""
+
+    match = None
+    while match is None:
+        match = _FEATURES.search(buffer)
+        if match is None:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("Missing the features array of the FeatureCollection.")
+            buffer += chunk
+
+    pos = match.end()
+    row = 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        decoded = None
+        if pos < len(buffer):
+            if buffer[pos] == "]":
+                return
+            try:
+                decoded = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The feature continues in the next chunk.
+                pass
+
+        if decoded is None:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("Invalid FeatureCollection, malformed or truncated feature.")
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        feature, pos = decoded
+        row += 1
+        yield row, feature, None
+
+def _event_fields(record) -> dict:
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object.")
+
+    # GeoJSON Features carry the event fields in their properties.
+    if record.get("type") == "Feature":
+        fields = dict(record.get("properties") or {})
+        fields["geometry"] = record.get("geometry")
+        return fields
+    return dict(record)
+
+def _validate(record, owner_id) -> tuple:
+    """
+    Returns the insert values of a record and its geometry, without the geometry columns.
+
+    Raises:
+        ValueError describing the first invalid field.
+    """
+
+    fields = _event_fields(record)
+    if owner_id is not None:
+        fields["owner_id"] = owner_id
+
+    status, message = validate_post_request(fields, PostFields.event.value)
+    if not status:
+        raise ValueError(message["status"])
+
+    for column, length in _LENGTHS.items():
+        if len(fields[column]) > length:
+            raise ValueError(f"{column} longer than {length} characters")
+
+    try:
+        start_time = datetime.fromisoformat(fields["start_time"])
+        end_time = datetime.fromisoformat(fields["end_time"])
+    except ValueError:
+        raise ValueError("start_time or end_time not in format <YYYY-MM-DDTHH:MM>")
+
+    try:
+        geom_shape = shape(fields["geometry"])
+    except Exception as e:
+        raise ValueError(f"Invalid geometry: {e}")
+    if geom_shape.geom_type not in GEOMETRY_TYPES:
+        raise ValueError(f"Unsupported geometry type {geom_shape.geom_type}, expected one of {', '.join(GEOMETRY_TYPES)}")
+
+    values = {
+        "owner_id": fields["owner_id"],
+        "title": fields["title"],
+        "description": fields["description"],
+        "start_time": start_time,
+        "end_time": end_time,
+        "color": fields["color"]
+    }
+    return values, geom_shape
+
+def prepare_chunk(chunk: list, owner_id: int = None) -> tuple:
+    """
+    Validates a chunk of parsed records and converts their geometries.
+
+    Args:
+        chunk = [(row, record, parse_error)]
+
+    Returns:
+        ([(row, insert values)], [(row, error)])
+    """
+
+    rows = []
+    values = []
+    shapes = []
+    errors = []
+    for row, record, error in chunk:
+        if error:
+            errors.append((row, error))
+            continue
+        try:
+            event_values, geom_shape = _validate(record, owner_id)
+        except ValueError as e:
+            errors.append((row, str(e)))
+            continue
+        rows.append(row)
+        values.append(event_values)
+        shapes.append(geom_shape)
+
+    if not shapes:
+        return [], sorted(errors)
+
+    shapes = np.array(shapes, dtype = object)
+    empty = shapely.is_empty(shapes)
+    wkbs = shapely.to_wkb(shapes)
+
+    res = []
+    for pos, event_values in enumerate(values):
+        if empty[pos]:
+            errors.append((rows[pos], "Invalid geometry: empty"))
+            continue
+        geojson, geojson_simplified = geojson_variants(shapes[pos])
+        event_values.update({
+            "geometry": WKBElement(wkbs[pos], srid = SRID),
+            "geojson": geojson,
+            "geojson_simplified": geojson_simplified
+        })
+        res.append((rows[pos], event_values))
+    return res, sorted(errors)
+
+def _insert_batch(batch: list) -> list:
+    """
+    Inserts a batch with one executemany and one commit. If the database
+    rejects it, the rows are retried one by one to find the failing ones.
+
+    Returns:
+        [(row, error)] of the rows that were not inserted.
+    """
+
+    try:
+        db.session.execute(insert(Event), [event_values for _, event_values in batch])
+        db.session.commit()
+        return []
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    errors = []
+    for row, event_values in batch:
+        try:
+            db.session.execute(insert(Event), [event_values])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            errors.append((row, str(e.orig if getattr(e, "orig", None) else e).splitlines()[0]))
+    return errors
+
+def _create_missing_stats():
+    counters = [literal(0)] * len(EventStats.COUNTERS)
+    missing = select(Event.id, *counters)\
+        .outerjoin(EventStats, EventStats.event_id == Event.id)\
+        .where(EventStats.event_id.is_(None))
+    db.session.execute(insert(EventStats).from_select(["event_id", *EventStats.COUNTERS], missing))
+    db.session.commit()
+
+def read_records(stream, fmt: str):
+    """
+    Returns the record iterator of an NDJSON or FeatureCollection stream.
+    """
+
+    if fmt == NDJSON:
+        return iter_ndjson(stream)
+    if fmt == FEATURE_COLLECTION:
+        return iter_feature_collection(stream)
+    raise ValueError(f"Unknown format {fmt}, expected {NDJSON} or {FEATURE_COLLECTION}.")
+
+def import_events(records, owner_id: int = None, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Imports events in batches, one INSERT and one commit per batch.
+
+    Invalid rows are reported and skipped, they do not abort the import.
+
+    Args:
+        records = iterable of (row, record, parse_error), see iter_ndjson
+            and iter_feature_collection. Records are /post_event bodies
+            or GeoJSON Features with the same fields as properties.
+
+        owner_id = the owner of every event, None to read it from the records.
+
+    Returns:
+        {"inserted": int, "failed": int, "errors": [{"row": int, "error": str}]},
+        plus "aborted": str if the stream could not be parsed to the end.
+    """
+
+    report = {"inserted": 0, "failed": 0, "errors": []}
+
+    def add_errors(errors):
+        report["failed"] += len(errors)
+        free = MAX_REPORTED_ERRORS - len(report["errors"])
+        report["errors"].extend({"row": row, "error": error} for row, error in errors[:free])
+
+    def flush(chunk):
+        batch, errors = prepare_chunk(chunk, owner_id)
+        add_errors(errors)
+        if batch:
+            failed = _insert_batch(batch)
+            add_errors(failed)
+            report["inserted"] += len(batch) - len(failed)
+
+    chunk = []
+    try:
+        try:
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == batch_size:
+                    flush(chunk)
+                    chunk = []
+        except ValueError as e:
+            # The stream itself is malformed, the rows read before it are kept.
+            report["aborted"] = str(e)
+        if chunk:
+            flush(chunk)
+    finally:
+        if report["inserted"]:
+            # Reloads the caches and indexes of the server workers too.
+            response_cache.invalidate("feed", "events")
+            live_hub.publish("reload", {"inserted": report["inserted"]})
+            _create_missing_stats()
+            event_index.invalidate()
+            centroid_index.invalidate()
+            text_index.invalidate()
+            nearest_index.invalidate()
+
+    return report
@@ -0,0 +1,237 @@
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+from changelog import change_log
+from state import app_local
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent uncompressed.
+MIN_COMPRESS_BYTES = 1024
+
+class CacheBackend:
+    """
+    Storage used by ResponseCache.
+
+    Subclass it to plug in a shared store (Redis, memcached) so every worker
+    sees the same entries. The generations are shared through the database,
+    see changelog.ChangeLog.
+    """
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float = None):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+class MemoryCache(CacheBackend):
+    """
+    In-process LRU cache with a TTL per entry.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class ResponseCache:
+    """
+    Caches GET responses under keys that embed the generation of every scope
+    they depend on. Bumping a scope's generation makes its entries unreachable,
+    they are then evicted by the LRU.
+
+    Scopes are "feed" for event lists, "event:<id>" for one event and "all".
+    "events" is bumped when events are added, moved or removed, for the
+    in-process indexes.
+    The generations come from the change log, so a write bumps them in every
+    process within its poll interval.
+    """
+
+    def __init__(self, backend: CacheBackend, changes = change_log):
+        self.backend = backend
+        self.changes = changes
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _key(self, scopes: list) -> str:
+        scopes = ["all"] + list(scopes)
+        generations = ",".join(f"{scope}={self.generation(scope)}" for scope in scopes)
+        # Bodies hold absolute URLs (avatars) built from the request host.
+        return f"{request.host}|{request.full_path}|{request.headers.get('Accept', '')}|{generations}"
+
+    def generation(self, scope: str) -> int:
+        return self.changes.generation(scope)
+
+    def invalidate(self, *scopes):
+        """
+        Bumps the generations of scopes, in the caller's transaction. Call it
+        before the commit of the write, the caller commits.
+        """
+
+        if scopes:
+            self.changes.record(*scopes)
+
+    def clear(self):
+        """
+        Drops the entries of this process.
+        """
+
+        self.backend.clear()
+
+    def invalidate_events(self, event_ids, feed: bool = True):
+        """
+        Invalidates the cached reads of some events, and of the feed by default.
+        The caller commits.
+        """
+
+        scopes = [f"event:{event_id}" for event_id in event_ids]
+        if feed:
+            scopes.append("feed")
+        self.invalidate(*scopes)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            "entries": len(self.backend)
+        }
+
+    def cached(self, scopes):
+        """
+        Decorator caching a GET view.
+
+        Args:
+            scopes = function returning the scopes the response depends on,
+                called inside the request.
+        """
+
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                return self.respond(f, scopes, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def respond(self, f, scopes, *args, **kwargs):
+        """
+        Returns the cached response of the view f, calling it on a miss, see cached().
+        """
+
+        key = self._key(scopes(*args, **kwargs))
+        entry = self.backend.get(key)
+
+        if entry is not None:
+            self._count("hits")
+            body, mimetype, etag, encoded = entry
+            response = make_response(body)
+            response.mimetype = mimetype
+        else:
+            self._count("misses")
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            body = response.get_data()
+            etag = hashlib.blake2b(body, digest_size = 16).hexdigest()
+            encoded = compress(body)
+            self.backend.set(key, (body, response.mimetype, etag, encoded))
+
+        # The key holds the Accept header, so the negotiated format is cached apart.
+        response.vary.update(("Accept", "Accept-Encoding"))
+        encoding = request.accept_encodings.best_match(list(encoded))
+        if encoding is not None:
+            response.set_data(encoded[encoding])
+            response.content_encoding = encoding
+            etag = f"{etag}-{encoding}"
+
+        response.set_etag(etag)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            self._count("not_modified")
+        return response
+
+def compress(body: bytes) -> dict:
+    """
+    Returns the precompressed variants of a cached body, {content coding: bytes}.
+    Brotli is used when the brotli package is installed.
+    """
+
+    if len(body) < MIN_COMPRESS_BYTES:
+        return {}
+
+    encoded = {}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality = 5)
+    encoded["gzip"] = gzip.compress(body, compresslevel = 6)
+    return encoded
+
+response_cache = app_local("response_cache", lambda: ResponseCache(MemoryCache(), change_log._get_current_object()))
+
+def cached(scopes):
+    """
+    Decorator caching a GET view in the response cache of the current app,
+    see ResponseCache.cached.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            return response_cache.respond(f, scopes, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+from sqlalchemy import event, select, delete, func
+from sqlalchemy.orm import Session
+from models import db
+from models import Change
+from state import app_local, has_state
+
+# Changes kept for the processes that poll late, the older ones are pruned.
+KEEP_CHANGES = 10_000
+PRUNE_EVERY = 1_000
+# Seconds a missing id is waited for before it is taken for a rolled back
+# change, longer than a transaction holds a change before its commit.
+GAP_WAIT = float(os.environ.get("CHANGE_GAP_WAIT", 10))
+
+class ChangeLog:
+    """
+    Generations shared by the worker and CLI processes, through the changes table.
+
+    A writer records the scopes it changed in its own transaction, see
+    record(). Every process reads the new changes at most every poll seconds
+    and bumps the generations of their scopes, so its caches and in-process
+    indexes see the writes of the others. The process that wrote a change
+    applies it as soon as it commits.
+
+    Change ids are auto-incremented, so writers never wait for each other,
+    but a lower id may commit after a higher one. The scopes of a change are
+    applied as soon as it is read. Changes with a kind are live updates,
+    passed in id order to the subscribe() listeners: the ones read past a
+    missing id wait until it commits, or for GAP_WAIT seconds if it never
+    does. stable_id() is the id up to which every change was passed on.
+
+    With poll <= 0 the table is never read, for a single process. The live
+    updates are then passed on at commit.
+    """
+
+    def __init__(self, poll: float = 1.0):
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._checked = None
+        # Every change up to this id was read, None before the first poll.
+        self._seen = None
+        # {change id: (kind, data)} read past a missing id.
+        self._pending = {}
+        # {missing id: monotonic time it was first missed}
+        self._gaps = {}
+        # Bumped on every change applied, the generations take its value.
+        self._clock = 0
+        # {scope: clock of its last change}
+        self._generations = {}
+        # {scope: number of changes written by the other processes}
+        self._foreign = {}
+        # Ids committed by this process and not read back yet.
+        self._own = set()
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """
+        Calls listener(change_id, kind, data) for every live update.
+        """
+
+        self._listeners.append(listener)
+
+    def _notify(self, change_id: int, kind: str, data: str):
+        for listener in self._listeners:
+            listener(change_id, kind, data)
+
+    def reset(self):
+        """
+        Forgets the changes seen, for a database created again from scratch.
+        """
+
+        with self._lock:
+            self._checked = None
+            self._seen = None
+            self._pending = {}
+            self._gaps = {}
+            self._generations = {}
+            self._foreign = {}
+            self._own = set()
+
+    def record(self, *scopes, kind: str = None, data: str = None) -> int:
+        """
+        Adds a change of scopes to the session's transaction, with a single
+        INSERT. The caller commits.
+
+        Args:
+            kind, data = the live update of the change, None for none.
+
+        Returns:
+            The id of the change.
+        """
+
+        change_id = db.session.execute(Change.__table__.insert().values(
+            scopes = ",".join(scopes), kind = kind, data = data
+        )).inserted_primary_key[0]
+        if change_id % PRUNE_EVERY == 0:
+            db.session.execute(delete(Change).where(Change.id <= change_id - KEEP_CHANGES))
+
+        db.session.info.setdefault("changes", []).append((change_id, scopes, kind, data))
+        return change_id
+
+    def _bump(self, scopes, foreign: bool):
+        self._clock += 1
+        for scope in scopes:
+            self._generations[scope] = self._clock
+            if foreign:
+                self._foreign[scope] = self._foreign.get(scope, 0) + 1
+
+    def _committed(self, session):
+        changes = session.info.pop("changes", None)
+        if not changes:
+            return
+
+        with self._lock:
+            for change_id, scopes, _, _ in changes:
+                self._own.add(change_id)
+                self._bump(scopes, foreign = False)
+        if self.poll <= 0:
+            for change_id, _, kind, data in changes:
+                if kind is not None:
+                    self._notify(change_id, kind, data)
+
+    def _rolled_back(self, session):
+        session.info.pop("changes", None)
+
+    def _advance(self, now: float) -> list:
+        # Moves _seen over the changes read and the missing ids waited for
+        # long enough. Returns the live updates passed, in id order.
+        updates = []
+        if self._pending:
+            for missing in range(self._seen + 1, max(self._pending)):
+                if missing not in self._pending:
+                    self._gaps.setdefault(missing, now)
+
+        while self._pending:
+            next_id = self._seen + 1
+            if next_id in self._pending:
+                kind, data = self._pending.pop(next_id)
+                if kind is not None:
+                    updates.append((next_id, kind, data))
+            elif now - self._gaps[next_id] < GAP_WAIT:
+                break
+            self._gaps.pop(next_id, None)
+            self._seen = next_id
+        return updates
+
+    def refresh(self):
+        """
+        Reads the changes of the other processes, if the last poll is older than poll seconds.
+        """
+
+        if self.poll <= 0:
+            return
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.poll:
+            return
+        # One thread polls, the others go on with the generations they have.
+        if not self._poll_lock.acquire(blocking = False):
+            return
+
+        try:
+            self._checked = now
+            with db.engine.connect() as connection:
+                if self._seen is None:
+                    self._seen = connection.execute(select(func.max(Change.id))).scalar() or 0
+                    return
+                rows = [
+                    row for row in connection.execute(
+                        select(Change.id, Change.scopes, Change.kind, Change.data)
+                            .where(Change.id > self._seen).order_by(Change.id)
+                    ).all()
+                    if row.id not in self._pending
+                ]
+                pruned = None
+                if rows and rows[0].id > self._seen + 1 and not self._pending:
+                    oldest = connection.execute(select(func.min(Change.id))).scalar()
+                    if oldest > self._seen + 1:
+                        pruned = oldest - 1
+
+            with self._lock:
+                if pruned is not None:
+                    # Pruned before this process read them, anything may have changed.
+                    self._bump(["all"], foreign = True)
+                    self._seen = pruned
+                for row in rows:
+                    if row.id in self._own:
+                        # Applied at its commit already.
+                        self._own.discard(row.id)
+                    else:
+                        self._bump([scope for scope in row.scopes.split(",") if scope], foreign = True)
+                    self._pending[row.id] = (row.kind, row.data)
+                updates = self._advance(now)
+                self._own = {change_id for change_id in self._own if change_id > self._seen}
+
+            for update in updates:
+                self._notify(*update)
+        finally:
+            self._poll_lock.release()
+
+    def stable_id(self) -> int:
+        """
+        Returns the id up to which every live update was passed on, reading
+        the database when it is not polled.
+        """
+
+        if self.poll <= 0 or self._seen is None:
+            return db.session.query(func.max(Change.id)).scalar() or 0
+        return self._seen
+
+    def generation(self, scope: str) -> int:
+        """
+        Returns a number that changes with every change of a scope, 0 if none was seen.
+        """
+
+        self.refresh()
+        return self._generations.get(scope, 0)
+
+    def foreign_generation(self, scope: str) -> int:
+        """
+        Returns the number of changes of a scope, or of "all", written by the
+        other processes. For the in-process indexes, which apply the writes
+        of their own process themselves.
+        """
+
+        self.refresh()
+        return self._foreign.get(scope, 0) + self._foreign.get("all", 0)
+
+def live_updates_after(after: int, limit: int = 500) -> dict:
+    """
+    Reads the live updates that followed a change id, for clients polling
+    /events/changes or resuming a stream.
+
+    Only the changes up to change_log.stable_id() are returned, a later one
+    may still be followed by a lower id that commits after it.
+
+    Returns:
+        {"last_id": int, "changes": [(id, kind, data)], "reload": bool},
+        reload being True when some of them were pruned already. last_id is
+        the id to continue after.
+    """
+
+    change_log.refresh()
+    last_id = change_log.stable_id()
+    if after is None or after >= last_id:
+        return {"last_id": last_id, "changes": [], "reload": after is not None and after > last_id}
+
+    oldest = db.session.query(func.min(Change.id)).scalar()
+    if oldest is None or after < oldest - 1:
+        return {"last_id": last_id, "changes": [], "reload": True}
+
+    rows = db.session.query(Change.id, Change.kind, Change.data)\
+        .filter(Change.id > after, Change.id <= last_id, Change.kind.isnot(None))\
+        .order_by(Change.id).limit(limit).all()
+    if len(rows) == limit:
+        last_id = rows[-1].id
+    return {"last_id": last_id, "changes": [tuple(row) for row in rows], "reload": False}
+
+change_log = app_local("change_log", lambda: ChangeLog(poll = float(os.environ.get("GENERATION_POLL", 1))))
+
+def _committed(session):
+    if has_state():
+        change_log._committed(session)
+
+def _rolled_back(session):
+    if has_state():
+        change_log._rolled_back(session)
+
+event.listen(Session, "after_commit", _committed)
+event.listen(Session, "after_rollback", _rolled_back)
@@ -0,0 +1,241 @@
+"""
+Compact columnar encoding of the event feed.
+
+Instead of one JSON object per event, every field is sent as a typed array
+with one value per event. Coordinates are packed float32 pairs, times are
+int64 epoch seconds, colors are indexes into a palette and the stats are integers
+(percentages and the mean age in tenths).
+
+Layout:
+    b"FFC1", uint32 header length, the JSON header, padding to 8 bytes,
+    then the column buffers, each starting on a multiple of 8 bytes.
+
+The header lists the columns as {"name", "type", "offset", "length"},
+offset being relative to the end of the padding and length in values, and
+holds the string columns (title, description), the color palette, the
+geometry type names and the age bucket labels. Little endian throughout.
+
+Geometries are nested as event -> parts -> rings -> coordinates:
+geometry_parts has the part count of each event, part_rings the ring count
+of each part and ring_coords the coordinate count of each ring. Points and
+line strings are one part with one ring, a MultiLineString has one part per
+line. Events only have the types of models.GEOMETRY_TYPES, the writers
+reject the others.
+"""
+import json
+from datetime import datetime, timezone
+import numpy as np
+from flask import request, jsonify, Response
+from raw_json import RawJSON
+from models import GEOMETRY_TYPES
+
+MIMETYPE = "application/vnd.fairfinder.columns"
+MAGIC = b"FFC1"
+ALIGN = 8
+
+# Fields sent in tenths, as integers.
+TENTHS = ("ageAvg", "malePerc", "femalePerc", "notPerc")
+COUNTS = ("going", "not_going", "interested")
+TIMES = ("start_time", "end_time", "created_at")
+
+_TYPE_NAMES = {
+    np.dtype("<i8"): "int64",
+    np.dtype("<i4"): "int32",
+    np.dtype("<u4"): "uint32",
+    np.dtype("<u2"): "uint16",
+    np.dtype("u1"): "uint8",
+    np.dtype("<f4"): "float32"
+}
+
+def _epoch(value: str) -> int:
+    # Naive times are sent as they are stored, the client reads them back as naive.
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo = timezone.utc)
+    return int(moment.timestamp())
+
+def _geometry(geometry) -> dict:
+    if isinstance(geometry, RawJSON):
+        return json.loads(geometry.text)
+    return geometry
+
+def _parts(geometry: dict) -> list:
+    """
+    Returns the geometry as parts -> rings -> coordinates.
+    """
+
+    kind, coordinates = geometry["type"], geometry["coordinates"]
+    if kind == "Point":
+        return [[[coordinates]]]
+    if kind == "LineString":
+        return [[coordinates]]
+    if kind == "Polygon":
+        return [coordinates]
+    if kind == "MultiPoint":
+        return [[[point]] for point in coordinates]
+    if kind == "MultiLineString":
+        return [[line] for line in coordinates]
+    if kind == "MultiPolygon":
+        return coordinates
+    raise ValueError(f"Unsupported geometry type: {kind}")
+
+def encode(events: list) -> bytes:
+    """
+    Encodes the event dicts of the feed (see build_feed).
+    """
+
+    palette = {}
+    age_labels = list(events[0]["age_distribution"]) if events else []
+
+    geometry_types = []
+    geometry_parts = []
+    part_rings = []
+    ring_coords = []
+    coords = []
+    for event in events:
+        geometry = _geometry(event["geometry"])
+        parts = _parts(geometry)
+        geometry_types.append(GEOMETRY_TYPES.index(geometry["type"]))
+        geometry_parts.append(len(parts))
+        for rings in parts:
+            part_rings.append(len(rings))
+            for ring in rings:
+                ring_coords.append(len(ring))
+                for coordinate in ring:
+                    coords.extend(coordinate[:2])
+
+    columns = {
+        "id": np.array([event["id"] for event in events], "<i4"),
+        "owner_id": np.array([event["owner_id"] for event in events], "<i4"),
+        **{
+            field: np.array([_epoch(event[field]) for event in events], "<i8")
+            for field in TIMES
+        },
+        "color": np.array([palette.setdefault(event["color"], len(palette)) for event in events], "<u2"),
+        "geometry_type": np.array(geometry_types, "u1"),
+        "geometry_parts": np.array(geometry_parts, "<u4"),
+        "part_rings": np.array(part_rings, "<u4"),
+        "ring_coords": np.array(ring_coords, "<u4"),
+        "coords": np.array(coords, "<f4"),
+        **{field: np.array([event[field] for event in events], "<i4") for field in COUNTS},
+        **{
+            field: np.rint(np.array([event[field] for event in events], np.float64) * 10).astype("<i4")
+            for field in TENTHS
+        },
+        # Row major, one row of len(age_labels) counts per event.
+        "age_distribution": np.array(
+            [[event["age_distribution"][label] for label in age_labels] for event in events], "<i4"
+        ).reshape(-1)
+    }
+
+    specs = []
+    buffers = []
+    offset = 0
+    for name, values in columns.items():
+        specs.append({"name": name, "type": _TYPE_NAMES[values.dtype], "offset": offset, "length": int(values.size)})
+        data = values.tobytes()
+        padding = -len(data) % ALIGN
+        buffers.append(data + b"\0" * padding)
+        offset += len(data) + padding
+
+    header = json.dumps({
+        "count": len(events),
+        "columns": specs,
+        "title": [event["title"] for event in events],
+        "description": [event["description"] for event in events],
+        "palette": list(palette),
+        "geometry_types": GEOMETRY_TYPES,
+        "age_labels": age_labels,
+        "tenths": TENTHS
+    }, separators = (",", ":")).encode()
+
+    prefix = MAGIC + len(header).to_bytes(4, "little") + header
+    return prefix + b"\0" * (-len(prefix) % ALIGN) + b"".join(buffers)
+
+def _geometry_from_parts(kind: str, parts: list) -> dict:
+    if kind == "Point":
+        return {"type": kind, "coordinates": parts[0][0][0]}
+    if kind == "LineString":
+        return {"type": kind, "coordinates": parts[0][0]}
+    if kind == "Polygon":
+        return {"type": kind, "coordinates": parts[0]}
+    if kind == "MultiPoint":
+        return {"type": kind, "coordinates": [rings[0][0] for rings in parts]}
+    if kind == "MultiLineString":
+        return {"type": kind, "coordinates": [rings[0] for rings in parts]}
+    return {"type": kind, "coordinates": parts}
+
+def decode(data: bytes) -> list:
+    """
+    Reads back the events of encode(), as the client does (see
+    frontend/src/app/services/event-columns.ts). Times are naive ISO
+    strings to the second, coordinates float32 precise.
+    """
+
+    if data[:4] != MAGIC:
+        raise ValueError(f"Unknown feed format: {data[:4]!r}")
+    header_length = int.from_bytes(data[4:8], "little")
+    header = json.loads(data[8:8 + header_length])
+    base = 8 + header_length + (-(8 + header_length) % ALIGN)
+    dtypes = {name: dtype for dtype, name in _TYPE_NAMES.items()}
+    columns = {
+        spec["name"]: np.frombuffer(
+            data, dtypes[spec["type"]], spec["length"], base + spec["offset"]
+        ).tolist()
+        for spec in header["columns"]
+    }
+
+    age_count = len(header["age_labels"])
+    parts_iter = iter(columns["part_rings"])
+    rings_iter = iter(columns["ring_coords"])
+    coords = columns["coords"]
+    coord = 0
+    events = []
+    for i in range(header["count"]):
+        parts = []
+        for _ in range(columns["geometry_parts"][i]):
+            rings = []
+            for _ in range(next(parts_iter)):
+                count = next(rings_iter)
+                rings.append([[coords[2 * c], coords[2 * c + 1]] for c in range(coord, coord + count)])
+                coord += count
+            parts.append(rings)
+
+        event = {
+            "id": columns["id"][i],
+            "owner_id": columns["owner_id"][i],
+            "title": header["title"][i],
+            "description": header["description"][i],
+            **{
+                field: datetime.fromtimestamp(columns[field][i], timezone.utc).replace(tzinfo = None).isoformat()
+                for field in TIMES
+            },
+            "geometry": _geometry_from_parts(header["geometry_types"][columns["geometry_type"][i]], parts),
+            "color": header["palette"][columns["color"][i]],
+            **{field: columns[field][i] for field in COUNTS},
+            **{field: columns[field][i] / 10 for field in header["tenths"]},
+            "age_distribution": {
+                label: columns["age_distribution"][i * age_count + k] for k, label in enumerate(header["age_labels"])
+            }
+        }
+        events.append(event)
+    return events
+
+def wants_columns() -> bool:
+    """
+    Returns True if the client prefers the columnar encoding to JSON.
+    """
+
+    return request.accept_mimetypes.best_match(["application/json", MIMETYPE]) == MIMETYPE
+
+def feed_response(events: list):
+    """
+    Returns the feed as JSON or in the columnar encoding, as negotiated with the Accept header.
+    """
+
+    if wants_columns():
+        response = Response(encode(events), mimetype = MIMETYPE)
+    else:
+        response = jsonify(events)
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,147 @@
+"""
+Columnar participant statistics with NumPy.
+
+Participants are given as parallel arrays (the event of each row as an
+index into the events, gender codes, birthdays as day ordinals and an
+optional weight when rows are already grouped), and the counts of every
+event are computed at once with bincount instead of a Python loop per
+participant.
+
+Missing genders count as "N". Participants with a missing birthday are
+counted, but are in no age bucket and not in the mean age.
+"""
+from datetime import date
+import numpy as np
+
+GENDERS = ("M", "F", "N")
+GENDER_CODES = {gender: code for code, gender in enumerate(GENDERS)}
+# Lower bound of each age bucket, the last one is open ended. Younger participants are in no bucket.
+AGE_EDGES = (18, 25, 35, 45)
+
+# The ordinal of a missing birthday, date ordinals start at 1.
+MISSING_BIRTHDAY = 0
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def gender_codes(genders) -> np.ndarray:
+    """
+    Unknown or missing genders count as "N".
+    """
+
+    return np.fromiter((GENDER_CODES.get(gender, GENDER_CODES["N"]) for gender in genders), np.intp, len(genders))
+
+def birthday_ordinals(birthdays) -> np.ndarray:
+    """
+    Missing birthdays are MISSING_BIRTHDAY.
+    """
+
+    return np.fromiter(
+        (MISSING_BIRTHDAY if birthday is None else birthday.toordinal() for birthday in birthdays),
+        np.int64, len(birthdays)
+    )
+
+def exact_ages(ordinals: np.ndarray, today: date = None) -> np.ndarray:
+    """
+    Returns the age in whole years on today, the birthday counting from its date.
+    """
+
+    today = today or date.today()
+    days = (np.asarray(ordinals, np.int64) - _EPOCH_ORDINAL).astype("datetime64[D]")
+    years = days.astype("datetime64[Y]").astype(np.int64) + 1970
+    months = days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    month_days = (days - days.astype("datetime64[M]")).astype(np.int64) + 1
+    not_yet = today.month * 100 + today.day < months * 100 + month_days
+    return today.year - years - not_yet
+
+def floor_ages(ordinals: np.ndarray, today: date = None) -> np.ndarray:
+    """
+    Returns the age as whole 365 day years lived on today, the one the
+    mean age of the event stats averages.
+    """
+
+    today = today or date.today()
+    return (today.toordinal() - np.asarray(ordinals, np.int64)) // 365
+
+def age_buckets(ages: np.ndarray, edges: tuple = AGE_EDGES) -> np.ndarray:
+    """
+    Returns the bucket index of each age, -1 below the first edge.
+    """
+
+    return np.searchsorted(np.asarray(edges), ages, side = "right") - 1
+
+def grouped_counts(groups: np.ndarray, codes: np.ndarray, group_count: int, code_count: int,
+                   weights: np.ndarray = None) -> np.ndarray:
+    """
+    Counts the rows of each (group, code) pair. Rows with a negative code are skipped.
+
+    Returns:
+        A group_count x code_count array.
+    """
+
+    keep = codes >= 0
+    flat = np.bincount(
+        groups[keep] * code_count + codes[keep],
+        weights = None if weights is None else weights[keep],
+        minlength = group_count * code_count
+    )
+    return flat.reshape(group_count, code_count).astype(np.int64)
+
+def aggregate(groups: np.ndarray, genders: np.ndarray, birthdays: np.ndarray, group_count: int,
+              weights: np.ndarray = None, edges: tuple = AGE_EDGES, today: date = None) -> dict:
+    """
+    Computes the demographics of many groups (events) in one pass.
+
+    Args:
+        groups = the group index of each row, in range(group_count).
+
+        genders = gender codes, see gender_codes().
+
+        birthdays = day ordinals, see birthday_ordinals().
+
+        weights = the number of participants of each row, 1 by default.
+
+    Returns:
+        {"count": (groups,), "genders": (groups, len(GENDERS)),
+         "ages": (groups, len(edges)), "age_sum": (groups,) of floor_ages(),
+         "aged": (groups,) the count of participants with a birthday}
+    """
+
+    groups = np.asarray(groups, np.intp)
+    weight_values = np.ones(len(groups), np.int64) if weights is None else np.asarray(weights, np.int64)
+    birthdays = np.asarray(birthdays, np.int64)
+    aged_weights = np.where(birthdays != MISSING_BIRTHDAY, weight_values, 0)
+
+    return {
+        "count": np.bincount(groups, weights = weight_values, minlength = group_count).astype(np.int64),
+        "genders": grouped_counts(groups, np.asarray(genders, np.intp), group_count, len(GENDERS), weight_values),
+        "ages": grouped_counts(
+            groups,
+            np.where(aged_weights > 0, age_buckets(exact_ages(birthdays, today), edges), -1),
+            group_count, len(edges), weight_values
+        ),
+        # bincount sums in float64, exact for integers below 2 ** 53.
+        "age_sum": np.bincount(
+            groups, weights = floor_ages(birthdays, today) * aged_weights, minlength = group_count
+        ).astype(np.int64),
+        "aged": np.bincount(groups, weights = aged_weights, minlength = group_count).astype(np.int64)
+    }
+
+def summarize(count: np.ndarray, gender_counts: np.ndarray, age_sum: np.ndarray, aged: np.ndarray = None) -> dict:
+    """
+    Mean age and gender percentages of many groups at once, 0 for empty groups.
+
+    Args:
+        age_sum = the sum of the floor_ages() of each group.
+
+        aged = the participants of each group age_sum is over, count by default.
+
+    Returns:
+        {"age_avg": (groups,), "gender_perc": (groups, len(GENDERS))}
+    """
+
+    count = np.asarray(count, np.float64)
+    safe = np.where(count > 0, count, 1)
+    aged = count if aged is None else np.asarray(aged, np.float64)
+    age_avg = np.where(aged > 0, np.round(np.asarray(age_sum, np.float64) / np.where(aged > 0, aged, 1), 1), 0)
+    gender_perc = np.where(count[:, None] > 0, np.round(gender_counts / safe[:, None] * 100, 1), 0)
+    return {"age_avg": age_avg, "gender_perc": gender_perc}
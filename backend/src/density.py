@@ -0,0 +1,165 @@
+import threading
+import numpy as np
+import shapely
+from models import db
+from models import Event, EventStats
+from event_stats import compute_counters
+from cache import MemoryCache, response_cache
+from changelog import change_log
+from state import app_local
+
+# Cells per tile side.
+GRID = 16
+MAX_ZOOM = 20
+MAX_TILES = 64
+
+class CentroidIndex:
+    """
+    Event centroids as NumPy arrays, reloaded lazily after event writes,
+    those of the other processes included (the "events" change log scope).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._generation = None
+
+    def invalidate(self):
+        with self._lock:
+            self._arrays = None
+
+    def arrays(self) -> tuple:
+        """
+        Returns (ids, lon, lat), sorted by id.
+        """
+
+        generation = change_log.foreign_generation("events")
+        with self._lock:
+            if self._arrays is not None and self._generation == generation:
+                return self._arrays
+
+            rows = db.session.query(Event.id, Event.geometry).order_by(Event.id).all()
+            ids = np.fromiter((row.id for row in rows), dtype = np.int64, count = len(rows))
+            centroids = shapely.centroid(shapely.from_wkb([bytes(row.geometry.data) for row in rows]))
+
+            self._arrays = (ids, shapely.get_x(centroids), shapely.get_y(centroids))
+            self._generation = generation
+            return self._arrays
+
+centroid_index = app_local("centroid_index", CentroidIndex)
+tile_cache = app_local("tile_cache", lambda: MemoryCache(max_entries = 4096, ttl = 300))
+
+def _weights(ids: np.ndarray) -> np.ndarray:
+    # Same popularity score as the map heatmap: 3 * going + interested, at least 1.
+    stats = {
+        event_id: (going, interested) for event_id, going, interested
+        in db.session.query(EventStats.event_id, EventStats.going, EventStats.interested)
+    }
+    missing = [int(event_id) for event_id in ids if int(event_id) not in stats]
+    if missing:
+        for event_id, counters in compute_counters(missing).items():
+            stats[event_id] = (counters["going"], counters["interested"])
+
+    going = np.fromiter((stats.get(int(event_id), (0, 0))[0] for event_id in ids), dtype = np.int64, count = len(ids))
+    interested = np.fromiter((stats.get(int(event_id), (0, 0))[1] for event_id in ids), dtype = np.int64, count = len(ids))
+    return np.maximum(1, 3 * going + interested).astype(np.float64)
+
+def tiles_for_bbox(bbox: tuple, zoom: int) -> list:
+    """
+    Returns the (x, y) tiles of a zoom level covering a lon/lat box.
+
+    Tiles split the lon/lat plane into 2^zoom columns of equal size.
+    """
+
+    size = 360.0 / 2 ** zoom
+    columns = 2 ** zoom
+    rows = max(1, columns // 2)
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    min_x = int(np.clip(np.floor((min_lon + 180) / size), 0, columns - 1))
+    max_x = int(np.clip(np.floor((max_lon + 180) / size), 0, columns - 1))
+    min_y = int(np.clip(np.floor((min_lat + 90) / size), 0, rows - 1))
+    max_y = int(np.clip(np.floor((max_lat + 90) / size), 0, rows - 1))
+
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+def bin_tiles(lon: np.ndarray, lat: np.ndarray, weights: np.ndarray, zoom: int, tiles: list) -> dict:
+    """
+    Bins points into the GRID x GRID cells of the given tiles in one pass.
+
+    Returns:
+        {(x, y): [cell dicts]} with an entry for every requested tile.
+    """
+
+    cell = 360.0 / 2 ** zoom / GRID
+    cells_per_row = 2 ** zoom * GRID
+    res = {tile: [] for tile in tiles}
+    if not len(lon):
+        return res
+
+    cell_x = np.floor((lon + 180) / cell).astype(np.int64)
+    cell_y = np.floor((lat + 90) / cell).astype(np.int64)
+    wanted = np.array([x * cells_per_row + y for x, y in tiles], dtype = np.int64)
+    mask = np.isin((cell_x // GRID) * cells_per_row + cell_y // GRID, wanted)
+    if not mask.any():
+        return res
+
+    cell_x, cell_y = cell_x[mask], cell_y[mask]
+    lon, lat, weights = lon[mask], lat[mask], weights[mask]
+
+    keys, inverse = np.unique(cell_x * cells_per_row + cell_y, return_inverse = True)
+    counts = np.bincount(inverse)
+    scores = np.bincount(inverse, weights = weights)
+    # Score weighted centroid of the events in the cell.
+    center_lon = np.bincount(inverse, weights = lon * weights) / scores
+    center_lat = np.bincount(inverse, weights = lat * weights) / scores
+
+    key_x = keys // cells_per_row
+    key_y = keys % cells_per_row
+    for pos in range(len(keys)):
+        tile = (int(key_x[pos] // GRID), int(key_y[pos] // GRID))
+        res[tile].append({
+            "lon": round(float(center_lon[pos]), 6),
+            "lat": round(float(center_lat[pos]), 6),
+            "count": int(counts[pos]),
+            "score": int(scores[pos])
+        })
+    return res
+
+def get_density(bbox: tuple, zoom: int) -> dict:
+    """
+    Returns the weighted event density of the tiles covering a lon/lat box.
+
+    Tiles are cached per zoom level until the next event or participation
+    write, of any process.
+
+    Raises:
+        ValueError if the box needs more than MAX_TILES tiles at this zoom.
+    """
+
+    tiles = tiles_for_bbox(bbox, zoom)
+    if len(tiles) > MAX_TILES:
+        raise ValueError(f"bbox too large for zoom {zoom}, it spans {len(tiles)} tiles (max {MAX_TILES}).")
+
+    generation = f"{response_cache.generation('all')}.{response_cache.generation('feed')}"
+    cells = {}
+    missing = []
+    for tile in tiles:
+        cached = tile_cache.get(f"{generation}/{zoom}/{tile[0]}/{tile[1]}")
+        if cached is None:
+            missing.append(tile)
+        else:
+            cells[tile] = cached
+
+    if missing:
+        ids, lon, lat = centroid_index.arrays()
+        binned = bin_tiles(lon, lat, _weights(ids), zoom, missing)
+        for tile, tile_cells in binned.items():
+            tile_cache.set(f"{generation}/{zoom}/{tile[0]}/{tile[1]}", tile_cells)
+        cells.update(binned)
+
+    return {
+        "zoom": zoom,
+        "cell_size": 360.0 / 2 ** zoom / GRID,
+        "cells": [cell for tile in tiles for cell in cells[tile]]
+    }
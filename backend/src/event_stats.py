@@ -0,0 +1,396 @@
+from datetime import date
+import numpy as np
+from sqlalchemy import func, update, bindparam, inspect
+from models import db
+from models import User, Event, Participation, EventStats
+import demographics
+
+STATUS_COUNTERS = {
+    "Going": "going",
+    "Not going": "not_going",
+    "Interested": "interested"
+}
+
+GENDER_COUNTERS = {
+    "M": "male",
+    "F": "female",
+    "N": "not_specified"
+}
+
+# (label in the event JSON, counter, min age, max age)
+AGE_BUCKETS = (
+    ("18-24", "age_18_24", 18, 24),
+    ("25-34", "age_25_34", 25, 34),
+    ("35-44", "age_35_44", 35, 44),
+    ("45+", "age_45_plus", 45, None)
+)
+
+AGE_EDGES = tuple(min_age for _, _, min_age, _ in AGE_BUCKETS)
+AGE_COUNTERS = [counter for _, counter, _, _ in AGE_BUCKETS]
+AGE_LABELS = [label for label, _, _, _ in AGE_BUCKETS]
+GENDER_COLUMNS = [GENDER_COUNTERS[gender] for gender in demographics.GENDERS]
+
+def empty_counters() -> dict:
+    return {counter: 0 for counter in EventStats.COUNTERS}
+
+def exact_age(birthday: date, today: date = None) -> int:
+    return int(demographics.exact_ages([birthday.toordinal()], today)[0])
+
+def age_bucket(age: int):
+    """
+    Returns the counter of the age bucket, None for participants under 18.
+    """
+
+    index = int(demographics.age_buckets(age, AGE_EDGES))
+    return AGE_COUNTERS[index] if index >= 0 else None
+
+def participant_bucket(user: User):
+    """
+    Returns the age counter an user is counted in when going to an event today.
+    """
+
+    return age_bucket(exact_age(user.birthday))
+
+def participant_age(user: User) -> int:
+    """
+    Returns the age an user is counted with in age_sum when going to an event
+    today, see demographics.floor_ages.
+    """
+
+    return int(demographics.floor_ages([user.birthday.toordinal()])[0])
+
+def demographic_delta(gender: str, age: int, bucket, sign: int) -> dict:
+    """
+    Returns the counter changes of adding (sign = 1) or removing (sign = -1)
+    a "Going" participant.
+
+    Args:
+        age, bucket = the age and age counter, the ones stored on the
+            participation when removing. bucket is None for participants
+            under 18.
+    """
+
+    delta = {
+        GENDER_COUNTERS.get(gender, "not_specified"): sign,
+        "age_sum": sign * (age or 0)
+    }
+    if bucket:
+        delta[bucket] = sign
+    return delta
+
+def _merge(delta: dict, other: dict) -> dict:
+    for counter, value in other.items():
+        delta[counter] = delta.get(counter, 0) + value
+    return delta
+
+def compute_counters(event_ids: list = None) -> dict:
+    """
+    Computes the counters from the participations with two grouped queries.
+
+    Args:
+        event_ids = the events to compute, None for every event.
+
+    Returns:
+        {event_id: counters} for the events that have participations.
+    """
+
+    counters = {}
+
+    status_query = db.session.query(
+        Participation.event_id,
+        Participation.status,
+        func.count(Participation.id)
+    )
+    going_query = db.session.query(
+        Participation.event_id,
+        User.gender,
+        User.birthday,
+        func.count(Participation.id)
+    ).join(User, Participation.user_id == User.id)\
+        .filter(Participation.status == "Going")
+
+    if event_ids is not None:
+        if not event_ids:
+            return counters
+        status_query = status_query.filter(Participation.event_id.in_(event_ids))
+        going_query = going_query.filter(Participation.event_id.in_(event_ids))
+
+    status_rows = status_query.group_by(Participation.event_id, Participation.status).all()
+    going_rows = going_query.group_by(Participation.event_id, User.gender, User.birthday).all()
+
+    for event_id, status, count in status_rows:
+        event_counters = counters.setdefault(event_id, empty_counters())
+        if status in STATUS_COUNTERS:
+            event_counters[STATUS_COUNTERS[status]] += count
+
+    if going_rows:
+        going_ids, groups = np.unique([row[0] for row in going_rows], return_inverse = True)
+        going = demographics.aggregate(
+            groups,
+            demographics.gender_codes([row[1] for row in going_rows]),
+            demographics.birthday_ordinals([row[2] for row in going_rows]),
+            len(going_ids),
+            weights = np.array([row[3] for row in going_rows], np.int64),
+            edges = AGE_EDGES
+        )
+        columns = {
+            **dict(zip(GENDER_COLUMNS, going["genders"].T)),
+            **dict(zip(AGE_COUNTERS, going["ages"].T)),
+            "age_sum": going["age_sum"]
+        }
+        for column, event_id in enumerate(going_ids.tolist()):
+            event_counters = counters.setdefault(event_id, empty_counters())
+            for counter, values in columns.items():
+                event_counters[counter] += int(values[column])
+
+    return counters
+
+def counters_to_dicts(counters: list) -> list:
+    """
+    Formats the counters of many events as the stats fields of the event
+    JSON, with one array pass over all of them.
+    """
+
+    if not counters:
+        return []
+
+    matrix = np.array(
+        [[event_counters[counter] for counter in EventStats.COUNTERS] for event_counters in counters], np.int64
+    )
+    column = {counter: matrix[:, index] for index, counter in enumerate(EventStats.COUNTERS)}
+    summary = demographics.summarize(
+        column["going"],
+        np.stack([column[counter] for counter in GENDER_COLUMNS], axis = 1),
+        column["age_sum"]
+    )
+    male_perc, female_perc, non_perc = summary["gender_perc"].T.tolist()
+
+    return [
+        {
+            "going": going,
+            "not_going": not_going,
+            "interested": interested,
+            "ageAvg": age_avg,
+            "malePerc": male,
+            "femalePerc": female,
+            "notPerc": non,
+            "age_distribution": dict(zip(AGE_LABELS, ages))
+        }
+        for going, not_going, interested, age_avg, male, female, non, ages in zip(
+            column["going"].tolist(), column["not_going"].tolist(), column["interested"].tolist(),
+            summary["age_avg"].tolist(), male_perc, female_perc, non_perc,
+            matrix[:, [EventStats.COUNTERS.index(counter) for counter in AGE_COUNTERS]].tolist()
+        )
+    ]
+
+def counters_to_dict(counters: dict) -> dict:
+    """
+    Formats the counters of an event as the stats fields of the event JSON.
+    """
+
+    return counters_to_dicts([counters])[0]
+
+def load_counters(events: list, all_events: bool = False) -> dict:
+    """
+    Reads the stored counters of events with one primary key lookup, computing
+    the ones of events that have no stats row yet.
+
+    Returns:
+        {event_id: counters}
+    """
+
+    query = EventStats.query
+    if not all_events:
+        if not events:
+            return {}
+        query = query.filter(EventStats.event_id.in_([event.id for event in events]))
+
+    counters = {row.event_id: row.to_counters() for row in query.all()}
+
+    missing = [event.id for event in events if event.id not in counters]
+    if missing:
+        counters.update(compute_counters(missing))
+    return counters
+
+def apply_delta(event_ids: list, delta: dict) -> int:
+    """
+    Adds delta to the counters of the events in a single UPDATE.
+
+    Returns:
+        The number of stats rows updated.
+    """
+
+    values = {
+        getattr(EventStats, counter): getattr(EventStats, counter) + value
+        for counter, value in delta.items() if value
+    }
+    if not values or not event_ids:
+        return 0
+
+    return EventStats.query.filter(EventStats.event_id.in_(event_ids))\
+        .update(values, synchronize_session = False)
+
+def status_change_delta(user: User, old_status, new_status, old_bucket = None, new_bucket = None,
+                        old_age = None, new_age = None) -> dict:
+    """
+    Returns the counter changes of a participation status change.
+
+    Args:
+        user = the participant, only read when one of the statuses is "Going".
+
+        old_status = the previous status, None for a new participation.
+
+        old_bucket, new_bucket = the age counter of the participation before
+            and after, see Participation.age_bucket.
+
+        old_age, new_age = the age of the participation before and after,
+            see Participation.age.
+    """
+
+    delta = {}
+    if old_status == new_status:
+        return delta
+
+    if old_status in STATUS_COUNTERS:
+        delta[STATUS_COUNTERS[old_status]] = -1
+        if old_status == "Going":
+            _merge(delta, demographic_delta(user.gender, old_age, old_bucket, -1))
+    if new_status in STATUS_COUNTERS:
+        _merge(delta, {STATUS_COUNTERS[new_status]: 1})
+        if new_status == "Going":
+            _merge(delta, demographic_delta(user.gender, new_age, new_bucket, 1))
+    return delta
+
+def apply_status_deltas(deltas: dict, rows: dict) -> dict:
+    """
+    Applies {event_id: delta} to the locked stats rows {event_id: EventStats}. The
+    caller flushes the participations first and commits.
+
+    Returns:
+        {event_id: counters} after the change, for every event of deltas.
+    """
+
+    counters = {}
+    missing = []
+    for event_id, delta in deltas.items():
+        row = rows.get(event_id)
+        if row is None:
+            missing.append(event_id)
+            continue
+        for counter, value in delta.items():
+            if value:
+                setattr(row, counter, getattr(row, counter) + value)
+        counters[event_id] = row.to_counters()
+
+    if missing:
+        # Events created before the stats table existed.
+        computed = compute_counters(missing)
+        for event_id in missing:
+            counters[event_id] = computed.get(event_id, empty_counters())
+            db.session.add(EventStats(event_id = event_id, **counters[event_id]))
+    return counters
+
+def record_user_change(user: User, old_gender: str, old_birthday: date):
+    """
+    Moves an user's demographics in the events they are going to,
+    after a gender or birthday edit. The caller commits.
+
+    Each participation leaves the age and age counter stored on it, which
+    are not the user's current ones once they had a birthday since.
+    """
+
+    if old_gender == user.gender and old_birthday == user.birthday:
+        return
+
+    by_age = {}
+    for event_id, bucket, age in db.session.query(Participation.event_id, Participation.age_bucket, Participation.age)\
+            .filter(Participation.user_id == user.id, Participation.status == "Going"):
+        by_age.setdefault((bucket, age), []).append(event_id)
+
+    new_bucket = participant_bucket(user)
+    new_age = participant_age(user)
+    for (old_bucket, old_age), event_ids in by_age.items():
+        delta = demographic_delta(old_gender, old_age, old_bucket, -1)
+        _merge(delta, demographic_delta(user.gender, new_age, new_bucket, 1))
+        apply_delta(event_ids, delta)
+
+    if by_age:
+        Participation.query.filter(Participation.user_id == user.id, Participation.status == "Going")\
+            .update({Participation.age_bucket: new_bucket, Participation.age: new_age}, synchronize_session = False)
+
+def reset_counters():
+    EventStats.query.update(
+        {getattr(EventStats, counter): 0 for counter in EventStats.COUNTERS},
+        synchronize_session = False
+    )
+
+def refresh_age_buckets() -> int:
+    """
+    Stores the current age and age counter on every "Going" participation,
+    as compute_counters counts them. The caller commits.
+
+    Databases older than migration 12 have no participations.age yet, only
+    the age counter is stored until that migration adds it.
+
+    Returns:
+        The number of users updated.
+    """
+
+    users = db.session.query(User.id, User.birthday)\
+        .filter(User.id.in_(db.session.query(Participation.user_id).filter(Participation.status == "Going")))\
+        .all()
+    if not users:
+        return 0
+
+    ordinals = demographics.birthday_ordinals([row.birthday for row in users])
+    buckets = demographics.age_buckets(demographics.exact_ages(ordinals), AGE_EDGES)
+    values = {"age_bucket": bindparam("bucket")}
+    if "age" in {column["name"] for column in inspect(db.engine).get_columns("participations")}:
+        values["age"] = bindparam("participant_age")
+    db.session.execute(
+        update(Participation.__table__)
+            .where(Participation.user_id == bindparam("participant"), Participation.status == "Going")
+            .values(**values),
+        [
+            {"participant": row.id, "bucket": AGE_COUNTERS[bucket] if bucket >= 0 else None, "participant_age": age}
+            for row, bucket, age in zip(users, buckets.tolist(), demographics.floor_ages(ordinals).tolist())
+        ]
+    )
+    return len(users)
+
+def rebuild_stats() -> dict:
+    """
+    Recomputes the counters of every event from the participations, and
+    the age counter stored on them.
+
+    Returns:
+        {"events": int, "created": [event_id], "drifted": {event_id: {counter: [stored, actual]}}}
+    """
+
+    actual = compute_counters()
+    stored = {row.event_id: row for row in EventStats.query.all()}
+
+    report = {"events": 0, "created": [], "drifted": {}}
+    for (event_id,) in db.session.query(Event.id).all():
+        report["events"] += 1
+        counters = actual.get(event_id, empty_counters())
+        row = stored.get(event_id)
+
+        if row is None:
+            db.session.add(EventStats(event_id = event_id, **counters))
+            report["created"].append(event_id)
+            continue
+
+        drift = {
+            counter: [value, counters[counter]]
+            for counter, value in row.to_counters().items()
+            if value != counters[counter]
+        }
+        if drift:
+            report["drifted"][event_id] = drift
+            for counter, value in counters.items():
+                setattr(row, counter, value)
+
+    refresh_age_buckets()
+    db.session.commit()
+    return report
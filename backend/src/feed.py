@@ -0,0 +1,39 @@
+from models import Event
+from event_stats import empty_counters, load_counters, counters_to_dicts
+
+def build_feed(events: list, all_events: bool = False, simplified: bool = False, counters: dict = None) -> list:
+    """
+    Serializes events together with their participation stats.
+
+    The stats are read from the event_stats table, so the number of queries
+    does not depend on the number of events.
+
+    Args:
+        events = the Event objects to serialize.
+
+        all_events = True if events holds the whole table, so the
+            stats lookup can skip the IN filter.
+
+        simplified = True for the low zoom geometries.
+
+        counters = {event_id: counters} already known, e.g. just written,
+            the other events are read.
+
+    Returns:
+        A list of event dicts.
+    """
+
+    counters = dict(counters or {})
+    unknown = [event for event in events if event.id not in counters]
+    if unknown:
+        counters.update(load_counters(unknown, all_events and not counters))
+    stats = counters_to_dicts([counters.get(event.id, empty_counters()) for event in events])
+
+    result = []
+    event: Event
+    for event, event_stats in zip(events, stats):
+        event_dict = event.to_dict(simplified)
+        event_dict.update(event_stats)
+        result.append(event_dict)
+
+    return result
@@ -0,0 +1,420 @@
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from shapely.geometry import shape
+from state import app_local
+
+ROUTE_URL = "https://route-api.arcgis.com/arcgis/rest/services/World/Route/NAServer/Route_World"
+GEOCODE_URL = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer"
+# 4 decimals are about 11 m, closer stops share their route.
+PRECISION = 4
+# Each route costs an upstream call, the map only asks for start and destination.
+MAX_STOPS = int(os.environ.get("GEO_MAX_STOPS", 2))
+MAX_LOCATIONS = 10
+EARTH_RADIUS_MILES = 3958.8
+
+class UpstreamError(Exception):
+    pass
+
+class Upstream:
+    """
+    Routing and geocoding service behind /geo.
+
+    Results are plain dicts, the same for every upstream:
+        route = {"paths": [[[lon, lat]]], "length": miles, "time": minutes,
+                 "directions": [{"text": str, "length": miles}]}
+
+        geocode = {"candidates": [{"address": str, "location": [lon, lat], "score": float}]}
+    """
+
+    def route(self, stops: list) -> dict:
+        raise NotImplementedError
+
+    def geocode(self, query: str, max_locations: int) -> dict:
+        raise NotImplementedError
+
+class ArcGISUpstream(Upstream):
+    """
+    The ArcGIS World Route and GeocodeServer REST services.
+    """
+
+    def __init__(self, api_key: str = "", route_url: str = ROUTE_URL, geocode_url: str = GEOCODE_URL,
+                 timeout: float = 10):
+        self.api_key = api_key
+        self.route_url = route_url
+        self.geocode_url = geocode_url
+        self.timeout = timeout
+
+    def _get(self, url: str, params: dict) -> dict:
+        params = {**params, "f": "json"}
+        if self.api_key:
+            params["token"] = self.api_key
+        try:
+            with urllib.request.urlopen(f"{url}?{urllib.parse.urlencode(params)}", timeout = self.timeout) as response:
+                data = json.load(response)
+        except (OSError, ValueError) as e:
+            raise UpstreamError(f"Upstream request failed: {e}")
+
+        if "error" in data:
+            raise UpstreamError(data["error"].get("message", "Upstream error"))
+        return data
+
+    def route(self, stops: list) -> dict:
+        data = self._get(f"{self.route_url}/solve", {
+            "stops": ";".join(f"{lon},{lat}" for lon, lat in stops),
+            "returnDirections": "true",
+            "directionsLengthUnits": "esriNAUMiles",
+            "outSR": 4326
+        })
+        features = data.get("routes", {}).get("features", [])
+        if not features:
+            raise UpstreamError("No route found")
+
+        directions = (data.get("directions") or [{}])[0]
+        summary = directions.get("summary", {})
+        return {
+            "paths": features[0]["geometry"]["paths"],
+            "length": summary.get("totalLength", 0),
+            "time": summary.get("totalTime", 0),
+            "directions": [
+                {"text": feature["attributes"]["text"], "length": feature["attributes"].get("length", 0)}
+                for feature in directions.get("features", [])
+            ]
+        }
+
+    def geocode(self, query: str, max_locations: int) -> dict:
+        data = self._get(f"{self.geocode_url}/findAddressCandidates", {
+            "SingleLine": query,
+            "maxLocations": max_locations,
+            "outFields": "Match_addr",
+            "outSR": 4326
+        })
+        return {"candidates": [
+            {
+                "address": candidate["address"],
+                "location": [candidate["location"]["x"], candidate["location"]["y"]],
+                "score": candidate.get("score", 0)
+            }
+            for candidate in data.get("candidates", [])[:max_locations]
+        ]}
+
+class StubUpstream(Upstream):
+    """
+    Offline upstream for tests and benchmarks: straight line routes and a
+    fixed gazetteer. Counts its calls.
+
+    Args:
+        places = {normalized query: (address, lon, lat)}
+    """
+
+    def __init__(self, places: dict = None, delay: float = 0):
+        self.places = places or {}
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+    def route(self, stops: list) -> dict:
+        self._call()
+        legs = [haversine_miles(a, b) for a, b in zip(stops, stops[1:])]
+        return {
+            "paths": [[list(stop) for stop in stops]],
+            "length": sum(legs),
+            # 30 mph.
+            "time": sum(legs) * 2,
+            "directions": [
+                {"text": f"Go to stop {number + 2}", "length": length} for number, length in enumerate(legs)
+            ]
+        }
+
+    def geocode(self, query: str, max_locations: int) -> dict:
+        self._call()
+        place = self.places.get(normalize_query(query))
+        if place is None:
+            return {"candidates": []}
+        address, lon, lat = place
+        return {"candidates": [{"address": address, "location": [lon, lat], "score": 100}]}
+
+def haversine_miles(a, b) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+
+def normalize_query(query: str) -> str:
+    """
+    Case, diacritics, punctuation and spacing do not change the geocoding key.
+    """
+
+    folded = "".join(
+        char for char in unicodedata.normalize("NFKD", query.casefold()) if not unicodedata.combining(char)
+    )
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", folded)).strip()
+
+def round_point(point, precision: int = PRECISION) -> tuple:
+    return (round(point[0], precision), round(point[1], precision))
+
+class GeoCache:
+    """
+    Persistent cache in a SQLite file, shared by the workers of a host.
+
+    Entries expire after ttl seconds. Expired entries are deleted and the
+    least recently used ones evicted above max_entries by one write in
+    1 / evict_probability, so the table may briefly hold a few more.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000, ttl: float = 7 * 24 * 3600,
+                 evict_probability: float = 0.01):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_probability = evict_probability
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            self._conn = sqlite3.connect(self.path, timeout = 5, check_same_thread = False, isolation_level = None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geo_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_geo_cache_used_at ON geo_cache (used_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_geo_cache_expires_at ON geo_cache (expires_at)")
+        return self._conn
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM geo_cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE geo_cache SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO geo_cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, separators = (",", ":")), now + self.ttl, now)
+            )
+            if random.random() < self.evict_probability:
+                self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM geo_cache WHERE expires_at <= ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM geo_cache").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM geo_cache WHERE key IN (SELECT key FROM geo_cache ORDER BY used_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM geo_cache").fetchone()[0]
+
+class Coalescer:
+    """
+    Runs one call per key at a time, concurrent callers of the same key wait
+    for it and share its result.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+class RateLimiter:
+    """
+    Token buckets per client address, of the /geo endpoints, which anyone
+    may call. Each address gets burst requests at once, then rate per
+    second. Counted per worker process.
+
+    Args:
+        max_keys = addresses tracked, the least recently seen are forgotten above it.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 30, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> float:
+        """
+        Takes a token of key.
+
+        Returns:
+            0 if the request may go on, else the seconds until the next token.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last = False)
+        return wait
+
+class GeoService:
+    """
+    Cached and coalesced routing and geocoding.
+
+    Routes from the origins (venue entrances, parkings, stations) to a new
+    event are computed in the background when it is created.
+    """
+
+    def __init__(self, upstream: Upstream, cache: GeoCache, origins: list = None):
+        self.upstream = upstream
+        self.cache = cache
+        self.origins = [round_point(origin) for origin in origins or []]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._coalescer = Coalescer()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix = "geo-precompute")
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lookup(self, key: str, fetch) -> tuple:
+        """
+        Returns:
+            (result, True if it came from the cache)
+        """
+
+        result = self.cache.get(key)
+        if result is not None:
+            self._count("hits")
+            return result, True
+
+        def load():
+            # Another worker may have stored it while this one waited.
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            value = fetch()
+            self.cache.set(key, value)
+            return value
+
+        self._count("misses")
+        return self._coalescer.run(key, load), False
+
+    def route(self, stops: list) -> tuple:
+        stops = [round_point(stop) for stop in stops]
+        key = "route:" + ";".join(f"{lon},{lat}" for lon, lat in stops)
+        return self._lookup(key, lambda: self.upstream.route(stops))
+
+    def geocode(self, query: str, max_locations: int = 1) -> tuple:
+        # The upstream gets the text as typed, it may rely on the punctuation and diacritics.
+        key = f"geocode:{max_locations}:{normalize_query(query)}"
+        return self._lookup(key, lambda: self.upstream.geocode(query, max_locations))
+
+    def precompute_event_routes(self, destination: tuple):
+        """
+        Queues the routes from every origin to an event's destination point.
+        """
+
+        for origin in self.origins:
+            self._executor.submit(self._precompute, [origin, destination])
+
+    def _precompute(self, stops: list):
+        try:
+            self.route(stops)
+        except UpstreamError:
+            # Computed on demand instead.
+            pass
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.cache)}
+
+def event_destination(geojson: str) -> tuple:
+    """
+    Returns the point routes to an event lead to, inside its polygon or on its line.
+    """
+
+    point = shape(json.loads(geojson)).representative_point()
+    return round_point((point.x, point.y))
+
+def parse_point(value: str) -> tuple:
+    """
+    Parses "lon,lat".
+
+    Raises:
+        ValueError if it is not a valid WGS84 point.
+    """
+
+    lon, lat = (float(part) for part in value.split(","))
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError(f"Invalid point: {value}")
+    return lon, lat
+
+def parse_origins(value: str) -> list:
+    return [parse_point(point) for point in value.split(";") if point.strip()]
+
+def make_upstream() -> Upstream:
+    if os.environ.get("GEO_UPSTREAM", "arcgis") == "stub":
+        return StubUpstream()
+    return ArcGISUpstream(api_key = os.environ.get("ARCGIS_API_KEY", ""))
+
+geo_service = app_local("geo_service", lambda: GeoService(
+    make_upstream(),
+    GeoCache(
+        os.environ.get("GEO_CACHE_PATH", "cache/geo.sqlite3"),
+        max_entries = int(os.environ.get("GEO_CACHE_MAX_ENTRIES", 100_000)),
+        ttl = float(os.environ.get("GEO_CACHE_TTL", 7 * 24 * 3600)),
+        evict_probability = float(os.environ.get("GEO_CACHE_EVICT_PROBABILITY", 0.01))
+    ),
+    parse_origins(os.environ.get("GEO_ROUTE_ORIGINS", ""))
+))
+
+geo_rate_limiter = app_local("geo_rate_limiter", lambda: RateLimiter(
+    rate = float(os.environ.get("GEO_RATE_PER_MINUTE", 60)) / 60,
+    burst = int(os.environ.get("GEO_RATE_BURST", 30))
+))
@@ -0,0 +1,50 @@
+"""
+Production server settings, run from backend/src:
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+
+The schema is not touched on startup, run `flask --app app init-db` on a new
+database and `flask --app app migrate` after upgrades.
+
+Every worker process opens its own connection pool, so the database must
+accept WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+
+Every worker calls create_app() and has its own app. The workers share
+nothing but the database (and the geo cache file of the host). Per worker:
+    - the response cache, the token cache and the search, nearest and
+      density indexes, so their memory is paid WEB_CONCURRENCY times. They
+      see the writes of the other workers through the change log, read
+      every GENERATION_POLL seconds: a worker may serve a stale response
+      for that long after a write made elsewhere.
+    - the live streams, at most LIVE_MAX_CLIENTS each.
+    - the password hashing threads, PASSWORD_HASH_WORKERS split between them.
+    - the participation group commit, which only merges the writes of one worker.
+    - the /metrics histograms.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8081")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Threads let a worker serve other clients while one waits on a slow query.
+# Every /events/stream client holds one of them (LIVE_MAX_CLIENTS per worker,
+# the others poll /events/changes). WORKER_CLASS=gevent serves many streams,
+# set LIVE_MAX_CLIENTS=0 with it.
+worker_class = os.environ.get("WORKER_CLASS", "gthread")
+threads = int(os.environ.get("THREADS", 4))
+# The workers size their password hashing from these, see passwords.py.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+os.environ["THREADS"] = str(threads)
+timeout = int(os.environ.get("TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+# Restart workers now and then to bound memory growth of the in-process caches.
+max_requests = int(os.environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get("ACCESS_LOG", "-") or None
+
+def post_fork(server, worker):
+    # With --preload the app and its pool were created in the master, the sockets must not be shared.
+    if server.cfg.preload_app:
+        from models import db
+        with server.app.wsgi().app_context():
+            db.engine.dispose(close = False)
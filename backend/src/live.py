@@ -0,0 +1,184 @@
+import os
+import queue
+import threading
+import time
+from flask import current_app
+from changelog import change_log
+from state import app_local
+
+HEARTBEAT = float(os.environ.get("LIVE_HEARTBEAT", 15))
+# Updates buffered per client before it is considered too slow and dropped.
+CLIENT_QUEUE = 256
+# Client reconnect delay in milliseconds.
+RETRY_MS = 3000
+
+class LiveHub:
+    """
+    Fans the live updates of the change log out to the connected
+    Server-Sent Events clients.
+
+    Updates are written with the change that causes them, so every worker
+    and CLI process reaches the clients of every worker. Their ids are the
+    change ids, the same in every process: a client reconnecting with
+    Last-Event-ID to any worker receives what it missed, or a "reload"
+    update if it was pruned. Clients that cannot hold a connection poll
+    /events/changes instead.
+
+    Kinds:
+        created = the new event, as in /get_events.
+
+        deleted = {"id": event_id}
+
+        participation = {"id": event_id, <stats fields of the event>}
+
+        reload = the client should download the events again.
+
+    Args:
+        max_clients = streams served at once by this process, None for no limit.
+            With the gthread worker each one holds a server thread.
+    """
+
+    def __init__(self, changes = change_log, max_clients: int = None):
+        self.changes = changes
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._clients = set()
+        self._app = None
+        self._thread = None
+        changes.subscribe(self._deliver)
+
+    def init_app(self, app):
+        self._app = app
+
+    def publish(self, kind: str, data: dict, *scopes) -> int:
+        """
+        Publishes an update in the caller's transaction. Call it before the
+        commit, the caller commits.
+
+        Args:
+            scopes = cache scopes the same change invalidates, see ResponseCache.invalidate.
+        """
+
+        return self.changes.record(*scopes, kind = kind, data = current_app.json.dumps(data, sort_keys = False))
+
+    def _start(self):
+        # Reads the change log while streams wait, requests may not come to do it.
+        with self._lock:
+            if self._thread is None and self._app is not None and self.changes.poll > 0:
+                self._thread = threading.Thread(target = self._run, name = "live-poll", daemon = True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.changes.poll)
+            if not self._clients:
+                continue
+            with self._app.app_context():
+                try:
+                    self.changes.refresh()
+                except Exception:
+                    # The database is back on the next round.
+                    pass
+
+    def _deliver(self, change_id: int, kind: str, data: str):
+        update = (change_id, kind, data)
+        with self._lock:
+            self._last_id = max(self._last_id, change_id)
+            clients = list(self._clients)
+
+        for client in clients:
+            try:
+                client.put_nowait(update)
+            except queue.Full:
+                # The stream notices it was dropped and tells the client to reload.
+                self._drop(client)
+
+    def _drop(self, client):
+        with self._lock:
+            self._clients.discard(client)
+        try:
+            client.put_nowait(None)
+        except queue.Full:
+            client.dropped = True
+
+    def subscribe(self):
+        """
+        Registers a client queue.
+
+        Returns:
+            The queue, None if max_clients streams are already served.
+        """
+
+        self._start()
+        client = queue.Queue(CLIENT_QUEUE)
+        client.dropped = False
+        with self._lock:
+            if self.max_clients is not None and len(self._clients) >= self.max_clients:
+                return None
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def stream(self, client, missed: dict = None):
+        """
+        Yields the Server-Sent Events of one subscribed client until it disconnects.
+
+        Args:
+            missed = changelog.live_updates_after the client's Last-Event-ID, None for a new client.
+        """
+
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            # The updates also queued since are skipped.
+            sent = 0
+            if missed is not None:
+                if missed["reload"]:
+                    yield format_event(missed["last_id"], "reload", "{}")
+                for update in missed["changes"]:
+                    yield format_event(*update)
+                sent = missed["last_id"]
+
+            while True:
+                try:
+                    update = client.get(timeout = HEARTBEAT)
+                except queue.Empty:
+                    # Keeps proxies from closing the idle connection.
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if update is None or client.dropped:
+                    yield format_event(self._last_id, "reload", "{}")
+                    return
+                if update[0] > sent:
+                    yield format_event(*update)
+        finally:
+            self.unsubscribe(client)
+
+def format_event(update_id: int, kind: str, data: str) -> str:
+    return f"id: {update_id}\nevent: {kind}\ndata: {data}\n\n"
+
+def parse_last_event_id(value) -> int:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+def max_live_clients():
+    """
+    Returns LIVE_MAX_CLIENTS, by default half the THREADS of a worker, None
+    when neither is set.
+    """
+
+    if "LIVE_MAX_CLIENTS" in os.environ:
+        return int(os.environ["LIVE_MAX_CLIENTS"]) or None
+    threads = int(os.environ.get("THREADS", 0))
+    return max(1, threads // 2) if threads else None
+
+live_hub = app_local("live_hub", lambda: LiveHub(change_log._get_current_object(), max_live_clients()))
@@ -0,0 +1,210 @@
+"""
+Versioned schema changes of existing databases.
+
+New databases get the whole schema from init-db, which marks every
+migration as applied. Older ones run `flask --app app migrate`, which
+applies the pending migrations in version order and records them in the
+schema_migrations table.
+
+A migration is never edited once released, changes go in a new one. Each
+one checks what exists first, so it can run on a database that already got
+part of the change by hand or from the older init-* commands.
+"""
+from sqlalchemy import inspect
+from models import db
+from models import Event, Participation, EventStats, ArchivedEvent, ArchivedParticipation, Change
+from models import SchemaMigration
+from spatial import upgrade_geometry_column
+from event_stats import rebuild_stats
+from utils import backfill_geojson
+
+class Migration:
+    def __init__(self, version: int, name: str, upgrade):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+
+def create_indexes(table: str, indexes: dict, kind: str = "") -> list:
+    """
+    Creates the missing ones of {index name: [columns]} on a table.
+
+    Args:
+        kind = "" for plain indexes, or FULLTEXT, SPATIAL...
+
+    Returns:
+        The names of the indexes created.
+    """
+
+    existing = {index["name"] for index in inspect(db.engine).get_indexes(table)}
+    created = []
+    for name, columns in indexes.items():
+        if name not in existing:
+            db.session.execute(db.text(f"CREATE {kind} INDEX {name} ON {table} ({', '.join(columns)})"))
+            created.append(name)
+    db.session.commit()
+    return created
+
+def drop_indexes(table: str, names: list) -> list:
+    """
+    Drops the existing ones of some indexes of a table.
+
+    Returns:
+        The names of the indexes dropped.
+    """
+
+    existing = {index["name"] for index in inspect(db.engine).get_indexes(table)}
+    dropped = []
+    for name in names:
+        if name in existing:
+            db.session.execute(db.text(
+                f"DROP INDEX {name} ON {table}" if db.engine.dialect.name == "mysql" else f"DROP INDEX {name}"
+            ))
+            dropped.append(name)
+    db.session.commit()
+    return dropped
+
+def add_columns(table, names: list) -> list:
+    """
+    Adds the missing ones of some nullable columns of a model table, with
+    the types of the model.
+
+    Returns:
+        The names of the columns added.
+    """
+
+    existing = {column["name"] for column in inspect(db.engine).get_columns(table.name)}
+    added = []
+    for name in names:
+        if name not in existing:
+            column_type = table.c[name].type.compile(dialect = db.engine.dialect)
+            db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+            added.append(name)
+    db.session.commit()
+    return added
+
+def create_tables(*tables):
+    for table in tables:
+        table.create(db.engine, checkfirst = True)
+
+def _events_indexes():
+    create_indexes("events", {
+        "ix_events_start_end": ["start_time", "end_time"],
+        "ix_events_owner_start": ["owner_id", "start_time"]
+    })
+    if db.engine.dialect.name == "mysql":
+        create_indexes("events", {"ix_events_fulltext": ["title", "description"]}, "FULLTEXT")
+
+def _events_spatial():
+    upgrade_geometry_column()
+
+def _participations_indexes():
+    create_indexes("participations", {
+        "ix_participations_event_status": ["event_id", "status", "user_id"],
+        "ix_participations_event": ["event_id"],
+        "ix_participations_user": ["user_id"]
+    })
+
+def _events_time_indexes():
+    create_indexes("events", {
+        "ix_events_start": ["start_time"],
+        "ix_events_end": ["end_time"]
+    })
+
+def _change_log():
+    # The clock table of the first change log, dropped again by migration 11.
+    db.session.execute(db.text("CREATE TABLE IF NOT EXISTS change_clock (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)"))
+    db.session.commit()
+    create_tables(Change.__table__)
+    # Tables made before the live updates were carried by the change log.
+    add_columns(Change.__table__, ["kind", "data"])
+
+def _events_geojson():
+    add_columns(Event.__table__, ["geojson", "geojson_simplified"])
+    backfill_geojson()
+
+def _participations_age_bucket():
+    # Filled by the rebuild of the next migration.
+    add_columns(Participation.__table__, ["age_bucket"])
+
+def _event_stats():
+    create_tables(EventStats.__table__)
+    rebuild_stats()
+
+def _archive_tables():
+    create_tables(ArchivedEvent.__table__, ArchivedParticipation.__table__)
+
+def _drop_events_start_index():
+    # The feed is ordered by (start_time, end_time, id), which ix_events_start_end gives.
+    drop_indexes("events", ["ix_events_start"])
+
+def _change_ids_autoincrement():
+    # Writers no longer take their change id from the single change_clock row.
+    if db.engine.dialect.name == "mysql":
+        db.session.execute(db.text("ALTER TABLE changes MODIFY id INTEGER NOT NULL AUTO_INCREMENT"))
+    db.session.execute(db.text("DROP TABLE IF EXISTS change_clock"))
+    db.session.commit()
+
+def _participant_ages():
+    # ageAvg is the mean of the floored ages, their sum replaces the one of the birthdays.
+    add_columns(Participation.__table__, ["age"])
+    add_columns(EventStats.__table__, ["age_sum"])
+    if "birthday_sum" in {column["name"] for column in inspect(db.engine).get_columns("event_stats")}:
+        db.session.execute(db.text("ALTER TABLE event_stats DROP COLUMN birthday_sum"))
+        db.session.commit()
+    rebuild_stats()
+
+MIGRATIONS = (
+    Migration(1, "events time, owner and full-text indexes", _events_indexes),
+    Migration(2, "events geometry in SRID 4326 with a spatial index", _events_spatial),
+    Migration(3, "participations event, status and user indexes", _participations_indexes),
+    Migration(4, "events start and end time indexes", _events_time_indexes),
+    Migration(5, "changes and change_clock tables", _change_log),
+    Migration(6, "events GeoJSON columns, backfilled", _events_geojson),
+    Migration(7, "participations age bucket", _participations_age_bucket),
+    Migration(8, "event_stats table, rebuilt from the participations", _event_stats),
+    Migration(9, "events and participations archive tables", _archive_tables),
+    Migration(10, "drop the events start time index", _drop_events_start_index),
+    Migration(11, "auto-incremented change ids, without change_clock", _change_ids_autoincrement),
+    Migration(12, "participations age and event_stats age_sum, rebuilt", _participant_ages),
+)
+
+def applied_versions() -> set:
+    SchemaMigration.__table__.create(db.engine, checkfirst = True)
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+def pending_migrations() -> list:
+    applied = applied_versions()
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+def _record(migration: Migration):
+    db.session.add(SchemaMigration(version = migration.version, name = migration.name))
+    db.session.commit()
+
+def migrate() -> list:
+    """
+    Applies the pending migrations, each one recorded as soon as it succeeds.
+
+    Returns:
+        The migrations applied.
+    """
+
+    applied = []
+    for migration in pending_migrations():
+        migration.upgrade()
+        _record(migration)
+        applied.append(migration)
+    return applied
+
+def is_empty() -> bool:
+    return not inspect(db.engine).get_table_names()
+
+def stamp() -> list:
+    """
+    Marks every migration as applied without running it, for databases
+    created from the current models.
+    """
+
+    pending = pending_migrations()
+    for migration in pending:
+        _record(migration)
+    return pending
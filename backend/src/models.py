@@ -1,16 +1,53 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Enum, UniqueConstraint
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
 from geoalchemy2 import Geometry
-from geoalchemy2.shape import to_shape
+from geoalchemy2 import functions as geo_func
+from geoalchemy2.shape import to_shape, from_shape
+from sqlalchemy.ext.compiler import compiles
+import shapely
 from shapely.geometry import mapping
 
 from datetime import datetime, timezone
+from raw_json import RawJSON
+from passwords import password_hasher
+from avatars import avatar_url, LARGE
 
 
 db = SQLAlchemy()
 
+# Event geometries are stored as WGS84 lon/lat.
+SRID = 4326
+
+# Tolerance in degrees (~50 m) of the low zoom geometry variant.
+SIMPLIFY_TOLERANCE = 0.0005
+
+# Geometry types of events, the ones the map draws and columnar encodes.
+GEOMETRY_TYPES = ("Point", "LineString", "Polygon", "MultiPoint", "MultiLineString", "MultiPolygon")
+
+# MySQL reads and writes SRID 4326 in lat/lon order by default, GeoJSON is lon/lat.
+@compiles(geo_func.ST_GeomFromEWKT, "mysql")
+def _mysql_geom_from_text(element, compiler, **kw):
+    return "ST_GeomFromText({}, {}, 'axis-order=long-lat')".format(
+        compiler.process(element.clauses, **kw), SRID)
+
+@compiles(geo_func.ST_AsEWKB, "mysql")
+def _mysql_as_binary(element, compiler, **kw):
+    return "ST_AsBinary({}, 'axis-order=long-lat')".format(
+        compiler.process(element.clauses, **kw))
+
+def geojson_variants(geom_shape) -> tuple:
+    """
+    Returns the GeoJSON of a geometry and of its low zoom simplification,
+    None for the latter if simplifying does not drop any vertex.
+    """
+
+    full = json.dumps(mapping(geom_shape))
+    simplified = geom_shape.simplify(SIMPLIFY_TOLERANCE, preserve_topology = True)
+    if shapely.get_num_coordinates(simplified) >= shapely.get_num_coordinates(geom_shape):
+        return full, None
+    return full, json.dumps(mapping(simplified))
+
 class TestTable(db.Model):
     __tablename__ = "test"
     id = db.Column(db.Integer, primary_key = True, autoincrement = True)
@@ -40,7 +77,7 @@ class User(db.Model):
     events = db.relationship("Event", back_populates = "owner", cascade = "all, delete-orphan")
     participations = db.relationship("Participation", back_populates = "user", cascade = "all, delete-orphan")
 
-    def to_dict(self):
+    def to_dict(self, avatar_size: int = LARGE):
         return {
             "id": self.id,
             "firstName": self.first_name,
@@ -50,14 +87,14 @@ class User(db.Model):
             "birthday": self.birthday.isoformat(),
             "gender": self.gender,
             "created_at": self.created_at.isoformat(),
-            "profilePicture": self.profile_picture
+            "profilePicture": avatar_url(self.profile_picture, avatar_size)
         }
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 class Event(db.Model):
     __tablename__ = "events"
@@ -71,14 +108,52 @@ class Event(db.Model):
     start_time = db.Column(db.DateTime, nullable = False)
     end_time = db.Column(db.DateTime, nullable = False)
     created_at = db.Column(db.DateTime, default = lambda: datetime.now(timezone.utc), nullable = False)
-    geometry = db.Column(Geometry(), nullable = False)
+    # Only needed by spatial queries, reads use the precomputed GeoJSON.
+    geometry = db.deferred(db.Column(
+        Geometry(geometry_type = "GEOMETRY", srid = SRID, spatial_index = True),
+        nullable = False
+    ))
+    geojson = db.Column(db.Text)
+    geojson_simplified = db.Column(db.Text)
     color = db.Column(db.String(9), nullable = False)
 
     owner = db.relationship("User", back_populates = "events")
     participations = db.relationship("Participation", back_populates = "event", cascade = "all, delete-orphan")
+    stats = db.relationship("EventStats", back_populates = "event", uselist = False, cascade = "all, delete-orphan")
 
-    def to_dict(self):
-        geom_geojson = mapping(to_shape(self.geometry))
+    __table_args__ = (
+        # Time window and status filters of the feed, and its (start_time, end_time, id) order.
+        db.Index("ix_events_start_end", "start_time", "end_time"),
+        # Past and "upcoming or ongoing" events, a range of end_time.
+        db.Index("ix_events_end", "end_time"),
+        # Events of an owner, by date.
+        db.Index("ix_events_owner_start", "owner_id", "start_time"),
+        # Text search, other databases use text_search.TextIndex.
+        db.Index("ix_events_fulltext", "title", "description", mysql_prefix = "FULLTEXT").ddl_if(dialect = "mysql"),
+    )
+
+    def set_geometry(self, geom_shape):
+        """
+        Sets the geometry together with its precomputed GeoJSON variants.
+        """
+
+        self.geometry = from_shape(geom_shape, srid = SRID)
+        self.geojson, self.geojson_simplified = geojson_variants(geom_shape)
+
+    def geometry_geojson(self, simplified: bool = False) -> dict:
+        if simplified and self.geojson_simplified:
+            return json.loads(self.geojson_simplified)
+        if self.geojson:
+            return json.loads(self.geojson)
+        # Rows not backfilled yet.
+        return mapping(to_shape(self.geometry))
+
+    def to_dict(self, simplified: bool = False):
+        geojson = self.geojson_simplified if simplified and self.geojson_simplified else self.geojson
+        if geojson:
+            geom_geojson = RawJSON(geojson)
+        else:
+            geom_geojson = mapping(to_shape(self.geometry))
 
         return {
             "id": self.id,
@@ -110,12 +185,23 @@ class Participation(db.Model):
         nullable = False,
         default = "Interested"
     )
+    # Age counter of event_stats the participant was counted in while "Going",
+    # so leaving takes them out of that one after a birthday.
+    age_bucket = db.Column(db.String(16), nullable = True)
+    # Age added to event_stats.age_sum while "Going", taken out again when leaving.
+    age = db.Column(db.SmallInteger, nullable = True)
 
     user = db.relationship("User", back_populates = "participations")
     event = db.relationship("Event", back_populates = "participations")
 
     __table_args__ = (
         UniqueConstraint('user_id', 'event_id', name='unique_user_event'),
+        # Status counts and "Going" participants of events (event_stats.compute_counters), from the index alone.
+        db.Index("ix_participations_event_status", "event_id", "status", "user_id"),
+        # Participants of an event by id. MySQL would drop its implicit foreign key index for the one above.
+        db.Index("ix_participations_event", "event_id"),
+        # Participations of an user by id, unique_user_event has them by event.
+        db.Index("ix_participations_user", "user_id"),
     )
 
     def to_dict(self):
@@ -125,3 +211,111 @@ class Participation(db.Model):
             "event_id": self.event_id,
             "status": self.status
         }
+
+class EventStats(db.Model):
+    """
+    Participation counters of an event, kept up to date on every write.
+
+    The demographic counters only cover "Going" participants. Ages and age
+    buckets are computed at write time and stored on the participation, which
+    leaves with the ones it entered. A participant who got older keeps their
+    old age until the next rebuild-stats run.
+    """
+    __tablename__ = "event_stats"
+    event_id = db.Column(
+        db.Integer,
+        db.ForeignKey("events.id", ondelete = "CASCADE"),
+        primary_key = True
+    )
+    going = db.Column(db.Integer, nullable = False, default = 0)
+    not_going = db.Column(db.Integer, nullable = False, default = 0)
+    interested = db.Column(db.Integer, nullable = False, default = 0)
+    male = db.Column(db.Integer, nullable = False, default = 0)
+    female = db.Column(db.Integer, nullable = False, default = 0)
+    not_specified = db.Column(db.Integer, nullable = False, default = 0)
+    age_18_24 = db.Column(db.Integer, nullable = False, default = 0)
+    age_25_34 = db.Column(db.Integer, nullable = False, default = 0)
+    age_35_44 = db.Column(db.Integer, nullable = False, default = 0)
+    age_45_plus = db.Column(db.Integer, nullable = False, default = 0)
+    # Sum of the ages in whole 365 day years (demographics.floor_ages), ageAvg = age_sum / going.
+    age_sum = db.Column(db.BigInteger, nullable = False, default = 0)
+
+    event = db.relationship("Event", back_populates = "stats")
+
+    COUNTERS = (
+        "going", "not_going", "interested",
+        "male", "female", "not_specified",
+        "age_18_24", "age_25_34", "age_35_44", "age_45_plus",
+        "age_sum"
+    )
+
+    def to_counters(self) -> dict:
+        return {counter: getattr(self, counter) or 0 for counter in self.COUNTERS}
+
+class ArchivedEvent(db.Model):
+    """
+    Finished events moved out of the events table by archive-events, with
+    their stats as they were when archived.
+    """
+    __tablename__ = "events_archive"
+    id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    owner_id = db.Column(db.Integer, nullable = False, index = True)
+    title = db.Column(db.String(40), nullable = False)
+    description = db.Column(db.String(300), nullable = False)
+    start_time = db.Column(db.DateTime, nullable = False)
+    end_time = db.Column(db.DateTime, nullable = False, index = True)
+    created_at = db.Column(db.DateTime, nullable = False)
+    geojson = db.Column(db.Text)
+    color = db.Column(db.String(9), nullable = False)
+    stats = db.Column(db.Text)
+    archived_at = db.Column(db.DateTime, default = lambda: datetime.now(timezone.utc), nullable = False)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "owner_id": self.owner_id,
+            "title": self.title,
+            "description": self.description,
+            "start_time": self.start_time.isoformat(),
+            "end_time": self.end_time.isoformat(),
+            "created_at": self.created_at.isoformat(),
+            "geometry": RawJSON(self.geojson) if self.geojson else None,
+            "color": self.color,
+            **(json.loads(self.stats) if self.stats else {})
+        }
+
+class ArchivedParticipation(db.Model):
+    __tablename__ = "participations_archive"
+    id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    user_id = db.Column(db.Integer, nullable = False, index = True)
+    event_id = db.Column(db.Integer, nullable = False, index = True)
+    status = db.Column(
+        Enum("Going", "Not going", "Interested", name="event_status"),
+        nullable = False
+    )
+
+class SchemaMigration(db.Model):
+    """
+    The migrations.MIGRATIONS applied to the database.
+    """
+    __tablename__ = "schema_migrations"
+    version = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    name = db.Column(db.String(100), nullable = False)
+    applied_at = db.Column(db.DateTime, default = lambda: datetime.now(timezone.utc), nullable = False)
+
+class Change(db.Model):
+    """
+    A write other processes must see, read by changelog.ChangeLog.
+
+    Ids are auto-incremented, writers do not wait for each other. They are
+    taken at insert time, so concurrent writers may commit them out of
+    order, and rolled back ones leave holes.
+    """
+    __tablename__ = "changes"
+    id = db.Column(db.Integer, primary_key = True, autoincrement = True)
+    # Comma separated cache scopes, see cache.ResponseCache.
+    scopes = db.Column(db.Text, nullable = False)
+    # Live update of the map clients, see live.LiveHub. None for cache only changes.
+    kind = db.Column(db.String(20))
+    data = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default = lambda: datetime.now(timezone.utc), nullable = False)
@@ -0,0 +1,227 @@
+import json
+import math
+import threading
+from datetime import datetime
+import numpy as np
+import shapely
+from shapely.geometry import Point, shape
+from models import db
+from models import Event
+from spatial import EARTH_RADIUS_M, radius_bbox, split_antimeridian, use_database_index, location_filter
+from changelog import change_log
+from state import app_local
+
+# Grid cell side in degrees, about 28 km of latitude.
+CELL_DEGREES = 0.25
+# First search radius in meters, multiplied by RADIUS_GROWTH until k events are found.
+START_RADIUS = 5_000
+RADIUS_GROWTH = 4
+MAX_K = 100
+# Half the circumference reaches every point of the sphere.
+MAX_RADIUS = math.pi * EARTH_RADIUS_M
+
+def haversine_many(lon: float, lat: float, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distances in meters from a lon/lat point to arrays of points.
+    """
+
+    phi1 = math.radians(lat)
+    phi2 = np.radians(lats)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(lons - lon)
+
+    a = np.sin(d_phi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def distances_m(lon: float, lat: float, geoms: np.ndarray) -> np.ndarray:
+    """
+    Distances in meters from a lon/lat point to the closest point of each geometry.
+    """
+
+    closest = np.empty((len(geoms), 2))
+    # A point is its own closest point, the others are 0 away when inside a polygon.
+    is_point = shapely.get_type_id(geoms) == shapely.GeometryType.POINT
+    closest[is_point] = shapely.get_coordinates(geoms[is_point])
+    if not is_point.all():
+        lines = shapely.shortest_line(geoms[~is_point], Point(lon, lat))
+        closest[~is_point] = shapely.get_coordinates(shapely.get_point(lines, 0))
+    return haversine_many(lon, lat, closest[:, 0], closest[:, 1])
+
+def _closest(ids: np.ndarray, start_times: np.ndarray, distances: np.ndarray, k: int) -> list:
+    # Closest first, the earliest start and then the id breaking ties.
+    order = np.lexsort((ids, start_times, distances))[:k]
+    return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+def _cell_range(bbox: tuple) -> tuple:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (
+        math.floor(min_lon / CELL_DEGREES), math.floor(min_lat / CELL_DEGREES),
+        math.floor(max_lon / CELL_DEGREES), math.floor(max_lat / CELL_DEGREES)
+    )
+
+class NearestIndex:
+    """
+    Grid of the upcoming events, for k nearest queries on databases without
+    a spatial index (SQLite in tests).
+
+    Every event is put in the cells its bounding box overlaps. Loaded lazily,
+    then kept up to date by add() and remove(), and reloaded after the event
+    writes of the other processes. Events that have started are dropped when
+    a query meets them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._generation = None
+        # {(cell x, cell y): {event_id}}
+        self._cells = {}
+        # {event_id: (geometry, start_time, cells)}
+        self._events = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._cells = {}
+            self._events = {}
+
+    def _load(self, now: datetime, generation: int):
+        if self._loaded and self._generation == generation:
+            return
+        self._cells = {}
+        self._events = {}
+
+        rows = db.session.query(Event.id, Event.geometry, Event.start_time).filter(Event.start_time > now).all()
+        geoms = shapely.from_wkb([bytes(row.geometry.data) for row in rows])
+        for row, geom in zip(rows, geoms):
+            self._add(row.id, geom, row.start_time)
+        self._loaded = True
+        self._generation = generation
+
+    def _add(self, event_id: int, geom, start_time: datetime):
+        min_x, min_y, max_x, max_y = _cell_range(geom.bounds)
+        cells = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(event_id)
+        self._events[event_id] = (geom, start_time, cells)
+
+    def _remove(self, event_id: int):
+        entry = self._events.pop(event_id, None)
+        if entry is None:
+            return
+
+        for cell in entry[2]:
+            ids = self._cells[cell]
+            ids.discard(event_id)
+            if not ids:
+                del self._cells[cell]
+
+    def add(self, event: Event):
+        """
+        Indexes a new event if it is upcoming. Does nothing before the first query.
+        """
+
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(event.id)
+            if event.start_time > datetime.now():
+                self._add(event.id, shape(json.loads(event.geojson)), event.start_time)
+
+    def remove(self, event_id: int):
+        with self._lock:
+            if self._loaded:
+                self._remove(event_id)
+
+    def _candidates(self, bbox: tuple) -> set:
+        found = set()
+        for part in split_antimeridian(bbox):
+            min_x, min_y, max_x, max_y = _cell_range(part)
+            if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self._cells):
+                # Wide searches go through the occupied cells only.
+                for (x, y), ids in self._cells.items():
+                    if min_x <= x <= max_x and min_y <= y <= max_y:
+                        found.update(ids)
+                continue
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    found.update(self._cells.get((x, y), ()))
+        return found
+
+    def query(self, lon: float, lat: float, k: int) -> list:
+        """
+        Returns the k upcoming events closest to a lon/lat point.
+
+        The search radius grows until it holds k events. Any event within the
+        radius is in the cells of its bounding box, so none is missed.
+
+        Returns:
+            [(event_id, distance in meters)], closest first.
+        """
+
+        now = datetime.now()
+        generation = change_log.foreign_generation("events")
+        with self._lock:
+            self._load(now, generation)
+            radius = START_RADIUS
+            # {event_id: distance} of the candidates of the smaller radiuses.
+            known = {}
+            while True:
+                ids = []
+                for event_id in self._candidates(radius_bbox(lon, lat, radius)):
+                    if self._events[event_id][1] > now:
+                        ids.append(event_id)
+                    else:
+                        self._remove(event_id)
+
+                new = [event_id for event_id in ids if event_id not in known]
+                if new:
+                    geoms = np.array([self._events[event_id][0] for event_id in new])
+                    known.update(zip(new, distances_m(lon, lat, geoms).tolist()))
+                distances = np.array([known[event_id] for event_id in ids], np.float64)
+                inside = distances <= radius
+                if np.count_nonzero(inside) >= k or radius >= MAX_RADIUS:
+                    break
+                radius *= RADIUS_GROWTH
+
+            ids = np.array(ids, np.int64)[inside]
+            distances = distances[inside]
+            start_times = np.array([self._events[event_id][1] for event_id in ids.tolist()], "datetime64[s]")
+
+        return _closest(ids, start_times, distances, k)
+
+nearest_index = app_local("nearest_index", NearestIndex)
+
+def _database_nearest(lon: float, lat: float, k: int) -> list:
+    # Same radius growth as NearestIndex.query, each round is one query on the spatial index.
+    now = datetime.now()
+    radius = START_RADIUS
+    while True:
+        query = db.session.query(Event.id, Event.geometry, Event.start_time).filter(Event.start_time > now)
+        rows = location_filter(query, center = (lon, lat), radius = radius).all()
+        distances = distances_m(lon, lat, shapely.from_wkb([bytes(row.geometry.data) for row in rows]))
+        inside = distances <= radius
+        if np.count_nonzero(inside) >= k or radius >= MAX_RADIUS:
+            break
+        radius *= RADIUS_GROWTH
+
+    rows = [row for row, keep in zip(rows, inside.tolist()) if keep]
+    return _closest(
+        np.array([row.id for row in rows], np.int64),
+        np.array([row.start_time for row in rows], "datetime64[s]"),
+        distances[inside],
+        k
+    )
+
+def search_nearest(lon: float, lat: float, k: int) -> list:
+    """
+    Returns the k upcoming events closest to a lon/lat point, with the
+    database spatial index or the in-process NearestIndex.
+
+    Returns:
+        [(event_id, distance in meters)], closest first.
+    """
+
+    if use_database_index():
+        return _database_nearest(lon, lat, k)
+    return nearest_index.query(lon, lat, k)
@@ -0,0 +1,192 @@
+import base64
+import bisect
+import json
+from datetime import datetime
+from flask import request, jsonify, Response, stream_with_context, current_app
+from models import db
+
+MAX_LIMIT = 1000
+RANKED_LIMIT = 20
+# Keyset of ranked hits, best first.
+RANK_KEYS = [db.literal_column("score", db.Float), db.literal_column("id", db.Integer)]
+STREAM_CHUNK = 500
+NDJSON = "application/x-ndjson"
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, keys: list) -> list:
+    """
+    Decodes a cursor into the keyset values of the last row sent.
+
+    Raises:
+        ValueError if the cursor is malformed.
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Invalid cursor.")
+
+    res = []
+    for key, value in zip(keys, values):
+        if isinstance(key.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        res.append(value)
+    return res
+
+def keyset_filter(query, keys: list, values: list):
+    # (k1, k2) > (v1, v2) written out, so MySQL can use a range scan.
+    clauses = []
+    for pos, key in enumerate(keys):
+        equal = [keys[prev] == values[prev] for prev in range(pos)]
+        clauses.append(db.and_(*equal, key > values[pos]))
+    return query.filter(db.or_(*clauses))
+
+def keyset_page(query, keys: list, values: list, limit: int) -> list:
+    """
+    Returns up to limit rows ordered by keys, after the row with the given values.
+    """
+
+    if values is not None:
+        query = keyset_filter(query, keys, values)
+    return query.order_by(*keys).limit(limit).all()
+
+def _row_values(row, keys: list) -> list:
+    return [getattr(row, key.key) for key in keys]
+
+def is_paginated() -> bool:
+    """
+    Returns True if the request asks for a page or a stream instead of the full list.
+    """
+
+    return "limit" in request.args or "cursor" in request.args or wants_ndjson()
+
+def wants_ndjson() -> bool:
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best == NDJSON
+
+def _iter_chunks(query, keys: list, values: list, limit: int, server_side: bool):
+    sent = 0
+    if server_side:
+        if values is not None:
+            query = keyset_filter(query, keys, values)
+        query = query.order_by(*keys)
+        if limit is not None:
+            query = query.limit(limit)
+
+        chunk = []
+        for row in query.yield_per(STREAM_CHUNK):
+            chunk.append(row)
+            if len(chunk) == STREAM_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+
+    # Serializers that run their own queries cannot share the connection with
+    # an open server-side cursor, so they are fed keyset pages instead.
+    while limit is None or sent < limit:
+        size = STREAM_CHUNK if limit is None else min(STREAM_CHUNK, limit - sent)
+        chunk = keyset_page(query, keys, values, size)
+        if not chunk:
+            return
+        yield chunk
+        sent += len(chunk)
+        values = _row_values(chunk[-1], keys)
+
+def list_response(query, keys: list, serialize, server_side: bool = True):
+    """
+    Returns a page or an NDJSON stream of a list endpoint.
+
+    Args:
+        query = the base query of the list.
+
+        keys = the unique column set the rows are ordered and paged by.
+
+        serialize = function turning a list of rows into a list of dicts.
+
+        server_side = False if serialize runs queries of its own.
+
+    Returns:
+        A JSON {"items": [...], "next_cursor": str | None} page, or an
+        NDJSON stream with one item per line.
+    """
+
+    limit = request.args.get("limit", type = int)
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    cursor = request.args.get("cursor")
+    try:
+        values = decode_cursor(cursor, keys) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if wants_ndjson():
+        def generate():
+            for chunk in _iter_chunks(query, keys, values, limit, server_side):
+                for item in serialize(chunk):
+                    yield current_app.json.dumps(item, sort_keys = False) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype = NDJSON)
+
+    limit = min(limit or MAX_LIMIT, MAX_LIMIT)
+    rows = keyset_page(query, keys, values, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(_row_values(rows[-1], keys))
+
+    return jsonify({
+        "items": serialize(rows),
+        "next_cursor": next_cursor
+    }), 200
+
+def ranked_response(hits: list, serialize):
+    """
+    Returns a page of ranked hits, such as search results.
+
+    The cursor holds the (score, id) of the last hit sent, so a hit ranked
+    or deleted between two requests does not shift the next page.
+
+    Args:
+        hits = [(id, score)], ordered by score descending then id.
+
+        serialize = function turning a list of hits into a list of dicts.
+
+    Returns:
+        A JSON {"items": [...], "next_cursor": str | None, "total": int} page.
+    """
+
+    limit = request.args.get("limit", RANKED_LIMIT, type = int)
+    if limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, MAX_LIMIT)
+
+    position = 0
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            score, last_id = decode_cursor(cursor, RANK_KEYS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        position = bisect.bisect_right(hits, (-score, last_id), key = lambda hit: (-hit[1], hit[0]))
+
+    page = hits[position:position + limit]
+    next_cursor = None
+    if position + limit < len(hits):
+        next_cursor = encode_cursor([page[-1][1], page[-1][0]])
+
+    return jsonify({
+        "items": serialize(page),
+        "next_cursor": next_cursor,
+        "total": len(hits)
+    }), 200
@@ -0,0 +1,273 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from sqlalchemy import tuple_, and_
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from models import db, User, Event, EventStats, Participation
+from event_stats import STATUS_COUNTERS, participant_bucket, participant_age, status_change_delta, \
+    apply_status_deltas, counters_to_dicts
+from config import participation_group_commit
+from live import live_hub
+from state import app_local
+
+STATUSES = tuple(STATUS_COUNTERS)
+MAX_BATCH_SIZE = 500
+
+class CommitBusy(Exception):
+    """
+    Raised when the group commit did not write the changes in time, the
+    caller should answer 503.
+    """
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Too many participation writes in progress, try again later.")
+        self.retry_after = retry_after
+
+def upsert_statement():
+    """
+    Returns an INSERT of participations that updates the status, age and
+    age bucket of an existing (user_id, event_id) row instead of failing on
+    unique_user_event.
+    """
+
+    dialect = db.engine.dialect.name
+    if dialect == "mysql":
+        statement = mysql.insert(Participation.__table__)
+        return statement.on_duplicate_key_update(
+            status = statement.inserted.status, age_bucket = statement.inserted.age_bucket,
+            age = statement.inserted.age
+        )
+
+    insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+    statement = insert(Participation.__table__)
+    return statement.on_conflict_do_update(
+        index_elements = ["user_id", "event_id"],
+        set_ = {
+            "status": statement.excluded.status, "age_bucket": statement.excluded.age_bucket,
+            "age": statement.excluded.age
+        }
+    )
+
+def lock_participations(keys: list) -> tuple:
+    """
+    Reads the users, the stats rows and the current participations of
+    (user_id, event_id) pairs in one SELECT, locking the stats and
+    participation rows with FOR UPDATE in event_id order, so concurrent
+    writers of the same events wait for each other until the commit and
+    cannot deadlock.
+
+    Returns:
+        ({(user_id, event_id): (status, age_bucket, age) or None if there is no participation},
+         {user_id: User}, {event_id: EventStats}), without the pairs of events that do not exist.
+    """
+
+    user_ids = sorted({user_id for user_id, _ in keys})
+    event_ids = sorted({event_id for _, event_id in keys})
+    rows = db.session.query(
+        User, Event.id, EventStats, Participation.status, Participation.age_bucket, Participation.age
+    )\
+        .join(Event, and_(Event.id.in_(event_ids), tuple_(User.id, Event.id).in_(keys)))\
+        .outerjoin(EventStats, EventStats.event_id == Event.id)\
+        .outerjoin(Participation, and_(Participation.user_id == User.id, Participation.event_id == Event.id))\
+        .filter(User.id.in_(user_ids))\
+        .order_by(Event.id, User.id)\
+        .with_for_update(of = [EventStats, Participation])\
+        .populate_existing().all()
+
+    participations, users, stats_rows = {}, {}, {}
+    for user, event_id, stats, status, age_bucket, age in rows:
+        participations[(user.id, event_id)] = (status, age_bucket, age) if status is not None else None
+        users[user.id] = user
+        if stats is not None:
+            stats_rows[event_id] = stats
+    return participations, users, stats_rows
+
+def apply_status_changes(changes: list) -> tuple:
+    """
+    Writes many participation statuses and updates the event stats, in the
+    caller's transaction. The caller commits.
+
+    lock_participations reads the previous statuses and locks them with
+    the stats rows, so concurrent writes of the same participation (a
+    double click on two workers) are applied one after the other and the
+    counters cannot drift. Then one upsert writes all the rows and one
+    UPDATE each changed stats row, the changes for the live clients are one
+    INSERT per event. The cached reads of the changed events are
+    invalidated and their new stats published with the commit.
+
+    Args:
+        changes = [(user_id, event_id, status)], the last one wins for a
+            repeated (user_id, event_id).
+
+    Returns:
+        ({(user_id, event_id): (old status or None, new status)},
+         {event_id: counters} of the events that changed). Changes of
+        events that do not exist are not written, with (None, None).
+    """
+
+    wanted = {}
+    for user_id, event_id, status in changes:
+        wanted[(user_id, event_id)] = status
+    if not wanted:
+        return {}, {}
+
+    old, users, stats_rows = lock_participations(list(wanted))
+    result = {
+        key: ((old[key] or (None,))[0], status) if key in old else (None, None)
+        for key, status in wanted.items()
+    }
+    changed = {key: statuses for key, statuses in result.items() if statuses[0] != statuses[1]}
+    if not changed:
+        return result, {}
+
+    going_user_ids = {user_id for (user_id, _), (_, new_status) in changed.items() if new_status == "Going"}
+    buckets = {user_id: participant_bucket(users[user_id]) for user_id in going_user_ids}
+    ages = {user_id: participant_age(users[user_id]) for user_id in going_user_ids}
+
+    rows = []
+    deltas = {}
+    for (user_id, event_id), (old_status, new_status) in changed.items():
+        _, old_bucket, old_age = old[(user_id, event_id)] or (None, None, None)
+        going = new_status == "Going"
+        new_bucket = buckets[user_id] if going else None
+        new_age = ages[user_id] if going else None
+        rows.append({
+            "user_id": user_id, "event_id": event_id, "status": new_status, "age_bucket": new_bucket, "age": new_age
+        })
+
+        delta = status_change_delta(
+            users.get(user_id), old_status, new_status, old_bucket, new_bucket, old_age, new_age
+        )
+        event_delta = deltas.setdefault(event_id, {})
+        for counter, value in delta.items():
+            event_delta[counter] = event_delta.get(counter, 0) + value
+
+    db.session.execute(upsert_statement(), rows)
+    counters = apply_status_deltas(deltas, stats_rows)
+    publish_stats(counters)
+
+    return result, counters
+
+def publish_stats(counters: dict):
+    """
+    Publishes {event_id: counters} to the live clients, with the changes
+    that invalidate the cached reads of the events and of the feed.
+    """
+
+    event_ids = sorted(counters)
+    stats = counters_to_dicts([counters[event_id] for event_id in event_ids])
+    for event_id, event_stats in zip(event_ids, stats):
+        live_hub.publish("participation", {"id": event_id, **event_stats}, f"event:{event_id}", "feed")
+
+class GroupCommitter:
+    """
+    Merges the participation writes of concurrent requests into one
+    transaction, run by a single background thread.
+
+    A request submits its changes and waits. The thread takes everything
+    queued within window seconds (at most max_batch changes), writes it with
+    apply_status_changes and commits once. Writes of one process are applied
+    in order, so double clicks cannot race each other.
+
+    Off unless enabled, submit() is then not called.
+    """
+
+    def __init__(self, enabled: bool = False, window: float = 0.005, max_batch: int = MAX_BATCH_SIZE,
+                 timeout: float = 5):
+        self.enabled = enabled
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = "participation-commit", daemon = True)
+                self._thread.start()
+
+    def submit(self, changes: list) -> dict:
+        """
+        Queues changes and waits until they are committed.
+
+        Returns:
+            The result of apply_status_changes for these changes.
+
+        Raises:
+            CommitBusy if they are not committed within timeout seconds.
+            Changes not taken by the thread yet are dropped, the others
+            may still be committed.
+        """
+
+        self._start()
+        future = Future()
+        self._queue.put((changes, future))
+        try:
+            return future.result(timeout = self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise CommitBusy()
+
+    def _take_batch(self) -> list:
+        # Skips the submits that timed out and were cancelled.
+        batch = []
+        while not batch:
+            item = self._queue.get()
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch:
+            try:
+                item = self._queue.get(timeout = max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+                size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            with self._app.app_context():
+                try:
+                    statuses, counters = apply_status_changes([change for changes, _ in batch for change in changes])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    # One bad request (e.g. a deleted event) must not fail the others.
+                    for changes, future in batch:
+                        self._commit_alone(changes, future)
+                    continue
+
+            for changes, future in batch:
+                future.set_result((
+                    {(user_id, event_id): statuses[(user_id, event_id)] for user_id, event_id, _ in changes},
+                    {event_id: counters[event_id] for _, event_id, _ in changes if event_id in counters}
+                ))
+
+    def _commit_alone(self, changes: list, future: Future):
+        try:
+            result = apply_status_changes(changes)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+group_committer = app_local("group_committer", lambda: GroupCommitter(
+    enabled = participation_group_commit(),
+    window = float(os.environ.get("PARTICIPATION_GROUP_COMMIT_MS", 5)) / 1000,
+    max_batch = int(os.environ.get("PARTICIPATION_GROUP_COMMIT_MAX", MAX_BATCH_SIZE)),
+    timeout = float(os.environ.get("PARTICIPATION_GROUP_COMMIT_TIMEOUT", 5))
+))
@@ -0,0 +1,103 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from state import app_local
+
+class HasherBusy(Exception):
+    """
+    Raised when the hashing queue is full, the caller should answer 503.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many password operations in progress, try again later.")
+        self.retry_after = retry_after
+
+class PasswordHasher:
+    """
+    Runs the slow password KDF on a dedicated thread pool, so a login burst
+    can only use max_workers threads and other requests keep being served.
+
+    hashlib releases the GIL while hashing, so the pool runs in parallel.
+    At most max_workers + max_queue operations are admitted, the rest are
+    rejected with HasherBusy at once instead of piling up. Each admitted one
+    holds a server thread while it waits, so max_admitted keeps them under
+    the threads of the worker.
+
+    Args:
+        method = Werkzeug hash method, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:1000000".
+
+        max_admitted = cap of max_workers + max_queue, None for none.
+    """
+
+    def __init__(self, method: str = "scrypt", salt_length: int = 16, max_workers: int = None,
+                 max_queue: int = 0, max_admitted: int = None, retry_after: int = 1):
+        self.method = method
+        self.salt_length = salt_length
+        workers = max_workers or os.cpu_count() or 1
+        admitted = workers + max_queue
+        if max_admitted is not None:
+            admitted = max(1, min(admitted, max_admitted))
+        self.max_workers = min(workers, admitted)
+        self.max_queue = admitted - self.max_workers
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix = "password-hash")
+        self._slots = threading.BoundedSemaphore(admitted)
+        self._prefix = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking = False):
+            raise HasherBusy(self.retry_after)
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Returns True if the hash was made with other parameters than the current ones.
+        """
+
+        if self._prefix is None:
+            # Werkzeug expands the method defaults ("scrypt" -> "scrypt:32768:8:1").
+            self._prefix = generate_password_hash("", self.method, self.salt_length).split("$")[0]
+
+        parts = password_hash.split("$")
+        return len(parts) != 3 or parts[0] != self._prefix or len(parts[1]) != self.salt_length
+
+def process_hash_workers() -> int:
+    """
+    Returns the hash threads of this process: the hash threads of the machine
+    (PASSWORD_HASH_WORKERS, its cores by default) split between the
+    WEB_CONCURRENCY server processes, at least one each.
+    """
+
+    machine = int(os.environ.get("PASSWORD_HASH_WORKERS", 0)) or os.cpu_count() or 1
+    return max(1, machine // max(1, int(os.environ.get("WEB_CONCURRENCY", 1))))
+
+def max_admitted_hashes():
+    """
+    Returns the password operations a worker admits, one less than its
+    THREADS so hashing never holds all of them, None when THREADS is unset.
+    """
+
+    threads = int(os.environ.get("THREADS", 0))
+    return max(1, threads - 1) if threads else None
+
+password_hasher = app_local("password_hasher", lambda: PasswordHasher(
+    method = os.environ.get("PASSWORD_HASH_METHOD", "scrypt"),
+    salt_length = int(os.environ.get("PASSWORD_SALT_LENGTH", 16)),
+    max_workers = process_hash_workers(),
+    max_queue = int(os.environ.get("PASSWORD_HASH_QUEUE", 0)),
+    max_admitted = max_admitted_hashes(),
+    retry_after = int(os.environ.get("PASSWORD_HASH_RETRY_AFTER", 1))
+))
@@ -0,0 +1,163 @@
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from flask import g, request, has_app_context, Response
+from sqlalchemy import event
+from models import db
+from state import app_local
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+class Histogram:
+    """
+    Prometheus histogram with one series per label set.
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"counts": [0] * len(self.buckets), "sum": 0, "count": 0}
+            for pos, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][pos] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self, label_names: tuple) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                label_text = ",".join(f'{name}="{value}"' for name, value in zip(label_names, labels))
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{label_text}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{label_text}}} {series['count']}")
+        return lines
+
+class RequestProfiler:
+    """
+    Opt-in per-request instrumentation.
+
+    Records the wall time, the SQL query count and time, the JSON
+    serialization time and the response size of every request. They are
+    sent back in a Server-Timing header and aggregated per route on
+    /metrics, in the Prometheus text format. Metrics are per process.
+
+    A sample of the requests also runs under cProfile, the profiles of
+    those slower than slow_ms are written to profile_dir.
+    """
+
+    LABELS = ("method", "route", "status")
+
+    def __init__(self, slow_ms: float = 500, sample_rate: float = 0.0, profile_dir: str = "profiles"):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self.duration = Histogram("http_request_duration_seconds", "Request wall time.", DURATION_BUCKETS)
+        self.sql_queries = Histogram("http_request_sql_queries", "SQL queries per request.", QUERY_BUCKETS)
+        self.sql_duration = Histogram("http_request_sql_duration_seconds", "SQL time per request.", DURATION_BUCKETS)
+        self.serialization = Histogram(
+            "http_request_serialization_seconds", "JSON serialization time per request.", DURATION_BUCKETS
+        )
+        self.response_size = Histogram("http_response_size_bytes", "Response body size.", SIZE_BUCKETS)
+        # cProfile can only run one profile at a time.
+        self._profile_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+        dumps = app.json.dumps
+        def timed_dumps(obj, **kwargs):
+            start = time.perf_counter()
+            try:
+                return dumps(obj, **kwargs)
+            finally:
+                if has_app_context() and "profile" in g:
+                    g.profile["serialization"] += time.perf_counter() - start
+        app.json.dumps = timed_dumps
+
+        # The engines of this app only, another app in the process keeps its own metrics.
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, a failed execute never reaches the after event.
+        context._query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_start", None)
+        if start is not None and has_app_context() and "profile" in g:
+            g.profile["queries"] += 1
+            g.profile["sql"] += time.perf_counter() - start
+
+    def _before_request(self):
+        g.profile = {"start": time.perf_counter(), "queries": 0, "sql": 0.0, "serialization": 0.0, "cprofile": None}
+        if self.sample_rate and random.random() < self.sample_rate and self._profile_lock.acquire(blocking = False):
+            g.profile["cprofile"] = cProfile.Profile()
+            g.profile["cprofile"].enable()
+
+    def _after_request(self, response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+
+        wall = time.perf_counter() - profile["start"]
+        if profile["cprofile"] is not None:
+            profile["cprofile"].disable()
+            try:
+                if wall * 1000 >= self.slow_ms:
+                    self._dump(profile["cprofile"])
+            finally:
+                self._profile_lock.release()
+
+        size = None if response.is_streamed else response.calculate_content_length()
+        labels = (request.method, request.url_rule.rule if request.url_rule else "unmatched", str(response.status_code))
+        self.duration.observe(labels, wall)
+        self.sql_queries.observe(labels, profile["queries"])
+        self.sql_duration.observe(labels, profile["sql"])
+        self.serialization.observe(labels, profile["serialization"])
+        if size is not None:
+            self.response_size.observe(labels, size)
+
+        # Streamed bodies are produced after this point, their timings stop at the headers.
+        response.headers.add("Server-Timing", ", ".join([
+            f"app;dur={wall * 1000:.1f}",
+            f'db;dur={profile["sql"] * 1000:.1f};desc="{profile["queries"]} queries"',
+            f"ser;dur={profile['serialization'] * 1000:.1f}"
+        ]))
+        return response
+
+    def _dump(self, profile: cProfile.Profile):
+        os.makedirs(self.profile_dir, exist_ok = True)
+        route = re.sub(r"[^A-Za-z0-9]+", "_", request.path).strip("_") or "root"
+        profile.dump_stats(os.path.join(self.profile_dir, f"{route}-{time.time_ns() // 1000}-{os.getpid()}.prof"))
+
+    def metrics_view(self):
+        lines = []
+        for histogram in (self.duration, self.sql_queries, self.sql_duration, self.serialization, self.response_size):
+            lines.extend(histogram.render(self.LABELS))
+        return Response("\n".join(lines) + "\n", mimetype = "text/plain; version=0.0.4")
+
+request_profiler = app_local("request_profiler", lambda: RequestProfiler(
+    slow_ms = float(os.environ.get("PROFILE_SLOW_MS", 500)),
+    sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    profile_dir = os.environ.get("PROFILE_DIR", "profiles")
+))
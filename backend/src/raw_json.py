@@ -0,0 +1,37 @@
+import re
+import secrets
+from flask.json.provider import DefaultJSONProvider
+
+class RawJSON:
+    """
+    Already serialized JSON, embedded as is by RawJSONProvider.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+class RawJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that splices RawJSON values into the output instead of
+    parsing and re-encoding them.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        raws = []
+        nonce = secrets.token_hex(4)
+
+        def default(o):
+            if isinstance(o, RawJSON):
+                raws.append(o.text)
+                return f"\x00{nonce}:{len(raws) - 1}\x00"
+            return self.default(o)
+
+        kwargs["default"] = default
+        text = super().dumps(obj, **kwargs)
+        if not raws:
+            return text
+
+        placeholder = re.compile(r'"\\u0000' + nonce + r':(\d+)\\u0000"')
+        return placeholder.sub(lambda match: raws[int(match.group(1))], text)
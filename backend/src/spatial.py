@@ -0,0 +1,270 @@
+import math
+import threading
+from geoalchemy2.shape import to_shape
+from shapely import STRtree
+from shapely.geometry import Point, box, shape
+from shapely.ops import nearest_points
+from sqlalchemy import func
+from models import db, SRID
+from models import Event
+from timeline import time_window
+from changelog import change_log
+from state import app_local
+
+EARTH_RADIUS_M = 6371008.8
+
+def haversine_m(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """
+    Great-circle distance in meters between two lon/lat points.
+    """
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def distance_m(geom, lon: float, lat: float) -> float:
+    """
+    Distance in meters from a lon/lat point to the closest point of a geometry.
+    """
+
+    center = Point(lon, lat)
+    if geom.intersects(center):
+        return 0.0
+    closest = nearest_points(geom, center)[0]
+    return haversine_m(lon, lat, closest.x, closest.y)
+
+def radius_bbox(lon: float, lat: float, radius: float) -> tuple:
+    """
+    Returns the (min_lon, min_lat, max_lon, max_lat) box around a radius in meters.
+    """
+
+    d_lat = math.degrees(radius / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6 or lat + d_lat >= 90 or lat - d_lat <= -90:
+        return (-180.0, max(-90.0, lat - d_lat), 180.0, min(90.0, lat + d_lat))
+
+    d_lon = min(180.0, math.degrees(radius / (EARTH_RADIUS_M * cos_lat)))
+    return (lon - d_lon, lat - d_lat, lon + d_lon, lat + d_lat)
+
+def parse_location(args) -> tuple:
+    """
+    Reads the bbox (<min_lon>,<min_lat>,<max_lon>,<max_lat>) or the lat, lon
+    and radius (meters) request arguments.
+
+    A bbox with min_lon > max_lon crosses the antimeridian, its max_lon is
+    returned past 180 for split_antimeridian.
+
+    Returns:
+        (bbox, center, radius), None for the missing ones.
+
+    Raises:
+        ValueError describing the invalid argument.
+    """
+
+    bbox = args.get("bbox")
+    lat = args.get("lat", type = float)
+    lon = args.get("lon", type = float)
+    radius = args.get("radius", type = float)
+
+    if bbox is not None:
+        try:
+            bbox = tuple(float(value) for value in bbox.split(","))
+        except ValueError:
+            bbox = ()
+        valid = len(bbox) == 4 and bbox[1] <= bbox[3]\
+            and all(-180 <= lon <= 180 for lon in bbox[0::2]) and all(-90 <= lat <= 90 for lat in bbox[1::2])
+        if not valid:
+            raise ValueError("bbox must be <min_lon>,<min_lat>,<max_lon>,<max_lat>")
+        if bbox[0] > bbox[2]:
+            bbox = (bbox[0], bbox[1], bbox[2] + 360, bbox[3])
+        return bbox, None, None
+
+    if lat is not None and lon is not None and radius is not None:
+        if radius < 0:
+            raise ValueError("radius must be positive")
+        return None, (lon, lat), radius
+    return None, None, None
+
+def split_antimeridian(bbox: tuple) -> list:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon < -180:
+        return [(min_lon + 360, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+    if max_lon > 180:
+        return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon - 360, max_lat)]
+    return [bbox]
+
+class SpatialIndex:
+    """
+    In-process R-tree over the event geometries.
+
+    Used when the database has no spatial index support (SQLite in tests).
+    The tree is rebuilt lazily after event writes, those of the other
+    processes included (the "events" change log scope).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = None
+        self._generation = None
+        self._ids = []
+        self._geoms = []
+
+    def invalidate(self):
+        with self._lock:
+            self._tree = None
+
+    def _load(self):
+        generation = change_log.foreign_generation("events")
+        with self._lock:
+            if self._tree is not None and self._generation == generation:
+                return self._tree, self._ids, self._geoms
+
+            rows = db.session.query(Event.id, Event.geometry).all()
+            ids = [row.id for row in rows]
+            geoms = [to_shape(row.geometry) for row in rows]
+
+            self._tree = STRtree(geoms)
+            self._ids = ids
+            self._geoms = geoms
+            self._generation = generation
+            return self._tree, self._ids, self._geoms
+
+    def query_bbox(self, bbox: tuple) -> list:
+        """
+        Returns the ids of the events intersecting a lon/lat box.
+        """
+
+        tree, ids, _ = self._load()
+        found = set()
+        for part in split_antimeridian(bbox):
+            for pos in tree.query(box(*part), predicate = "intersects"):
+                found.add(ids[pos])
+        return list(found)
+
+    def query_radius(self, lon: float, lat: float, radius: float) -> list:
+        """
+        Returns the ids of the events within radius meters of a lon/lat point.
+        """
+
+        tree, ids, geoms = self._load()
+        found = set()
+        for part in split_antimeridian(radius_bbox(lon, lat, radius)):
+            for pos in tree.query(box(*part)):
+                if distance_m(geoms[pos], lon, lat) <= radius:
+                    found.add(ids[pos])
+        return list(found)
+
+event_index = app_local("event_index", SpatialIndex)
+
+def use_database_index() -> bool:
+    return db.engine.dialect.name in ("mysql", "mariadb")
+
+def _mbr_filter(bbox: tuple):
+    parts = []
+    for part in split_antimeridian(bbox):
+        envelope = func.ST_GeomFromText(box(*part).wkt, SRID, "axis-order=long-lat")
+        parts.append(func.MBRIntersects(Event.geometry, envelope))
+    return db.or_(*parts)
+
+def location_filter(query, bbox: tuple = None, center: tuple = None, radius: float = None):
+    """
+    Keeps the events whose MBR is inside a lon/lat box or radius, with the
+    database spatial index.
+
+    Points are checked exactly, polygons and lines still need
+    within_radius on the rows returned.
+    """
+
+    if bbox is not None:
+        return query.filter(_mbr_filter(bbox))
+
+    center_geom = func.ST_GeomFromText(Point(*center).wkt, SRID, "axis-order=long-lat")
+    # ST_Distance_Sphere only takes points, the exact distance to
+    # polygons and lines is checked on the MBR candidates.
+    is_point = func.ST_GeometryType(Event.geometry) == "POINT"
+    return query.filter(_mbr_filter(radius_bbox(center[0], center[1], radius)))\
+        .filter(db.case(
+            (is_point, func.ST_Distance_Sphere(Event.geometry, center_geom) <= radius),
+            else_ = True
+        ))
+
+def within_radius(geometry: dict, center: tuple, radius: float) -> bool:
+    return distance_m(shape(geometry), center[0], center[1]) <= radius
+
+def location_ids(bbox: tuple = None, center: tuple = None, radius: float = None) -> list:
+    """
+    Returns the ids of the events inside a lon/lat box or radius, from the in-process index.
+    """
+
+    if bbox is not None:
+        return event_index.query_bbox(bbox)
+    return event_index.query_radius(center[0], center[1], radius)
+
+def search_events(bbox: tuple = None, center: tuple = None, radius: float = None,
+                  start=None, end=None) -> list:
+    """
+    Returns the events inside a lon/lat box or radius, overlapping a time window.
+
+    Args:
+        bbox = (min_lon, min_lat, max_lon, max_lat)
+
+        center = (lon, lat), used together with radius (meters).
+
+        start, end = datetime bounds of the time window, None for open.
+
+    Returns:
+        A list of Event objects ordered by start_time.
+    """
+
+    query = time_window(Event.query, start, end)
+
+    if use_database_index():
+        events = location_filter(query, bbox, center, radius).order_by(Event.start_time, Event.id).all()
+        if bbox is not None:
+            return events
+        return [event for event in events if within_radius(event.geometry_geojson(), center, radius)]
+
+    ids = location_ids(bbox, center, radius)
+    if not ids:
+        return []
+
+    return query.filter(Event.id.in_(ids)).order_by(Event.start_time, Event.id).all()
+
+def upgrade_geometry_column() -> str:
+    """
+    Moves an existing events.geometry column to SRID 4326 with a SPATIAL index.
+
+    Tables created before the column had an SRID keep plain SRID 0 geometries,
+    which MySQL never serves from a spatial index.
+    """
+
+    if not use_database_index():
+        return "Nothing to do, the database has no spatial index support."
+
+    srid = db.session.execute(db.text(
+        "SELECT SRS_ID FROM information_schema.ST_GEOMETRY_COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'events' AND COLUMN_NAME = 'geometry'"
+    )).scalar()
+    if srid == SRID:
+        return "events.geometry already uses SRID 4326."
+
+    indexes = db.session.execute(db.text(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'events' AND COLUMN_NAME = 'geometry'"
+    )).scalars().all()
+    for index_name in indexes:
+        db.session.execute(db.text(f"ALTER TABLE events DROP INDEX `{index_name}`"))
+
+    updated = db.session.execute(db.text(
+        f"UPDATE events SET geometry = "
+        f"ST_GeomFromWKB(ST_AsBinary(geometry), {SRID}, 'axis-order=long-lat')"
+    )).rowcount
+    db.session.execute(db.text(f"ALTER TABLE events MODIFY geometry GEOMETRY NOT NULL SRID {SRID}"))
+    db.session.execute(db.text("ALTER TABLE events ADD SPATIAL INDEX(geometry)"))
+    db.session.commit()
+
+    return f"Converted {updated} events to SRID {SRID} and added the spatial index."
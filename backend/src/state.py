@@ -0,0 +1,48 @@
+"""
+Per app state.
+
+The caches, indexes, thread pools and background threads are created by
+create_app() for that app, not on import, so every app (a gunicorn worker,
+a test session, a CLI command) starts from its own empty caches. The pools
+and threads start on first use, in the worker even when gunicorn preloads
+the app in its master.
+
+The modules expose them as proxies to the instance of the current app,
+like flask.current_app, so they are used in an app context only. Threads
+keep the instance itself (proxy._get_current_object()).
+"""
+from flask import current_app, has_app_context
+from werkzeug.local import LocalProxy
+
+EXTENSION = "fair_finder"
+
+# {name: factory}, in import order, so a factory may use the ones before it.
+_factories = {}
+
+def app_local(name: str, factory) -> LocalProxy:
+    """
+    Returns a proxy to the instance factory() creates for the current app.
+
+    Args:
+        factory = function without arguments, called by init_app() in an app context.
+    """
+
+    _factories[name] = factory
+    return LocalProxy(lambda: current_app.extensions[EXTENSION][name])
+
+def init_app(app):
+    """
+    Creates the instances of every module imported so far for app.
+    """
+
+    instances = app.extensions[EXTENSION] = {}
+    with app.app_context():
+        for name, factory in _factories.items():
+            instances[name] = factory()
+
+def has_state() -> bool:
+    """
+    Returns True in an app context of an app created by create_app().
+    """
+
+    return has_app_context() and EXTENSION in current_app.extensions
@@ -0,0 +1,262 @@
+import bisect
+import json
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from sqlalchemy.dialects.mysql import match
+from models import db
+from models import Event
+from spatial import use_database_index, location_filter, location_ids, within_radius
+from timeline import filter_events
+from changelog import change_log
+from state import app_local
+
+# Shorter words are not indexed, as with InnoDB's innodb_ft_min_token_size.
+MIN_TOKEN_LENGTH = 3
+# A title word counts as much as this many description words.
+TITLE_WEIGHT = 2
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+WORD = re.compile(rf"\w{{{MIN_TOKEN_LENGTH},}}")
+
+def tokenize(text: str) -> list:
+    """
+    Splits text into words, folded for case and diacritics.
+    """
+
+    folded = text.casefold()
+    if not folded.isascii():
+        folded = "".join(
+            char for char in unicodedata.normalize("NFKD", folded) if not unicodedata.combining(char)
+        )
+    return WORD.findall(folded)
+
+def _in_statuses(start_time: datetime, end_time: datetime, statuses: list, now: datetime) -> bool:
+    # Same rules as timeline.status_filter.
+    return (
+        ("upcoming" in statuses and start_time > now)
+        or ("ongoing" in statuses and start_time <= now <= end_time)
+        or ("past" in statuses and end_time < now)
+    )
+
+class TextIndex:
+    """
+    In-process inverted index over the event titles and descriptions, for
+    databases without FULLTEXT support (SQLite in tests).
+
+    Loaded lazily on the first search, then kept up to date by add() and
+    remove(). Bulk writes call invalidate() and the next search reloads it,
+    as it does after event writes of the other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._generation = None
+        # {term: {event_id: weighted term frequency}}
+        self._postings = {}
+        # Sorted vocabulary, for prefix lookups.
+        self._terms = []
+        # {event_id: (terms, length, start_time, end_time)}
+        self._docs = {}
+        self._total_length = 0
+
+    def _clear(self):
+        self._loaded = False
+        self._postings = {}
+        self._terms = []
+        self._docs = {}
+        self._total_length = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def _load(self, generation: int):
+        if self._loaded and self._generation == generation:
+            return
+        self._clear()
+
+        rows = db.session.query(Event.id, Event.title, Event.description, Event.start_time, Event.end_time).all()
+        for row in rows:
+            self._add(row.id, row.title, row.description, row.start_time, row.end_time)
+        self._terms.sort()
+        self._loaded = True
+        self._generation = generation
+
+    def _add(self, event_id: int, title: str, description: str, start_time: datetime, end_time: datetime,
+             keep_sorted: bool = False):
+        frequencies = Counter(tokenize(description))
+        for token in tokenize(title):
+            frequencies[token] += TITLE_WEIGHT
+
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                if keep_sorted:
+                    bisect.insort(self._terms, term)
+                else:
+                    self._terms.append(term)
+            postings[event_id] = frequency
+
+        length = sum(frequencies.values())
+        self._docs[event_id] = (tuple(frequencies), length, start_time, end_time)
+        self._total_length += length
+
+    def _remove(self, event_id: int):
+        doc = self._docs.pop(event_id, None)
+        if doc is None:
+            return
+
+        terms, length, _, _ = doc
+        for term in terms:
+            postings = self._postings[term]
+            del postings[event_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        self._total_length -= length
+
+    def add(self, event: Event):
+        """
+        Indexes a new or edited event. Does nothing before the first search.
+        """
+
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(event.id)
+            self._add(event.id, event.title, event.description, event.start_time, event.end_time, keep_sorted = True)
+
+    def remove(self, event_id: int):
+        with self._lock:
+            if self._loaded:
+                self._remove(event_id)
+
+    def _expand(self, token: str) -> list:
+        # The vocabulary terms starting with token, token itself included.
+        start = bisect.bisect_left(self._terms, token)
+        end = bisect.bisect_left(self._terms, token + "\U0010ffff", start)
+        return self._terms[start:end]
+
+    def search(self, tokens: list, start: datetime = None, end: datetime = None,
+               statuses: list = None, ids: set = None) -> list:
+        """
+        Returns the events containing every token, as a word or a word prefix,
+        ranked by BM25.
+
+        Args:
+            start, end, statuses = the time filters of timeline.filter_events.
+
+            ids = the only events to consider, None for all.
+
+        Returns:
+            [(event_id, score)], best first.
+        """
+
+        now = datetime.now()
+        generation = change_log.foreign_generation("events")
+        with self._lock:
+            self._load(generation)
+            count = len(self._docs)
+            if not count or not tokens:
+                return []
+            average_length = self._total_length / count
+
+            token_scores = []
+            for token in dict.fromkeys(tokens):
+                scores = {}
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for event_id, frequency in postings.items():
+                        length = self._docs[event_id][1]
+                        score = idf * frequency * (K1 + 1) / (
+                            frequency + K1 * (1 - B + B * length / average_length)
+                        )
+                        # A word matched by several expansions counts once, by its best one.
+                        if score > scores.get(event_id, 0):
+                            scores[event_id] = score
+                if not scores:
+                    return []
+                token_scores.append(scores)
+
+            token_scores.sort(key = len)
+            candidates = token_scores[0].keys()
+            for scores in token_scores[1:]:
+                candidates = candidates & scores.keys()
+            if ids is not None:
+                candidates = candidates & ids
+
+            hits = []
+            for event_id in candidates:
+                _, _, start_time, end_time = self._docs[event_id]
+                if start is not None and end_time < start:
+                    continue
+                if end is not None and start_time > end:
+                    continue
+                if statuses and not _in_statuses(start_time, end_time, statuses, now):
+                    continue
+                hits.append((event_id, sum(scores[event_id] for scores in token_scores)))
+
+        hits.sort(key = lambda hit: (-hit[1], hit[0]))
+        return hits
+
+text_index = app_local("text_index", TextIndex)
+
+def _fulltext_hits(tokens: list, start: datetime, end: datetime, statuses: list,
+                   bbox: tuple, center: tuple, radius: float) -> list:
+    # Every word required, each one also matching as a prefix.
+    relevance = match(Event.title, Event.description, against = " ".join(f"+{token}*" for token in tokens))\
+        .in_boolean_mode()
+    columns = [Event.id, relevance.label("score")]
+    if center is not None:
+        columns.append(Event.geojson)
+
+    query = filter_events(db.session.query(*columns).filter(relevance), start, end, statuses)
+    if bbox is not None or center is not None:
+        query = location_filter(query, bbox, center, radius)
+
+    rows = query.order_by(relevance.desc(), Event.id).all()
+    if center is not None:
+        # Rows without GeoJSON yet (see backfill-geojson) are kept on their MBR.
+        rows = [row for row in rows if not row.geojson or within_radius(json.loads(row.geojson), center, radius)]
+    return [(row.id, float(row.score)) for row in rows]
+
+def search_text(query: str, start: datetime = None, end: datetime = None, statuses: list = None,
+                bbox: tuple = None, center: tuple = None, radius: float = None) -> list:
+    """
+    Full-text search over the event titles and descriptions, with the MySQL
+    FULLTEXT index or the in-process TextIndex.
+
+    Args:
+        query = the words searched, all of them must match, each one as a
+            whole word or as the start of one.
+
+        start, end, statuses = the time filters of timeline.filter_events.
+
+        bbox, center, radius = the location filters of spatial.search_events.
+
+    Returns:
+        [(event_id, score)], best first.
+
+    Raises:
+        ValueError if query has no word of at least MIN_TOKEN_LENGTH characters.
+    """
+
+    tokens = tokenize(query)
+    if not tokens:
+        raise ValueError(f"q needs a word of at least {MIN_TOKEN_LENGTH} characters")
+
+    if use_database_index():
+        return _fulltext_hits(tokens, start, end, statuses, bbox, center, radius)
+
+    ids = None
+    if bbox is not None or center is not None:
+        ids = set(location_ids(bbox, center, radius))
+    return text_index.search(tokens, start, end, statuses, ids)
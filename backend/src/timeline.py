@@ -0,0 +1,71 @@
+from datetime import datetime
+from models import db
+from models import Event
+
+STATUSES = ("upcoming", "ongoing", "past")
+
+def time_window(query, start: datetime = None, end: datetime = None):
+    """
+    Keeps the events overlapping [start, end], either bound being optional.
+    """
+
+    if start is not None:
+        query = query.filter(Event.end_time >= start)
+    if end is not None:
+        query = query.filter(Event.start_time <= end)
+    return query
+
+def status_filter(query, statuses: list, now: datetime = None):
+    """
+    Keeps the events in any of the statuses, relative to now.
+    """
+
+    # Event times are naive local times, as sent by the map.
+    now = now or datetime.now()
+    statuses = frozenset(statuses)
+    # Neighbouring statuses are one range of an index, instead of an OR.
+    merged = {
+        frozenset(STATUSES): None,
+        frozenset(("upcoming", "ongoing")): Event.end_time >= now,
+        frozenset(("ongoing", "past")): Event.start_time <= now
+    }
+    if statuses in merged:
+        clause = merged[statuses]
+        return query if clause is None else query.filter(clause)
+
+    clauses = {
+        "upcoming": Event.start_time > now,
+        "ongoing": db.and_(Event.start_time <= now, Event.end_time >= now),
+        "past": Event.end_time < now
+    }
+    return query.filter(db.or_(*[clauses[status] for status in statuses]))
+
+def parse_time_filters(args) -> tuple:
+    """
+    Reads the from, to and status (comma separated) request arguments.
+
+    Returns:
+        (start, end, statuses), None for the missing ones.
+
+    Raises:
+        ValueError describing the invalid argument.
+    """
+
+    try:
+        start = datetime.fromisoformat(args["from"]) if "from" in args else None
+        end = datetime.fromisoformat(args["to"]) if "to" in args else None
+    except ValueError:
+        raise ValueError("from or to not in format <YYYY-MM-DDTHH:MM>")
+
+    statuses = None
+    if args.get("status"):
+        statuses = args["status"].split(",")
+        if any(status not in STATUSES for status in statuses):
+            raise ValueError(f"status must be a comma separated list of {', '.join(STATUSES)}")
+    return start, end, statuses
+
+def filter_events(query, start: datetime = None, end: datetime = None, statuses: list = None):
+    query = time_window(query, start, end)
+    if statuses:
+        query = status_filter(query, statuses)
+    return query
@@ -1,14 +1,29 @@
-from datetime import date, datetime, timezone
+from datetime import datetime
 import re
 from enum import Enum
 from models import db
 from models import TestTable
-from models import User, Event, Participation
-from werkzeug.security import generate_password_hash,check_password_hash
+from models import User, Event, Participation, EventStats, GEOMETRY_TYPES, geojson_variants
 
 from geoalchemy2.shape import from_shape
+from geoalchemy2.shape import to_shape
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
 from shapely.geometry import shape
 
+from feed import build_feed
+from event_stats import reset_counters
+from participations import apply_status_changes, group_committer
+from spatial import event_index
+from text_search import text_index
+from nearest import nearest_index
+from density import centroid_index
+from cache import response_cache
+from passwords import password_hasher
+from avatars import SMALL
+from live import live_hub
+from geo import geo_service, event_destination
+
 def add_test(text: str):
     new_test = TestTable(test_field=text)
     db.session.add(new_test)
@@ -47,7 +62,7 @@ def create_user(data: dict) -> User:
         email=data["email"],
         birthday=data["birthday"]
     )
-    user.password_hash = generate_password_hash(data["password"])
+    user.password_hash = password_hasher.hash(data["password"])
 
     db.session.add(user)
     db.session.commit()
@@ -60,7 +75,9 @@ def get_all_users() -> list:
         The list of the users in the DB.
     """
 
-    users = User.query.all()
+    return serialize_users(User.query.all())
+
+def serialize_users(users: list) -> list:
     return [user.to_dict() for user in users]
 
 def get_user(user_id: int) -> dict:
@@ -103,9 +120,10 @@ def create_event(data: dict) -> Event:
     
     try:
         geom_shape = shape(data["geometry"])
-        geom_db = from_shape(geom_shape)
     except Exception as e:
         raise ValueError(f"Invalid geometry: {e}")
+    if geom_shape.geom_type not in GEOMETRY_TYPES:
+        raise ValueError(f"Unsupported geometry type {geom_shape.geom_type}, expected one of {', '.join(GEOMETRY_TYPES)}")
     
     event = Event(
         owner_id = data["owner_id"],
@@ -113,75 +131,63 @@ def create_event(data: dict) -> Event:
         description = data["description"],
         start_time = start_time,
         end_time = end_time,
-        geometry = geom_db,
-        color = data["color"]
+        color = data["color"],
+        stats = EventStats()
     )
+    event.set_geometry(geom_shape)
 
     db.session.add(event)
+    db.session.flush()
+    response_cache.invalidate("feed", "events")
+    live_hub.publish("created", build_feed([event])[0])
     db.session.commit()
+    event_index.invalidate()
+    centroid_index.invalidate()
+    text_index.add(event)
+    nearest_index.add(event)
+    geo_service.precompute_event_routes(event_destination(event.geojson))
 
     return event
 
-def get_all_events() -> list:
-    events = Event.query.all()
-    result = []
-
-    for event in events:
-        event_dict = event.to_dict()
-
-        counts = {"Going": 0, "Not going": 0, "Interested": 0}
-
-        for participation in event.participations:
-            if participation.status in counts:
-                counts[participation.status] += 1
-
-        ages = []
-        gender_counts = {"M": 0, "F": 0, "N": 0}
-
-        total_participants = 0
-        for participation in event.participations:
-            if participation.status != "Going":
-                continue
-            total_participants = total_participants + 1
-            user = participation.user
-            if isinstance(user.birthday, str):
-                birthday_date = datetime.fromisoformat(user.birthday).date()
-            else:
-                birthday_date = user.birthday
-
-            age = (date.today() - birthday_date).days // 365 
-            ages.append(age)
-
-            if user.gender in gender_counts:
-                gender_counts[user.gender] += 1
-            else:
-                gender_counts["N"] += 1
-
-        if total_participants == 0:
-            age_avg = 0
-            male_perc = 0
-            female_perc = 0
-            non_perc = 0
-        else:
-            age_avg = round(sum(ages)/len(ages), 1) if ages else None
-
-            male_perc = round((gender_counts["M"]/total_participants)*100, 1) if total_participants else 0
-            female_perc = round((gender_counts["F"]/total_participants)*100, 1) if total_participants else 0
-            non_perc = round((gender_counts["N"]/total_participants)*100, 1) if total_participants else 0
-
-        event_dict.update({
-            "going": counts["Going"],
-            "not_going": counts["Not going"],
-            "interested": counts["Interested"],
-            "ageAvg": age_avg,
-            "malePerc": male_perc,
-            "femalePerc": female_perc,
-            "notPerc": non_perc
-        })
+def backfill_geojson(batch_size: int = 500) -> int:
+    """
+    Fills the precomputed GeoJSON of events created before it existed.
+    The migrations add the columns.
 
-        result.append(event_dict)
+    Returns:
+        The number of events updated.
+    """
 
-    return result
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Event.id, Event.geometry)\
+            .filter(Event.geojson.is_(None), Event.id > last_id)\
+            .order_by(Event.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        values = []
+        for row in rows:
+            geojson, geojson_simplified = geojson_variants(to_shape(row.geometry))
+            values.append({"id": row.id, "geojson": geojson, "geojson_simplified": geojson_simplified})
+
+        db.session.execute(update(Event), values)
+        db.session.commit()
+        updated += len(values)
+        last_id = rows[-1].id
+
+    response_cache.invalidate("feed")
+    db.session.commit()
+    return updated
+
+def get_all_events(simplified: bool = False) -> list:
+    """
+    Returns all events with their participation stats.
+    """
+
+    events = Event.query.all()
+    return build_feed(events, all_events = True, simplified = simplified)
 
 def get_event(event_id: int) -> dict:
     """
@@ -191,62 +197,13 @@ def get_event(event_id: int) -> dict:
     event = Event.query.filter_by(id = event_id).first()
     if event is None:
         return {}
-    
-    event_dict = event.to_dict()
-    counts = {"Going": 0, "Not going": 0, "Interested": 0}
-    for participation in event.participations:
-            if participation.status in counts:
-                counts[participation.status] += 1
-    ages = []
-    gender_counts = {"M": 0, "F": 0, "N": 0}
-
-    total_participants = 0
-    for participation in event.participations:
-        if participation.status != "Going":
-            continue
-        total_participants = total_participants + 1
-        user = participation.user
-        if isinstance(user.birthday, str):
-            birthday_date = datetime.fromisoformat(user.birthday).date()
-        else:
-            birthday_date = user.birthday
-
-        age = (date.today() - birthday_date).days // 365 
-        ages.append(age)
-
-        if user.gender in gender_counts:
-            gender_counts[user.gender] += 1
-        else:
-            gender_counts["N"] += 1
-
-    if total_participants == 0:
-        age_avg = 0
-        male_perc = 0
-        female_perc = 0
-        non_perc = 0
-    else:
-        age_avg = round(sum(ages)/len(ages), 1) if ages else None
-
-        male_perc = round((gender_counts["M"]/total_participants)*100, 1) if total_participants else 0
-        female_perc = round((gender_counts["F"]/total_participants)*100, 1) if total_participants else 0
-        non_perc = round((gender_counts["N"]/total_participants)*100, 1) if total_participants else 0
 
+    return build_feed([event])[0]
 
-    event_dict.update({
-        "going": counts["Going"],
-        "not_going": counts["Not going"],
-        "interested": counts["Interested"],
-        "ageAvg": age_avg,
-        "malePerc": male_perc,
-        "femalePerc": female_perc,
-        "notPerc": non_perc
-    })
-
-    return event_dict
-
-def create_participation(data: dict) -> Participation:
+def create_participation(data: dict) -> tuple:
     """
-    Create a new participation.
+    Sets the status of an user for an event, adding the participation if
+    the user didn't express intent yet.
 
     Args:
         data (dict): {
@@ -256,26 +213,39 @@ def create_participation(data: dict) -> Participation:
         }
 
     Returns:
-        A new participation object if user didn't express intent yet.
-        Otherwise, change status and return the participation object.
+        ((previous status or None, new status), {event_id: counters} if the status changed)
+    """
+
+    key = (data["user_id"], data["event_id"])
+    statuses, counters = save_participations([(*key, data["status"])])
+    return statuses[key], counters
+
+def save_participations(changes: list) -> tuple:
+    """
+    Writes participation statuses in one transaction, through the group
+    commit when it is enabled, then refreshes the caches and live clients
+    of the events that changed.
+
+    Args:
+        changes = [(user_id, event_id, status)]
+
+    Returns:
+        ({(user_id, event_id): (previous status or None, new status)},
+         {event_id: counters} of the events that changed)
     """
-    participation = Participation.query.filter_by(user_id = data["user_id"], event_id = data["event_id"]).first()
 
-    if participation:
-        participation.status = data["status"]
+    if group_committer.enabled:
+        result = group_committer.submit(changes)
     else:
-        participation = Participation(
-            user_id = data["user_id"],
-            event_id = data["event_id"],
-            status = data["status"]
-        )
-        db.session.add(participation)
-    db.session.commit()
+        result = apply_status_changes(changes)
+        db.session.commit()
 
-    return participation
+    return result
 
 def get_all_participations() -> list:
-    participations = Participation.query.all()
+    return serialize_participations(Participation.query.all())
+
+def serialize_participations(participations: list) -> list:
     return [participation.to_dict() for participation in participations]
 
 def get_participation(user_id: int, event_id: int) -> dict:
@@ -288,9 +258,47 @@ def get_participation(user_id: int, event_id: int) -> dict:
         return {}
     return participation.to_dict()
 
+def get_user_event_ids(user_id: int) -> list:
+    """
+    Returns the ids of the events an user has a participation in.
+    """
+
+    return [
+        event_id for (event_id,) in db.session.query(Participation.event_id)
+        .filter(Participation.user_id == user_id)
+    ]
+
+def get_participation_statuses(user_id: int, event_ids: list = None) -> dict:
+    """
+    Returns the participation status of an user for many events with one query.
+
+    Args:
+        event_ids = the events to look up, None for all of the user's participations.
+
+    Returns:
+        {event_id: status}, with None for requested events without a participation.
+    """
+
+    query = db.session.query(Participation.event_id, Participation.status)\
+        .filter(Participation.user_id == user_id)
+
+    statuses = {}
+    if event_ids is not None:
+        if not event_ids:
+            return statuses
+        statuses = {event_id: None for event_id in event_ids}
+        query = query.filter(Participation.event_id.in_(event_ids))
+
+    for event_id, status in query.all():
+        statuses[event_id] = status
+
+    return statuses
+
 def delete_all_participations():
     try:
         num_deleted = Participation.query.delete()  # șterge toate rândurile
+        reset_counters()
+        response_cache.invalidate("all")
         db.session.commit()
         return f"{num_deleted} participations deleted successfully."
     except Exception as e:
@@ -299,13 +307,11 @@ def delete_all_participations():
 
 # Extra methods.
 
-def get_user_participations(user_id: int):
-    """
-    Returns all participations for an user.
-    """
-
-    participations = Participation.query.filter_by(user_id = user_id).all()
+def user_participations_query(user_id: int):
+    return Participation.query.filter_by(user_id = user_id)\
+        .options(joinedload(Participation.event))
 
+def serialize_user_participations(participations: list) -> list:
     res = []
     participation: Participation
     for participation in participations:
@@ -318,17 +324,70 @@ def get_user_participations(user_id: int):
 
     return res
 
-def get_event_participations(event_id: int):
+def get_user_participations(user_id: int):
     """
-    Returns all participations for an event.
+    Returns all participations for an user.
     """
 
-    participations = Participation.query.filter_by(event_id = event_id).all()
+    return serialize_user_participations(user_participations_query(user_id).all())
 
+def get_user_dashboard(user: User) -> dict:
+    """
+    Returns an user's owned events with their stats, their participations
+    with a summary of each event, and the totals.
+
+    Runs a fixed number of queries: owned events, their stats, and the
+    participations joined with their events.
+    """
+
+    owned = Event.query.filter_by(owner_id = user.id)\
+        .order_by(Event.start_time, Event.id).all()
+    owned_events = build_feed(owned, simplified = True)
+
+    participations = user_participations_query(user.id)\
+        .order_by(Participation.id).all()
+
+    by_status = {"Going": 0, "Not going": 0, "Interested": 0}
+    participation_list = []
+    for participation in participations:
+        by_status[participation.status] = by_status.get(participation.status, 0) + 1
+        event = participation.event
+        participation_list.append({
+            "status": participation.status,
+            "event": {
+                "id": event.id,
+                "title": event.title,
+                "start_time": event.start_time.isoformat(),
+                "end_time": event.end_time.isoformat(),
+                "color": event.color
+            }
+        })
+
+    return {
+        "user": user.to_dict(),
+        "owned_events": owned_events,
+        "participations": participation_list,
+        "totals": {
+            "owned_events": len(owned_events),
+            "participations": len(participation_list),
+            "going": by_status["Going"],
+            "not_going": by_status["Not going"],
+            "interested": by_status["Interested"],
+            # Participants of the user's own events.
+            "attendees_going": sum(event["going"] for event in owned_events),
+            "attendees_interested": sum(event["interested"] for event in owned_events)
+        }
+    }
+
+def event_participations_query(event_id: int):
+    return Participation.query.filter_by(event_id = event_id)\
+        .options(joinedload(Participation.user))
+
+def serialize_event_participations(participations: list) -> list:
     res = []
     participation: Participation
     for participation in participations:
-        user_info = participation.user.to_dict()
+        user_info = participation.user.to_dict(avatar_size = SMALL)
         info = {
             "user": user_info,
             "status": participation.status
@@ -337,6 +396,13 @@ def get_event_participations(event_id: int):
 
     return res
 
+def get_event_participations(event_id: int):
+    """
+    Returns all participations for an event.
+    """
+
+    return serialize_event_participations(event_participations_query(event_id).all())
+
 
 # Validation
 
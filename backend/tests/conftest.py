@@ -0,0 +1,154 @@
+"""
+The tests drive the app through the Flask test client, on a throwaway
+SQLite database with the SpatiaLite extension (SPATIALITE_LIBRARY_PATH,
+see GeoAlchemy2), or on the scratch MySQL database of TEST_MYSQL_URL when
+it is set. The tables are created again for every test.
+
+Run from backend/:
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+TMP_DIR = tempfile.mkdtemp(prefix = "fair-finder-tests-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_MYSQL_URL") or "sqlite:///" + os.path.join(TMP_DIR, "test.db")
+os.environ.setdefault("AVATAR_FOLDER", os.path.join(TMP_DIR, "avatars"))
+os.environ.setdefault("GEO_UPSTREAM", "stub")
+os.environ.setdefault("GEO_CACHE_PATH", os.path.join(TMP_DIR, "geo.sqlite3"))
+# A single process, the change log is never polled inside the counted queries.
+os.environ["GENERATION_POLL"] = "0"
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "src"))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "benchmarks"))
+
+from datetime import date, datetime, timedelta
+from geoalchemy2 import load_spatialite
+from sqlalchemy import event
+from app import create_app, create_access_token
+from models import db, User, Event, EventStats, Change
+from spatial import event_index
+from text_search import text_index
+from nearest import nearest_index
+from density import centroid_index, tile_cache
+from cache import response_cache
+from auth import token_cache
+from changelog import change_log
+import synthetic
+
+@pytest.fixture(scope = "session")
+def app():
+    flask_app = create_app()
+    with flask_app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            if not os.environ.get("SPATIALITE_LIBRARY_PATH"):
+                pytest.skip("SpatiaLite is not available, set SPATIALITE_LIBRARY_PATH.")
+            event.listen(db.engine, "connect", load_spatialite)
+            db.engine.dispose()
+    return flask_app
+
+def reset_database():
+    """
+    Empties the database and the in-process indexes and caches.
+    """
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    for index in (event_index, centroid_index, text_index, nearest_index):
+        index.invalidate()
+    response_cache.clear()
+    tile_cache.clear()
+    token_cache.clear()
+    change_log.reset()
+
+@pytest.fixture
+def database(app):
+    with app.app_context():
+        reset_database()
+        yield db
+        db.session.remove()
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
+
+def seed(users: int, events: int, participations_per_event: int = 10, seed: int = 42) -> dict:
+    """
+    Inserts synthetic rows (see benchmarks/synthetic.py) into an empty database.
+    """
+
+    return synthetic.generate(users, events, participations_per_event, seed)
+
+def make_user(email: str = "owner@example.com", birthday: date = date(1990, 5, 17), gender: str = "N") -> User:
+    user = User(first_name = "Test", last_name = "User", email = email, password_hash = "-", birthday = birthday, gender = gender)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def make_event(owner: User, geometry, start_time: datetime, hours: int = 4, title: str = "Fair") -> Event:
+    """
+    Adds an event with a shapely geometry, as /post_event stores it.
+    """
+
+    event = Event(
+        owner_id = owner.id,
+        title = title,
+        description = "Test event",
+        start_time = start_time,
+        end_time = start_time + timedelta(hours = hours),
+        color = "#1abc9c",
+        stats = EventStats()
+    )
+    event.set_geometry(geometry)
+    db.session.add(event)
+    db.session.commit()
+    return event
+
+def record_foreign_change(*scopes) -> int:
+    """
+    Adds a change as another worker or CLI process writes it, unknown to change_log.
+    """
+
+    change = Change(scopes = ",".join(scopes))
+    db.session.add(change)
+    db.session.commit()
+    return change.id
+
+@contextmanager
+def polling(interval: float = 0.01):
+    """
+    Polls the change log every interval seconds inside the block, sleep(interval * 2) to see new changes.
+    """
+
+    change_log.poll = interval
+    try:
+        yield
+    finally:
+        change_log.poll = 0
+
+def auth_headers(user_id: int) -> dict:
+    return {"Authorization": f"Bearer {create_access_token(user_id)}"}
+
+def first_user() -> User:
+    return User.query.order_by(User.id).first()
+
+@contextmanager
+def count_queries():
+    """
+    Collects the SQL statements run inside the block.
+    """
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
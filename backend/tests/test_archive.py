@@ -0,0 +1,24 @@
+import time
+from datetime import datetime, timedelta
+from shapely.geometry import Point
+from models import db, Change
+from changelog import ChangeLog
+from archive import archive_events
+from conftest import make_user, make_event
+
+def test_archive_reaches_the_other_processes(client):
+    owner = make_user()
+    make_event(owner, Point(25, 45), datetime.now() - timedelta(days = 10))
+    make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1))
+    assert len(client.get("/get_events").get_json()) == 2
+
+    # A server worker, polling the change log.
+    worker = ChangeLog(poll = 0.01)
+    worker.generation("all")
+
+    assert archive_events(datetime.now() - timedelta(days = 1)) == 1
+    time.sleep(0.02)
+    assert worker.generation("all") > 0
+    assert worker.foreign_generation("events") > 0
+    assert [change.kind for change in db.session.query(Change).order_by(Change.id)] == [None, "reload"]
+    assert len(client.get("/get_events").get_json()) == 1
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime, timedelta, timezone
+import jwt
+import auth
+from auth import token_cache
+from conftest import make_user, auth_headers
+
+def _token(user_id: int, expires_in: float, secret: str = auth.SECRET_KEY) -> str:
+    payload = {"user_id": user_id, "exp": datetime.now(timezone.utc) + timedelta(seconds = expires_in), "type": "access"}
+    return jwt.encode(payload, secret, algorithm = "HS256")
+
+def _get_mine(client, token: str):
+    return client.get("/participations/me", headers = {"Authorization": f"Bearer {token}"})
+
+def _count_decodes(monkeypatch) -> list:
+    decoded = []
+    decode = jwt.decode
+    def counting(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth.jwt, "decode", counting)
+    return decoded
+
+def _record_ttls(monkeypatch) -> list:
+    ttls = []
+    set_entry = token_cache.set
+    def recording(key, value, ttl = None):
+        ttls.append(ttl)
+        set_entry(key, value, ttl)
+
+    monkeypatch.setattr(token_cache, "set", recording)
+    return ttls
+
+def test_tokens_are_decoded_once(client, monkeypatch):
+    user = make_user()
+    decoded = _count_decodes(monkeypatch)
+    headers = auth_headers(user.id)
+
+    for _ in range(3):
+        assert client.get("/participations/me", headers = headers).status_code == 200
+    assert len(decoded) == 1
+
+def test_cache_ttl_is_capped_at_the_token_exp(client, monkeypatch):
+    user = make_user()
+    ttls = _record_ttls(monkeypatch)
+
+    # A long lived token is checked again after the cache TTL.
+    assert _get_mine(client, _token(user.id, 3600)).status_code == 200
+    # A token about to expire is not kept past its exp.
+    assert _get_mine(client, _token(user.id, 30)).status_code == 200
+    assert ttls[0] == token_cache.ttl
+    assert 0 < ttls[1] <= 30
+
+def test_expired_tokens_leave_the_cache(client):
+    user = make_user()
+    token = _token(user.id, 1)
+    assert _get_mine(client, token).status_code == 200
+
+    # exp has a whole second precision.
+    time.sleep(max(0, jwt.decode(token, options = {"verify_signature": False})["exp"] - time.time()) + 0.05)
+    assert _get_mine(client, token).status_code == 401
+
+def test_cached_tokens_are_verified_again(client, monkeypatch):
+    user = make_user()
+    token = _token(user.id, 3600)
+    assert _get_mine(client, token).status_code == 200
+
+    # A rotated key revokes the cached tokens once their entries expire, or at once with clear().
+    monkeypatch.setattr(auth, "SECRET_KEY", "ROTATED")
+    assert _get_mine(client, token).status_code == 200
+    token_cache.clear()
+    assert _get_mine(client, token).status_code == 401
+    assert _get_mine(client, _token(user.id, 3600, "ROTATED")).status_code == 200
+
+    # A token not cached yet, kept for the shorter TTL.
+    monkeypatch.setattr(token_cache, "ttl", 0.05)
+    rotated = _token(user.id, 1800, "ROTATED")
+    assert _get_mine(client, rotated).status_code == 200
+    monkeypatch.setattr(auth, "SECRET_KEY", "ROTATED AGAIN")
+    time.sleep(0.1)
+    assert _get_mine(client, rotated).status_code == 401
+
+def test_forged_tokens_miss_the_cache(client):
+    user = make_user()
+    token = _token(user.id, 3600)
+    assert _get_mine(client, token).status_code == 200
+
+    header, payload, signature = token.split(".")
+    forged = ".".join([header, payload, signature[:-4] + ("AAAA" if not signature.endswith("AAAA") else "BBBB")])
+    assert _get_mine(client, forged).status_code == 401
+    assert _get_mine(client, _token(user.id, 3600, "ANOTHER KEY")).status_code == 401
+    assert client.get("/participations/me").status_code == 401
@@ -0,0 +1,59 @@
+import io
+import os
+import time
+from PIL import Image
+from models import db, User
+from avatars import avatar_pipeline, original_name
+from conftest import make_user, auth_headers
+
+def _png(color: str = "red") -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (300, 200), color).save(out, "PNG")
+    return out.getvalue()
+
+def _upload(client, user, body: bytes):
+    response = client.post(
+        f"/upload_avatar/{user.id}", data = {"avatar": (io.BytesIO(body), "avatar.png")},
+        content_type = "multipart/form-data", headers = auth_headers(user.id)
+    )
+    assert response.status_code == 200, response.get_data(as_text = True)
+    db.session.expire_all()
+    return db.session.get(User, user.id).profile_picture
+
+def test_thumbnails_are_served_once_rendered(client):
+    user = make_user()
+    digest = _upload(client, user, _png())
+
+    response = client.get(f"/uploads/avatars/{digest}_256.webp", headers = {"Accept": "image/webp"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+
+def test_original_is_served_while_another_process_renders(client):
+    digest = "0123456789abcdef0123456789abcdef"
+    os.makedirs(avatar_pipeline.folder, exist_ok = True)
+    with open(avatar_pipeline.path(original_name(digest, "png")), "wb") as out:
+        out.write(_png("blue"))
+
+    response = client.get(f"/uploads/avatars/{digest}_64.webp")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert client.get("/uploads/avatars/fedcba9876543210fedcba9876543210_64.webp").status_code == 404
+
+def test_failed_render_reverts_the_avatar(client, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(avatar_pipeline, "_save", fail)
+
+    user = make_user()
+    digest = _upload(client, user, _png("green"))
+    assert not avatar_pipeline.wait(digest)
+
+    # Reverted by the render thread.
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        db.session.expire_all()
+        if db.session.get(User, user.id).profile_picture is None:
+            break
+        time.sleep(0.01)
+    assert db.session.get(User, user.id).profile_picture is None
+    assert client.get(f"/uploads/avatars/{digest}_256.webp").status_code == 404
@@ -0,0 +1,25 @@
+import json
+from models import db, Change
+from conftest import make_user, auth_headers
+
+def _record(lon: float, lat: float) -> str:
+    return json.dumps({
+        "title": "Imported fair",
+        "description": "Imported event",
+        "start_time": "2030-05-01T10:00",
+        "end_time": "2030-05-01T18:00",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "color": "#1abc9c"
+    })
+
+def test_import_reaches_the_other_processes(client):
+    owner = make_user()
+    body = "\n".join(_record(25 + pos / 10, 45) for pos in range(3))
+    response = client.post(
+        "/events/bulk", data = body, content_type = "application/x-ndjson", headers = auth_headers(owner.id)
+    )
+    assert response.status_code == 200, response.get_data(as_text = True)
+    assert response.get_json()["inserted"] == 3
+
+    scopes = [change.scopes.split(",") for change in db.session.query(Change)]
+    assert any({"feed", "events"} <= set(change) for change in scopes)
@@ -0,0 +1,82 @@
+import time
+from models import db, Change
+from changelog import ChangeLog, change_log
+from cache import response_cache
+from conftest import record_foreign_change, polling
+
+def test_changes_of_other_processes_bump_generations(database):
+    log = ChangeLog(poll = 0.01)
+    assert log.generation("feed") == 0
+
+    record_foreign_change("event:3", "feed")
+    time.sleep(0.02)
+    assert log.generation("feed") == 1
+    assert log.generation("event:3") == 1
+    assert log.foreign_generation("feed") == 1
+    assert log.generation("event:4") == 0
+
+def test_own_changes_apply_on_commit(database):
+    with polling():
+        change_log.generation("feed")
+        response_cache.invalidate("feed")
+        assert change_log.generation("feed") == 0
+        db.session.commit()
+        assert change_log.generation("feed") != 0
+
+        time.sleep(0.02)
+        assert change_log.foreign_generation("feed") == 0
+
+def test_live_updates_wait_for_a_lower_id(database):
+    log = ChangeLog(poll = 0.01)
+    passed = []
+    log.subscribe(lambda change_id, kind, data: passed.append(change_id))
+    first = record_foreign_change("feed") + 1
+    log.generation("feed")
+
+    # A writer took the first id and commits after the one that took the next.
+    second = _foreign_update(first + 1, "feed")
+    time.sleep(0.02)
+    assert log.generation("feed") != 0
+    assert passed == [] and log.stable_id() == first - 1
+
+    _foreign_update(first, "feed")
+    time.sleep(0.02)
+    log.generation("feed")
+    assert passed == [first, second] and log.stable_id() == second
+
+def test_missing_ids_are_skipped_after_gap_wait(database, monkeypatch):
+    monkeypatch.setattr("changelog.GAP_WAIT", 0.05)
+    log = ChangeLog(poll = 0.01)
+    passed = []
+    log.subscribe(lambda change_id, kind, data: passed.append(change_id))
+    # The id after this one is rolled back and never commits.
+    after = record_foreign_change("feed") + 2
+    log.generation("feed")
+
+    _foreign_update(after, "feed")
+    time.sleep(0.02)
+    log.generation("feed")
+    assert passed == []
+
+    time.sleep(0.06)
+    log.generation("feed")
+    assert passed == [after] and log.stable_id() == after
+
+def _foreign_update(change_id: int, *scopes) -> int:
+    db.session.add(Change(id = change_id, scopes = ",".join(scopes), kind = "event", data = "{}"))
+    db.session.commit()
+    return change_id
+
+def test_rolled_back_changes_are_dropped(database):
+    response_cache.invalidate("feed")
+    db.session.rollback()
+    assert change_log.generation("feed") == 0
+    assert db.session.query(Change).count() == 0
+
+def test_cache_is_keyed_by_host(client):
+    client.get("/get_events", base_url = "http://a.example.com")
+    misses = response_cache.misses
+    client.get("/get_events", base_url = "http://b.example.com")
+    assert response_cache.misses == misses + 1
+    client.get("/get_events", base_url = "http://a.example.com")
+    assert response_cache.misses == misses + 1
@@ -0,0 +1,73 @@
+import json
+from datetime import datetime
+from shapely.geometry import shape
+from columnar import MIMETYPE, encode, decode
+from models import GEOMETRY_TYPES
+from conftest import make_user, make_event, auth_headers
+
+GEOMETRIES = [
+    {"type": "Point", "coordinates": [25.5, 45.25]},
+    {"type": "LineString", "coordinates": [[25, 45], [25.1, 45.1], [25.2, 45]]},
+    {"type": "Polygon", "coordinates": [
+        [[25, 45], [25.2, 45], [25.2, 45.2], [25, 45.2], [25, 45]],
+        [[25.05, 45.05], [25.1, 45.05], [25.1, 45.1], [25.05, 45.05]]
+    ]},
+    {"type": "MultiPoint", "coordinates": [[25, 45], [26, 46]]},
+    {"type": "MultiLineString", "coordinates": [[[25, 45], [25.1, 45.1]], [[26, 46], [26.1, 46.1], [26.2, 46]]]},
+    {"type": "MultiPolygon", "coordinates": [
+        [[[25, 45], [25.1, 45], [25.1, 45.1], [25, 45]]],
+        [[[26, 46], [26.1, 46], [26.1, 46.1], [26, 46]], [[26.02, 46.02], [26.05, 46.02], [26.05, 46.05], [26.02, 46.02]]]
+    ]}
+]
+
+def test_geometries_cover_the_event_types():
+    assert [geometry["type"] for geometry in GEOMETRIES] == list(GEOMETRY_TYPES)
+
+def test_feed_roundtrip(client):
+    owner = make_user()
+    start = datetime(2030, 5, 1, 10)
+    for geometry in GEOMETRIES:
+        make_event(owner, shape(geometry), start, title = geometry["type"])
+
+    expected = client.get("/get_events").get_json()
+    response = client.get("/get_events", headers = {"Accept": MIMETYPE})
+    assert response.mimetype == MIMETYPE
+    decoded = decode(response.data)
+
+    assert len(decoded) == len(GEOMETRIES)
+    for event, original in zip(decoded, expected):
+        assert event["geometry"]["type"] == original["geometry"]["type"]
+        # Coordinates are sent as float32.
+        assert shape(event["geometry"]).equals_exact(shape(original["geometry"]), 1e-5)
+        for field in ("id", "owner_id", "title", "description", "color", "start_time", "end_time",
+                      "going", "not_going", "interested", "age_distribution", "ageAvg", "malePerc"):
+            assert event[field] == original[field], field
+
+def test_times_outside_the_uint32_range():
+    event = {
+        "id": 1, "owner_id": 1, "title": "Old fair", "description": "", "color": "#1abc9c",
+        "start_time": "1950-06-01T10:00:00", "end_time": "2150-06-01T18:00:00", "created_at": "1969-12-31T23:59:59",
+        "geometry": GEOMETRIES[0], "going": 0, "not_going": 0, "interested": 0,
+        "ageAvg": 0, "malePerc": 0, "femalePerc": 0, "notPerc": 0, "age_distribution": {"age_18_24": 0}
+    }
+    decoded, = decode(encode([event]))
+    assert (decoded["start_time"], decoded["end_time"], decoded["created_at"]) == \
+        (event["start_time"], event["end_time"], event["created_at"])
+
+def test_geometry_collections_are_rejected(client):
+    owner = make_user()
+    collection = {"type": "GeometryCollection", "geometries": [GEOMETRIES[0], GEOMETRIES[1]]}
+    event = {
+        "title": "Fair", "description": "Test event", "start_time": "2030-05-01T10:00", "end_time": "2030-05-01T18:00",
+        "geometry": collection, "color": "#1abc9c"
+    }
+
+    response = client.post("/post_event", json = event, headers = auth_headers(owner.id))
+    assert response.status_code == 400
+    assert "GeometryCollection" in response.get_json()["error"]
+
+    response = client.post(
+        "/events/bulk", data = json.dumps(event), content_type = "application/x-ndjson", headers = auth_headers(owner.id)
+    )
+    assert response.get_json()["inserted"] == 0
+    assert client.get("/get_events", headers = {"Accept": MIMETYPE}).status_code == 200
@@ -0,0 +1,119 @@
+from datetime import date, datetime, timedelta
+import numpy as np
+from shapely.geometry import Point
+from demographics import (
+    GENDER_CODES, MISSING_BIRTHDAY, aggregate, age_buckets, birthday_ordinals, exact_ages, floor_ages,
+    gender_codes, grouped_counts, summarize
+)
+from models import db, Participation
+from event_stats import compute_counters, counters_to_dicts, empty_counters
+from conftest import make_user, make_event
+
+TODAY = date(2030, 6, 15)
+
+def _ordinals(*birthdays) -> np.ndarray:
+    return birthday_ordinals(list(birthdays))
+
+def test_gender_codes_default_to_not_specified():
+    assert gender_codes(["M", "F", "N", None, "X"]).tolist() == \
+        [GENDER_CODES["M"], GENDER_CODES["F"], GENDER_CODES["N"], GENDER_CODES["N"], GENDER_CODES["N"]]
+    assert gender_codes([]).tolist() == []
+
+def test_exact_and_floored_ages():
+    birthdays = [date(2000, 6, 15), date(2000, 6, 16), date(2000, 2, 29), date(2012, 6, 20)]
+    assert exact_ages(_ordinals(*birthdays), TODAY).tolist() == [30, 29, 30, 17]
+    # Whole 365 day years, the leap days make them run ahead of the calendar.
+    assert floor_ages(_ordinals(*birthdays), TODAY).tolist() == [(TODAY - birthday).days // 365 for birthday in birthdays]
+    assert floor_ages(_ordinals(date(2000, 6, 22)), TODAY).tolist() == [30]
+
+def test_age_buckets_at_the_edges():
+    ages = np.array([0, 17, 18, 24, 25, 34, 35, 44, 45, 99])
+    assert age_buckets(ages).tolist() == [-1, -1, 0, 0, 1, 1, 2, 2, 3, 3]
+
+def test_grouped_counts_skip_negative_codes():
+    groups = np.array([0, 0, 1, 2, 2])
+    codes = np.array([1, -1, 0, 1, 1])
+    assert grouped_counts(groups, codes, 4, 2).tolist() == [[0, 1], [1, 0], [0, 2], [0, 0]]
+    weights = np.array([3, 5, 1, 2, 4])
+    assert grouped_counts(groups, codes, 4, 2, weights).tolist() == [[0, 3], [1, 0], [0, 6], [0, 0]]
+
+def test_aggregate_counts_every_group():
+    birthdays = [date(2000, 1, 1), date(1990, 1, 1), date(2015, 1, 1), date(1980, 1, 1)]
+    result = aggregate(
+        groups = [0, 0, 0, 2],
+        genders = gender_codes(["M", "F", "F", None]),
+        birthdays = _ordinals(*birthdays),
+        group_count = 3,
+        weights = [2, 1, 1, 4],
+        today = TODAY
+    )
+    floored = [(TODAY - birthday).days // 365 for birthday in birthdays]
+
+    assert result["count"].tolist() == [4, 0, 4]
+    assert result["genders"].tolist() == [[2, 2, 0], [0, 0, 0], [0, 0, 4]]
+    # 30, 40 and an under 18 in the first group, 50 in the last.
+    assert result["ages"].tolist() == [[0, 2, 1, 0], [0, 0, 0, 0], [0, 0, 0, 4]]
+    assert result["age_sum"].tolist() == [2 * floored[0] + floored[1] + floored[2], 0, 4 * floored[3]]
+    assert result["aged"].tolist() == [4, 0, 4]
+
+def test_missing_birthdays_are_not_aged():
+    assert _ordinals(None).tolist() == [MISSING_BIRTHDAY]
+    result = aggregate(
+        groups = [0, 0, 1],
+        genders = gender_codes(["F", None, "M"]),
+        birthdays = _ordinals(date(2000, 1, 1), None, None),
+        group_count = 2,
+        today = TODAY
+    )
+
+    assert result["count"].tolist() == [2, 1]
+    assert result["genders"].tolist() == [[0, 1, 1], [1, 0, 0]]
+    assert result["ages"].tolist() == [[0, 1, 0, 0], [0, 0, 0, 0]]
+    assert result["age_sum"].tolist() == [(TODAY - date(2000, 1, 1)).days // 365, 0]
+    assert result["aged"].tolist() == [1, 0]
+
+    summary = summarize(result["count"], result["genders"], result["age_sum"], result["aged"])
+    assert summary["age_avg"].tolist() == [30.0, 0]
+    assert summary["gender_perc"].tolist() == [[0, 50.0, 50.0], [100.0, 0, 0]]
+
+def test_summarize_rounds_and_handles_empty_groups():
+    summary = summarize(
+        count = np.array([3, 0, 7]),
+        gender_counts = np.array([[1, 1, 1], [0, 0, 0], [2, 4, 1]]),
+        age_sum = np.array([100, 0, 200])
+    )
+    assert summary["age_avg"].tolist() == [33.3, 0, 28.6]
+    assert summary["gender_perc"].tolist() == [[33.3, 33.3, 33.3], [0, 0, 0], [28.6, 57.1, 14.3]]
+
+def test_counters_of_an_event_without_participants(database):
+    owner = make_user()
+    event = make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1))
+    db.session.add(Participation(user_id = owner.id, event_id = event.id, status = "Interested"))
+    db.session.commit()
+
+    counters = compute_counters([event.id])
+    assert counters[event.id]["going"] == 0 and counters[event.id]["age_sum"] == 0
+    stats, = counters_to_dicts([counters[event.id]])
+    assert (stats["ageAvg"], stats["malePerc"], stats["femalePerc"], stats["notPerc"]) == (0, 0, 0, 0)
+
+    assert compute_counters([]) == {}
+    stats, = counters_to_dicts([empty_counters()])
+    assert stats["going"] == 0 and stats["ageAvg"] == 0
+
+def test_counters_match_the_baseline_percentages(database):
+    owner = make_user()
+    event = make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1))
+    genders = ["M", "M", "F", "N", "N", "N"]
+    users = [
+        make_user(f"user{number}@example.com", date(1980 + number * 5, 3, 1), gender)
+        for number, gender in enumerate(genders)
+    ]
+    db.session.add_all(Participation(user_id = user.id, event_id = event.id, status = "Going") for user in users)
+    db.session.commit()
+
+    stats, = counters_to_dicts([compute_counters([event.id])[event.id]])
+    assert (stats["malePerc"], stats["femalePerc"], stats["notPerc"]) == (
+        round(2 / 6 * 100, 1), round(1 / 6 * 100, 1), round(3 / 6 * 100, 1)
+    )
+    ages = [(date.today() - user.birthday).days // 365 for user in users]
+    assert stats["ageAvg"] == round(sum(ages) / len(ages), 1)
@@ -0,0 +1,24 @@
+import time
+from datetime import datetime, timedelta
+from shapely.geometry import Point
+from conftest import make_user, make_event, record_foreign_change, polling
+
+def _count(client) -> int:
+    response = client.get("/events/density?bbox=20,40,30,50&zoom=4")
+    assert response.status_code == 200, response.get_data(as_text = True)
+    return sum(cell["count"] for cell in response.get_json()["cells"])
+
+def test_events_added_by_another_process(client):
+    owner = make_user()
+    start = datetime.now() + timedelta(days = 1)
+    make_event(owner, Point(25, 45), start)
+
+    with polling():
+        assert _count(client) == 1
+
+        # Inserted by bulk-import in another process.
+        make_event(owner, Point(26, 46), start)
+        assert _count(client) == 1
+        record_foreign_change("feed", "events")
+        time.sleep(0.02)
+        assert _count(client) == 2
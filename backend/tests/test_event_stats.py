@@ -0,0 +1,92 @@
+from datetime import date, datetime, timedelta
+from shapely.geometry import Point
+from models import db, User, Participation, EventStats
+from event_stats import rebuild_stats
+from conftest import make_user, make_event, auth_headers
+
+def _post(client, user, event, status: str):
+    response = client.post(
+        "/post_participation", json = {"event_id": event.id, "status": status}, headers = auth_headers(user.id)
+    )
+    assert response.status_code == 200, response.get_data(as_text = True)
+    return response.get_json()
+
+def _stats(event) -> EventStats:
+    db.session.expire_all()
+    return db.session.get(EventStats, event.id)
+
+def test_leaving_after_a_birthday_uses_the_stored_bucket(client):
+    user = make_user(birthday = date(date.today().year - 30, 1, 1))
+    event = make_event(user, Point(25, 45), datetime.now() + timedelta(days = 1))
+
+    _post(client, user, event, "Going")
+    # Counted when they were 24.
+    Participation.query.filter_by(user_id = user.id).update({Participation.age_bucket: "age_18_24"})
+    stats = _stats(event)
+    stats.age_25_34 = 0
+    stats.age_18_24 = 1
+    db.session.commit()
+
+    _post(client, user, event, "Not going")
+    stats = _stats(event)
+    assert (stats.going, stats.age_18_24, stats.age_25_34) == (0, 0, 0)
+
+def test_rebuild_stores_the_current_bucket(client):
+    user = make_user(birthday = date(date.today().year - 30, 1, 1))
+    event = make_event(user, Point(25, 45), datetime.now() + timedelta(days = 1))
+    _post(client, user, event, "Going")
+    Participation.query.filter_by(user_id = user.id).update({Participation.age_bucket: "age_18_24"})
+    db.session.commit()
+
+    rebuild_stats()
+    db.session.expire_all()
+    assert Participation.query.filter_by(user_id = user.id).one().age_bucket == "age_25_34"
+
+def test_post_participation_returns_the_written_stats(client):
+    user = make_user(birthday = date(date.today().year - 30, 1, 1))
+    other = make_user("other@example.com", date(date.today().year - 20, 1, 1))
+    event = make_event(user, Point(25, 45), datetime.now() + timedelta(days = 1))
+    _post(client, other, event, "Interested")
+
+    body = _post(client, user, event, "Going")
+    assert (body["id"], body["going"], body["interested"]) == (event.id, 1, 1)
+    assert body["age_distribution"]["25-34"] == 1
+
+    # Unchanged, the stats are read instead.
+    assert _post(client, user, event, "Going")["going"] == 1
+    assert _stats(event).going == 1
+
+def _baseline_age_avg(event_id: int) -> float:
+    # The mean age of the original feed, each age floored to whole 365 day years.
+    ages = [
+        (date.today() - user.birthday).days // 365
+        for user in db.session.query(User).join(Participation, Participation.user_id == User.id)
+            .filter(Participation.event_id == event_id, Participation.status == "Going")
+    ]
+    return round(sum(ages) / len(ages), 1) if ages else 0
+
+def test_age_avg_matches_the_floored_mean(client):
+    today = date.today()
+    owner = make_user()
+    event = make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1))
+    # Days before and after the 365 day anniversaries, where the floored age
+    # and the age from the birthday's date differ, and a mean of many digits.
+    birthdays = [
+        today - timedelta(days = 365 * 30 + 3), today - timedelta(days = 365 * 30 - 3),
+        today - timedelta(days = 365 * 41 + 200), today - timedelta(days = 365 * 19 + 364),
+        date(today.year - 25, 2, 28), date(today.year - 52, 12, 31), date(2000, 2, 29)
+    ]
+    users = [make_user(f"going{number}@example.com", birthday) for number, birthday in enumerate(birthdays)]
+    for user in users:
+        _post(client, user, event, "Going")
+
+    feed_age = lambda: client.get(f"/get_event?event_id={event.id}").get_json()["ageAvg"]
+    assert feed_age() == _baseline_age_avg(event.id) != 0
+
+    # Leaving takes out the age the participant was counted with.
+    _post(client, users[0], event, "Not going")
+    _post(client, users[3], event, "Interested")
+    assert feed_age() == _baseline_age_avg(event.id)
+
+    rebuild_stats()
+    assert feed_age() == _baseline_age_avg(event.id)
@@ -0,0 +1,54 @@
+import time
+import os
+from geo import GeoCache, GeoService, StubUpstream, RateLimiter, geo_rate_limiter, MAX_STOPS
+from conftest import TMP_DIR
+
+class RecordingUpstream(StubUpstream):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def geocode(self, query: str, max_locations: int) -> dict:
+        self.queries.append(query)
+        return super().geocode(query, max_locations)
+
+def test_geo_is_public_and_rate_limited(client, monkeypatch):
+    monkeypatch.setattr(geo_rate_limiter, "burst", 2)
+    monkeypatch.setattr(geo_rate_limiter, "_buckets", {})
+    assert client.get("/geo/geocode?q=Cluj").status_code == 200
+    assert client.get("/geo/route?stops=23.6,46.7;23.7,46.8").status_code == 200
+
+    response = client.get("/geo/geocode?q=Cluj")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Other addresses have their own bucket.
+    assert client.get("/geo/geocode?q=Cluj", environ_base = {"REMOTE_ADDR": "10.0.0.2"}).status_code == 200
+
+def test_rate_limiter_refills():
+    limiter = RateLimiter(rate = 100, burst = 1)
+    assert limiter.allow("a") == 0
+    assert limiter.allow("a") > 0
+    time.sleep(0.02)
+    assert limiter.allow("a") == 0
+
+def test_route_stops_are_capped(client):
+    stops = ";".join(["23.6,46.7"] * (MAX_STOPS + 1))
+    assert client.get(f"/geo/route?stops={stops}").status_code == 400
+    assert client.get("/geo/route?stops=23.6,46.7;23.7,46.8").status_code == 200
+
+def test_geocode_forwards_the_text_as_typed():
+    upstream = RecordingUpstream()
+    service = GeoService(upstream, GeoCache(os.path.join(TMP_DIR, "geocode.sqlite3")))
+
+    service.geocode("Piața Unirii, Cluj")
+    _, hit = service.geocode("piata unirii cluj")
+    assert upstream.queries == ["Piața Unirii, Cluj"]
+    assert hit
+
+def test_eviction_keeps_max_entries():
+    cache = GeoCache(os.path.join(TMP_DIR, "evict.sqlite3"), max_entries = 3, evict_probability = 1)
+    for number in range(5):
+        cache.set(f"key:{number}", {"number": number})
+    assert len(cache) == 3
+    assert cache.get("key:0") is None
+    assert cache.get("key:4") == {"number": 4}
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from shapely.geometry import Point
+from changelog import ChangeLog, live_updates_after
+from live import LiveHub, live_hub
+from conftest import make_user, make_event, auth_headers
+
+def _going(client, user, event):
+    response = client.post(
+        "/post_participation", json = {"event_id": event.id, "status": "Going"}, headers = auth_headers(user.id)
+    )
+    assert response.status_code == 200, response.get_data(as_text = True)
+
+def test_polling_clients_get_the_updates(client):
+    user = make_user()
+    event = make_event(user, Point(25, 45), datetime.now() + timedelta(days = 1))
+    first = client.get("/events/changes").get_json()
+    assert first["changes"] == []
+
+    _going(client, user, event)
+    response = client.get(f"/events/changes?after={first['last_id']}")
+    body = response.get_json()
+    assert [(change["kind"], change["data"]["id"], change["data"]["going"]) for change in body["changes"]] == [
+        ("participation", event.id, 1)
+    ]
+
+    again = client.get(f"/events/changes?after={body['last_id']}")
+    assert again.get_json()["changes"] == []
+    cached = client.get(f"/events/changes?after={body['last_id']}", headers = {"If-None-Match": again.headers["ETag"]})
+    assert cached.status_code == 304
+
+def test_stream_resumes_from_any_worker(client):
+    user = make_user()
+    event = make_event(user, Point(25, 45), datetime.now() + timedelta(days = 1))
+    _going(client, user, event)
+
+    stream = live_hub.stream(live_hub.subscribe(), live_updates_after(0))
+    try:
+        assert next(stream).startswith("retry:")
+        assert "event: participation" in next(stream)
+    finally:
+        stream.close()
+    assert live_hub.client_count() == 0
+
+def test_stream_clients_are_capped(database):
+    hub = LiveHub(ChangeLog(poll = 0), max_clients = 1)
+    assert hub.subscribe() is not None
+    assert hub.subscribe() is None
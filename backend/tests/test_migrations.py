@@ -0,0 +1,44 @@
+from datetime import date, datetime, timedelta
+from shapely.geometry import Point
+from sqlalchemy import inspect
+from models import db, Event, Participation, EventStats
+from migrations import MIGRATIONS, migrate, applied_versions
+from conftest import make_user, make_event
+
+def _downgrade():
+    # The schema before the change log, the stored GeoJSON, the stats and the archive.
+    for table in ("event_stats", "events_archive", "participations_archive", "changes"):
+        db.session.execute(db.text(f"DROP TABLE {table}"))
+    for table, column in (
+        ("events", "geojson"), ("events", "geojson_simplified"), ("participations", "age_bucket"), ("participations", "age")
+    ):
+        db.session.execute(db.text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+    db.session.execute(db.text("CREATE INDEX ix_events_start ON events (start_time)"))
+    db.session.commit()
+    db.session.expunge_all()
+
+def test_migrate_brings_an_old_schema_up_to_date(database):
+    owner = make_user(birthday = date(date.today().year - 30, 1, 1))
+    event = make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1))
+    db.session.add(Participation(user_id = owner.id, event_id = event.id, status = "Going"))
+    db.session.commit()
+    event_id = event.id
+    _downgrade()
+
+    assert [migration.version for migration in migrate()] == [migration.version for migration in MIGRATIONS]
+
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    assert {"event_stats", "events_archive", "participations_archive", "changes"} <= tables
+    assert "change_clock" not in tables
+    assert {"kind", "data"} <= {column["name"] for column in inspector.get_columns("changes")}
+    event_indexes = {index["name"] for index in inspector.get_indexes("events")}
+    assert "ix_events_end" in event_indexes and "ix_events_start" not in event_indexes
+
+    event = db.session.get(Event, event_id)
+    assert event.geojson
+    assert db.session.get(EventStats, event_id).going == 1
+    participation = Participation.query.one()
+    assert (participation.age_bucket, participation.age) == ("age_25_34", 30)
+    assert db.session.get(EventStats, event_id).age_sum == 30
+    assert migrate() == [] and len(applied_versions()) == len(MIGRATIONS)
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+from shapely.geometry import Point, box
+from conftest import make_user, make_event, record_foreign_change, polling
+
+def _nearest(client, query: str) -> list:
+    response = client.get(f"/events/nearest?{query}")
+    assert response.status_code == 200, response.get_data(as_text = True)
+    return response.get_json()
+
+def test_k_nearest_closest_first(client):
+    owner = make_user()
+    start = datetime.now() + timedelta(days = 1)
+    far = make_event(owner, Point(26, 45), start)
+    near = make_event(owner, Point(25.01, 45), start)
+    # 0 m away from a point inside it.
+    around = make_event(owner, box(24.9, 44.9, 25.1, 45.1), start)
+    middle = make_event(owner, Point(25.2, 45), start)
+
+    events = _nearest(client, "lat=45&lon=25&k=3")
+    assert [event["id"] for event in events] == [around.id, near.id, middle.id]
+    assert events[0]["distance"] == 0
+    assert events[1]["distance"] < events[2]["distance"]
+    assert far.id in [event["id"] for event in _nearest(client, "lat=45&lon=25&k=10")]
+
+def test_only_upcoming_events(client):
+    owner = make_user()
+    upcoming = make_event(owner, Point(25.5, 45), datetime.now() + timedelta(days = 1))
+    make_event(owner, Point(25, 45), datetime.now() - timedelta(hours = 1))
+    make_event(owner, Point(25, 45.01), datetime.now() - timedelta(days = 2))
+
+    assert [event["id"] for event in _nearest(client, "lat=45&lon=25&k=5")] == [upcoming.id]
+
+def test_events_added_by_another_process(client):
+    owner = make_user()
+    start = datetime.now() + timedelta(days = 1)
+    first = make_event(owner, Point(25.5, 45), start)
+
+    with polling():
+        assert [event["id"] for event in _nearest(client, "lat=45&lon=25&k=1")] == [first.id]
+
+        # Inserted by bulk-import in another process.
+        second = make_event(owner, Point(25.01, 45), start)
+        record_foreign_change("feed", "events")
+        time.sleep(0.02)
+        assert [event["id"] for event in _nearest(client, "lat=45&lon=25&k=1")] == [second.id]
@@ -0,0 +1,74 @@
+import json
+from datetime import datetime, timedelta
+from shapely.geometry import Point
+from models import db, Event
+from conftest import make_user, make_event
+
+START = datetime(2030, 5, 1, 10)
+
+def _page(client, path: str, cursor: str = None, limit: int = 2) -> dict:
+    response = client.get(f"{path}?limit={limit}" + (f"&cursor={cursor}" if cursor else ""))
+    assert response.status_code == 200, response.get_data(as_text = True)
+    return response.get_json()
+
+def _fair(owner, hours_from_start: int, title: str = "Fair"):
+    return make_event(owner, Point(25, 45), START + timedelta(hours = hours_from_start), title = title)
+
+def test_feed_pages_are_stable_across_inserts(client):
+    owner = make_user()
+    # Same start for the first two, ordered by (start_time, end_time, id).
+    events = [_fair(owner, hours) for hours in (0, 0, 1, 2, 3)]
+    ids = [event.id for event in events]
+
+    first = _page(client, "/get_events")
+    assert [item["id"] for item in first["items"]] == ids[:2]
+
+    # Before the cursor, at it and after it.
+    _fair(owner, -1, "Earlier")
+    tied = _fair(owner, 0, "Tied")
+    later = _fair(owner, 4, "Later")
+
+    seen = [item["id"] for item in first["items"]]
+    cursor = first["next_cursor"]
+    while cursor:
+        page = _page(client, "/get_events", cursor)
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+    # The tied event has a higher id than the last one sent, so it follows it.
+    assert seen == ids[:2] + [tied.id] + ids[2:] + [later.id]
+
+def test_feed_pages_skip_deleted_rows(client):
+    owner = make_user()
+    ids = [_fair(owner, hours).id for hours in range(5)]
+
+    first = _page(client, "/get_events")
+    # The last row sent is gone, its cursor still points after it.
+    db.session.delete(db.session.get(Event, ids[1]))
+    db.session.delete(db.session.get(Event, ids[2]))
+    db.session.commit()
+
+    second = _page(client, "/get_events", first["next_cursor"])
+    assert [item["id"] for item in second["items"]] == ids[3:] and second["next_cursor"] is None
+
+def test_users_pages_and_stream(client):
+    users = [make_user(f"user{number}@example.com") for number in range(5)]
+    first = _page(client, "/get_users", limit = 3)
+    make_user("late@example.com")
+    second = _page(client, "/get_users", first["next_cursor"], limit = 3)
+
+    assert [item["id"] for item in first["items"] + second["items"]] == [user.id for user in users] + [users[-1].id + 1]
+    assert second["next_cursor"] is None
+
+    response = client.get("/get_users?format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.get_data(as_text = True).splitlines()] == \
+        [item["id"] for item in first["items"] + second["items"]]
+
+def test_invalid_pages(client):
+    assert client.get("/get_events?limit=0").status_code == 400
+    assert client.get("/get_events?cursor=bogus").status_code == 400
+    # A cursor of another list does not have the same keys.
+    make_user()
+    make_user("second@example.com")
+    cursor = _page(client, "/get_users", limit = 1)["next_cursor"]
+    assert client.get(f"/get_events?cursor={cursor}").status_code == 400
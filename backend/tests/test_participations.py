@@ -0,0 +1,129 @@
+import time
+from datetime import date, datetime, timedelta
+from shapely.geometry import Point
+from models import db, Participation, EventStats
+import participations
+from participations import apply_status_changes, group_committer
+from conftest import make_user, make_event, auth_headers, count_queries
+
+def _batch(client, user, changes: list):
+    return client.post("/participations/batch", json = {"changes": changes}, headers = auth_headers(user.id))
+
+def _events(owner, count: int) -> list:
+    start = datetime.now() + timedelta(days = 1)
+    return [make_event(owner, Point(25 + number / 100, 45), start) for number in range(count)]
+
+def test_batch_writes_the_statuses_and_stats(client):
+    user = make_user(birthday = date(date.today().year - 30, 1, 1), gender = "F")
+    first, second = _events(user, 2)
+    db.session.add(Participation(user_id = user.id, event_id = second.id, status = "Interested"))
+    db.session.commit()
+
+    response = _batch(client, user, [
+        {"event_id": first.id, "status": "Going"},
+        {"event_id": second.id, "status": "Interested"},
+        {"event_id": second.id, "status": "Going"}
+    ])
+    assert response.status_code == 200, response.get_data(as_text = True)
+    assert sorted(response.get_json(), key = lambda change: change["event_id"]) == [
+        {"event_id": first.id, "status": "Going", "previous_status": None},
+        {"event_id": second.id, "status": "Going", "previous_status": "Interested"}
+    ]
+
+    db.session.expire_all()
+    assert {row.event_id: row.status for row in Participation.query} == {first.id: "Going", second.id: "Going"}
+    stats = db.session.get(EventStats, first.id)
+    assert (stats.going, stats.female, stats.age_25_34) == (1, 1, 1)
+    # An intent of this user before the batch had been counted already.
+    assert db.session.get(EventStats, second.id).going == 1
+
+def test_batch_rejects_invalid_changes(client):
+    user = make_user()
+    event, = _events(user, 1)
+
+    assert client.post("/participations/batch", json = {"changes": []}).status_code == 401
+    assert _batch(client, user, []).status_code == 400
+    assert _batch(client, user, [{"event_id": event.id, "status": "Maybe"}]).status_code == 400
+    assert _batch(client, user, [{"event_id": str(event.id), "status": "Going"}]).status_code == 400
+    too_many = [{"event_id": event.id, "status": "Going"}] * (participations.MAX_BATCH_SIZE + 1)
+    assert _batch(client, user, too_many).status_code == 400
+
+    response = _batch(client, user, [{"event_id": event.id, "status": "Going"}, {"event_id": 999, "status": "Going"}])
+    assert response.status_code == 404
+    assert response.get_json()["event_ids"] == [999]
+    assert Participation.query.count() == 0
+
+def test_statements_per_changed_event(database):
+    owner = make_user()
+    events = _events(owner, 3)
+    users = [make_user(email = f"user{number}@example.com") for number in range(20)]
+    changes = [(user.id, event.id, "Going") for user in users for event in events]
+
+    with count_queries() as statements:
+        apply_status_changes(changes)
+        db.session.commit()
+    # The locking read and the upsert, then the stats UPDATEs and a change INSERT per event.
+    assert len(statements) <= 2 + 2 * len(events)
+    assert all(db.session.get(EventStats, event.id).going == len(users) for event in events)
+
+def test_unchanged_statuses_write_nothing(database):
+    user = make_user()
+    event, = _events(user, 1)
+    key = (user.id, event.id)
+    apply_status_changes([(*key, "Going")])
+    db.session.commit()
+
+    with count_queries() as statements:
+        result, counters = apply_status_changes([(*key, "Going")])
+    assert result == {key: ("Going", "Going")} and counters == {}
+    assert len(statements) == 1
+
+def test_group_commit_timeout_answers_503(client, monkeypatch):
+    user = make_user()
+    event, = _events(user, 1)
+    apply = participations.apply_status_changes
+    def slow(changes):
+        time.sleep(0.3)
+        return apply(changes)
+
+    monkeypatch.setattr(participations, "apply_status_changes", slow)
+    monkeypatch.setattr(group_committer, "enabled", True)
+    monkeypatch.setattr(group_committer, "timeout", 0.05)
+    response = _batch(client, user, [{"event_id": event.id, "status": "Going"}])
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    # Let the running batch finish before the database is dropped.
+    time.sleep(0.4)
+
+def test_my_participations(client):
+    user, other = make_user(), make_user(email = "other@example.com")
+    going, interested, untouched = _events(user, 3)
+    db.session.add_all([
+        Participation(user_id = user.id, event_id = going.id, status = "Going"),
+        Participation(user_id = user.id, event_id = interested.id, status = "Interested"),
+        Participation(user_id = other.id, event_id = untouched.id, status = "Going")
+    ])
+    db.session.commit()
+    mine = lambda query = "": client.get(f"/participations/me{query}", headers = auth_headers(user.id))
+
+    # Only this user's, keyed by event id.
+    assert mine().get_json() == {str(going.id): "Going", str(interested.id): "Interested"}
+    # The requested events, None for those without a participation.
+    response = mine(f"?event_ids={going.id},{untouched.id},999")
+    assert response.get_json() == {str(going.id): "Going", str(untouched.id): None, "999": None}
+    assert mine("?event_ids=").get_json() == {}
+
+    assert mine("?event_ids=1,two").status_code == 400
+    assert client.get("/participations/me").status_code == 401
+
+def test_my_participations_with_one_query(client):
+    user = make_user()
+    events = _events(user, 5)
+    apply_status_changes([(user.id, event.id, "Going") for event in events])
+    db.session.commit()
+    headers, query = auth_headers(user.id), ",".join(str(event.id) for event in events)
+
+    with count_queries() as statements:
+        response = client.get(f"/participations/me?event_ids={query}", headers = headers)
+    assert set(response.get_json().values()) == {"Going"}
+    assert len(statements) == 1
@@ -0,0 +1,35 @@
+import threading
+import pytest
+from passwords import PasswordHasher, HasherBusy, process_hash_workers, max_admitted_hashes
+
+def test_admission_stays_under_the_worker_threads(monkeypatch):
+    monkeypatch.setenv("THREADS", "4")
+    hasher = PasswordHasher(max_workers = 8, max_queue = 4, max_admitted = max_admitted_hashes())
+    assert hasher.max_workers + hasher.max_queue == 3
+
+def test_pool_is_split_between_the_processes(monkeypatch):
+    monkeypatch.setenv("PASSWORD_HASH_WORKERS", "8")
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    assert process_hash_workers() == 2
+    monkeypatch.setenv("WEB_CONCURRENCY", "17")
+    assert process_hash_workers() == 1
+
+def test_busy_at_once_when_full():
+    hasher = PasswordHasher(max_workers = 1, max_admitted = 1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+        return True
+
+    thread = threading.Thread(target = hasher._run, args = (slow,))
+    thread.start()
+    started.wait()
+    try:
+        with pytest.raises(HasherBusy):
+            hasher._run(lambda: True)
+    finally:
+        release.set()
+        thread.join()
@@ -0,0 +1,87 @@
+import os
+import re
+from datetime import datetime, timedelta
+import pytest
+from geoalchemy2 import load_spatialite
+from shapely.geometry import Point
+from sqlalchemy import event
+from app import create_app
+from models import db
+from conftest import TMP_DIR, make_user, make_event, reset_database
+
+PROFILE_DIR = os.path.join(TMP_DIR, "profiles")
+
+@pytest.fixture
+def profiled(app, monkeypatch):
+    """
+    An app of its own with the profiler on and every request profiled.
+    """
+
+    monkeypatch.setenv("PROFILING", "1")
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1")
+    monkeypatch.setenv("PROFILE_SLOW_MS", "0")
+    monkeypatch.setenv("PROFILE_DIR", PROFILE_DIR)
+    profiled_app = create_app()
+    with profiled_app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", load_spatialite)
+        reset_database()
+        yield profiled_app
+        db.session.remove()
+
+def _timings(response) -> dict:
+    return {
+        name: (float(duration), description)
+        for name, duration, description in re.findall(r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response.headers["Server-Timing"])
+    }
+
+def _metric(text: str, name: str, route: str) -> float:
+    match = re.search(rf'^{name}\{{method="GET",route="{re.escape(route)}",status="200"\}} (\S+)$', text, re.MULTILINE)
+    assert match, f"{name} {route}"
+    return float(match.group(1))
+
+def test_server_timing_header(profiled):
+    owner = make_user()
+    make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1))
+    client = profiled.test_client()
+
+    response = client.get("/get_events")
+    assert response.status_code == 200
+    timings = _timings(response)
+    assert set(timings) == {"app", "db", "ser"}
+    queries = int(timings["db"][1].split()[0])
+    assert queries >= 1
+    assert timings["app"][0] >= timings["db"][0]
+
+    # Served from the response cache.
+    assert _timings(client.get("/get_events"))["db"][1] == "0 queries"
+
+def test_metrics_aggregate_per_route(profiled):
+    owner = make_user()
+    event_id = make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1)).id
+    client = profiled.test_client()
+
+    first = client.get("/get_events")
+    client.get("/get_events")
+    client.get(f"/get_event_part/{event_id}")
+    assert client.get("/get_event_part/999999").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    text = response.get_data(as_text = True)
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert _metric(text, "http_request_duration_seconds_count", "/get_events") == 2
+    assert re.search(
+        r'^http_request_duration_seconds_bucket\{method="GET",route="/get_events",status="200",le="\+Inf"\} 2$',
+        text, re.MULTILINE
+    )
+    assert _metric(text, "http_request_sql_queries_sum", "/get_events") == int(_timings(first)["db"][1].split()[0])
+    assert _metric(text, "http_response_size_bytes_count", "/get_events") == 2
+    assert _metric(text, "http_request_duration_seconds_count", "/get_event_part/<int:event_id>") == 2
+
+    # Every request was profiled and slower than 0 ms.
+    assert any(name.startswith("get_events-") and name.endswith(".prof") for name in os.listdir(PROFILE_DIR))
+
+def test_other_apps_are_not_profiled(profiled, client):
+    assert "Server-Timing" not in client.get("/").headers
+    assert client.get("/metrics").status_code == 404
@@ -0,0 +1,79 @@
+"""
+The read endpoints run a fixed number of queries, whatever the number of
+events and participations.
+"""
+from sqlalchemy import func
+from conftest import seed, reset_database, count_queries, auth_headers
+from models import db, Event, Participation
+from cache import response_cache
+
+SMALL = {"users": 20, "events": 5}
+LARGE = {"users": 200, "events": 60}
+
+def _queries(client, url: str, headers: dict = None) -> int:
+    # A cached response would run no query at all.
+    response_cache.clear()
+    with count_queries() as statements:
+        response = client.get(url, headers = headers)
+    assert response.status_code == 200, response.get_data(as_text = True)
+    return len(statements)
+
+def _queries_by_size(client, url, headers = None) -> list:
+    """
+    Returns the query count of url on a small and on a large database.
+
+    Args:
+        url = the URL, or a function returning it, called after seeding.
+
+        headers = function returning the request headers, called after seeding.
+    """
+
+    counts = []
+    for size in (SMALL, LARGE):
+        reset_database()
+        seed(size["users"], size["events"])
+        counts.append(_queries(
+            client, url() if callable(url) else url, headers() if headers is not None else None
+        ))
+    return counts
+
+def _first_event_id() -> int:
+    return Event.query.order_by(Event.id).first().id
+
+def _busiest_owner_id() -> int:
+    # An owner of events, so every part of the dashboard is read.
+    return db.session.query(Participation.user_id)\
+        .filter(Participation.user_id.in_(db.session.query(Event.owner_id)))\
+        .group_by(Participation.user_id)\
+        .order_by(func.count(Participation.id).desc(), Participation.user_id).first()[0]
+
+def test_get_events_query_count(client):
+    small, large = _queries_by_size(client, "/get_events")
+    assert small == large
+    # The events and their stats.
+    assert large <= 2
+
+def test_get_events_filtered_query_count(client):
+    small, large = _queries_by_size(client, "/get_events?status=upcoming,ongoing")
+    assert small == large
+    assert large <= 2
+
+def test_get_events_page_query_count(client):
+    small, large = _queries_by_size(client, "/get_events?limit=50")
+    assert small == large
+    assert large <= 2
+
+def test_get_event_query_count(client):
+    small, large = _queries_by_size(client, lambda: f"/get_event?event_id={_first_event_id()}")
+    assert small == large
+    assert large <= 2
+
+def test_dashboard_query_count(client):
+    small, large = _queries_by_size(
+        client,
+        lambda: f"/users/{_busiest_owner_id()}/dashboard",
+        lambda: auth_headers(_busiest_owner_id())
+    )
+    assert small == large
+    # The user, their participations with the events and stats, their own events.
+    assert large <= 5
@@ -0,0 +1,168 @@
+"""
+Query plans of the endpoints: every SELECT, UPDATE and DELETE they issue is
+run through EXPLAIN on a seeded MySQL database, and fails when it reads a
+whole table (type ALL or index) or sorts the rows ("Using filesort")
+instead of reading them in index order. A change that drops an index from
+a hot path is caught before it ships.
+
+An index walked in order up to a LIMIT is not a full scan. Endpoints that
+read whole tables on purpose (the full feed, the density tiles) list the
+tables they may scan, and the ones sorting a few matches say so.
+
+Only runs with TEST_MYSQL_URL set, SQLite plans say nothing of production.
+"""
+import os
+import re
+import pytest
+from sqlalchemy import event
+from models import db, User, Event
+from cache import response_cache
+from conftest import reset_database, seed, auth_headers
+import synthetic
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("TEST_MYSQL_URL", "").startswith("mysql"),
+    reason = "TEST_MYSQL_URL does not point at a MySQL database."
+)
+
+EXPLAINED = ("SELECT", "UPDATE", "DELETE")
+
+class Probe:
+    """
+    Requests to one endpoint. request(client, ids) sends them, ids holds
+    an event_id, a user_id and the user's auth headers.
+
+    Args:
+        scans = the tables the endpoint may read whole.
+
+        sorts = True if the endpoint may sort its rows.
+    """
+
+    def __init__(self, name: str, request, scans = (), sorts: bool = False):
+        self.name = name
+        self.request = request
+        self.scans = set(scans)
+        self.sorts = sorts
+
+PROBES = [
+    Probe("get_events", lambda client, ids: client.get("/get_events"), scans = ("events", "event_stats")),
+    # Most of the live events once archive-events runs, read through ix_events_end
+    # or in feed order through ix_events_start_end, as the planner prefers.
+    Probe("get_events_upcoming", lambda client, ids: client.get("/get_events?status=upcoming,ongoing"),
+          scans = ("events", "event_stats"), sorts = True),
+    Probe("get_events_page", lambda client, ids: client.get("/get_events?limit=50")),
+    Probe("get_event", lambda client, ids: client.get(f"/get_event?event_id={ids['event_id']}")),
+    Probe("participants", lambda client, ids: client.get(f"/get_event_part/{ids['event_id']}")),
+    Probe("participants_page", lambda client, ids: client.get(f"/get_event_part/{ids['event_id']}?limit=50")),
+    Probe("user_participations", lambda client, ids: client.get(f"/get_user_part/{ids['user_id']}")),
+    Probe("user_participations_page", lambda client, ids: client.get(f"/get_user_part/{ids['user_id']}?limit=50")),
+    Probe("my_participations", lambda client, ids: client.get("/participations/me", headers = ids["headers"])),
+    Probe("participation", lambda client, ids: client.get(f"/participation/{ids['event_id']}/users/{ids['user_id']}")),
+    Probe("get_user", lambda client, ids: client.get(f"/get_user?user_id={ids['user_id']}", headers = ids["headers"])),
+    Probe("dashboard", lambda client, ids: client.get(f"/users/{ids['user_id']}/dashboard", headers = ids["headers"])),
+    # The spatial matches are ordered by start_time.
+    Probe("search_bbox", lambda client, ids: client.get("/events/search?bbox=23,44,26,46"), sorts = True),
+    Probe("search_radius", lambda client, ids: client.get("/events/search?lat=45&lon=25&radius=50000"), sorts = True),
+    Probe("search_text", lambda client, ids: client.get("/events/search/text?q=fair&status=upcoming")),
+    Probe("nearest", lambda client, ids: client.get("/events/nearest?lat=45&lon=25&k=10")),
+    # Density tiles load every centroid and popularity weight.
+    Probe("density", lambda client, ids: client.get("/events/density?bbox=20,43,30,49&zoom=6"),
+          scans = ("events", "event_stats")),
+    # The rows locked by a write are sorted in event_id order.
+    Probe("post_participation", lambda client, ids: client.post(
+        "/post_participation", json = {"event_id": ids["event_id"], "status": "Going"}, headers = ids["headers"]
+    ), sorts = True),
+    Probe("participations_batch", lambda client, ids: client.post(
+        "/participations/batch",
+        json = {"changes": [{"event_id": ids["event_id"], "status": "Interested"}]},
+        headers = ids["headers"]
+    ), sorts = True),
+    Probe("login", lambda client, ids: client.post(
+        "/login", json = {"email": ids["email"], "password": synthetic.PASSWORD}
+    ))
+]
+
+@pytest.fixture(scope = "module")
+def seeded(app):
+    with app.app_context():
+        reset_database()
+        seed(500, 300, 20)
+        # Planner statistics of the seeded rows, as a live database has.
+        db.session.execute(db.text("ANALYZE TABLE users, events, participations, event_stats"))
+        db.session.commit()
+
+        user_id, email = db.session.query(User.id, User.email)\
+            .filter(User.email.like("bench%@example.com")).order_by(User.id).first()
+        yield {
+            "event_id": db.session.query(Event.id).order_by(Event.id).first()[0],
+            "user_id": user_id,
+            "email": email,
+            "headers": auth_headers(user_id)
+        }
+        db.session.remove()
+
+def _table(name: str) -> str:
+    # SQLAlchemy aliases joined tables as users_1, users_2...
+    return re.sub(r"_\d+$", "", name or "")
+
+def explain(cursor, statement: str, parameters, probe: Probe) -> tuple:
+    """
+    Returns:
+        (plan lines, problems)
+    """
+
+    limited = re.search(r"\bLIMIT\b", statement) is not None
+    cursor.execute("EXPLAIN " + statement, parameters)
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    plan = [
+        f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} extra={row['Extra'] or ''}"
+        for row in rows
+    ]
+    problems = []
+    for row in rows:
+        table = _table(row["table"])
+        # <derivedN>, <subqueryN> and <union...> are read from their own plans.
+        if table.startswith("<") or table in probe.scans:
+            continue
+        if row["type"] == "ALL" or (row["type"] == "index" and not limited):
+            problems.append(f"full {'index' if row['type'] == 'index' else 'table'} scan of {table}")
+        if "Using filesort" in (row["Extra"] or "") and not probe.sorts:
+            problems.append(f"filesort on {table}")
+    return plan, problems
+
+@pytest.mark.parametrize("probe", PROBES, ids = [probe.name for probe in PROBES])
+def test_query_plan(app, seeded, probe):
+    issued = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(EXPLAINED):
+            issued.append((statement, parameters[0] if executemany else parameters))
+
+    client = app.test_client()
+    response_cache.clear()
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = probe.request(client, seeded)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code < 400, response.get_data(as_text = True)
+
+    # The first parameters of each distinct statement.
+    statements = {}
+    for statement, parameters in issued:
+        statements.setdefault(statement, parameters)
+
+    failures = []
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in statements.items():
+            plan, problems = explain(cursor, statement, parameters, probe)
+            if problems:
+                failures.append("\n".join([
+                    f"{', '.join(problems)}: {' '.join(statement.split())[:300]}",
+                    *(f"    {line}" for line in plan)
+                ]))
+    finally:
+        connection.close()
+    assert not failures, "\n".join(failures)
@@ -0,0 +1,36 @@
+import time
+from datetime import datetime, timedelta
+from shapely.geometry import Point
+from conftest import make_user, make_event, record_foreign_change, polling
+
+def _search_ids(client, query: str) -> set:
+    response = client.get(f"/events/search?{query}")
+    assert response.status_code == 200, response.get_data(as_text = True)
+    return {event["id"] for event in response.get_json()}
+
+def test_bbox_crossing_the_antimeridian(client):
+    owner = make_user()
+    start = datetime.now() + timedelta(days = 1)
+    east = make_event(owner, Point(179.5, 0.5), start)
+    west = make_event(owner, Point(-179.5, -0.5), start)
+    make_event(owner, Point(0, 0), start)
+
+    assert _search_ids(client, "bbox=179,-1,-179,1") == {east.id, west.id}
+
+def test_invalid_bbox(client):
+    for bbox in ("1,2,3", "0,10,1,5", "0,0,200,1", "0,-95,1,1"):
+        assert client.get(f"/events/search?bbox={bbox}").status_code == 400
+
+def test_events_added_by_another_process(client):
+    owner = make_user()
+    start = datetime.now() + timedelta(days = 1)
+    first = make_event(owner, Point(25, 45), start)
+
+    with polling():
+        assert _search_ids(client, "bbox=24,44,27,47") == {first.id}
+
+        # Inserted by bulk-import in another process.
+        second = make_event(owner, Point(26, 46), start)
+        record_foreign_change("feed", "events")
+        time.sleep(0.02)
+        assert _search_ids(client, "bbox=24,44,27,47") == {first.id, second.id}
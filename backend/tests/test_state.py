@@ -0,0 +1,22 @@
+import threading
+from app import create_app
+from cache import response_cache
+from auth import token_cache
+from changelog import change_log
+from participations import group_committer
+from passwords import password_hasher
+
+def test_every_app_has_its_own_state():
+    threads = set(threading.enumerate())
+    first, second = create_app(), create_app()
+
+    instances = []
+    for app in (first, second):
+        with app.app_context():
+            instances.append([
+                proxy._get_current_object() for proxy in (response_cache, token_cache, change_log, group_committer, password_hasher)
+            ])
+            assert response_cache.changes is change_log._get_current_object()
+    assert all(mine is not theirs for mine, theirs in zip(*instances))
+    # The pools and threads start on first use.
+    assert set(threading.enumerate()) == threads
@@ -0,0 +1,131 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from shapely.geometry import Point
+from sqlalchemy import event
+from models import db
+from text_search import TextIndex, text_index, tokenize
+from conftest import make_user, make_event, auth_headers
+
+mysql_only = pytest.mark.skipif(
+    not os.environ.get("TEST_MYSQL_URL", "").startswith("mysql"),
+    reason = "TEST_MYSQL_URL does not point at a MySQL database."
+)
+
+def _fair(owner, title: str, description: str = None):
+    created = make_event(owner, Point(25, 45), datetime.now() + timedelta(days = 1), title = title)
+    if description is not None:
+        created.description = description
+        db.session.commit()
+    return created
+
+def _ids(hits: list) -> list:
+    return [event_id for event_id, _ in hits]
+
+def test_tokenize_folds_case_and_diacritics():
+    assert tokenize("Târgul de Crăciun, ediția 2030!") == ["targul", "craciun", "editia", "2030"]
+
+def test_bm25_ranking(database):
+    owner = make_user()
+    # Same lengths, a title word weighs TITLE_WEIGHT description words.
+    in_title = _fair(owner, "Pottery", "stands and crafts")
+    in_description = _fair(owner, "Stands", "pottery and crafts")
+    # Same frequency in a longer text.
+    longer = _fair(owner, "Stands", "pottery and crafts and many other things sold")
+    _fair(owner, "Books", "nothing related")
+
+    hits = TextIndex().search(tokenize("pottery"))
+    assert _ids(hits) == [in_title.id, in_description.id, longer.id]
+    assert hits[0][1] > hits[1][1] > hits[2][1] > 0
+
+def test_every_word_must_match(database):
+    owner = make_user()
+    both = _fair(owner, "Pottery market")
+    _fair(owner, "Pottery workshop")
+
+    assert _ids(TextIndex().search(tokenize("pottery market"))) == [both.id]
+    assert TextIndex().search(tokenize("pottery concert")) == []
+
+def test_prefix_matching(database):
+    owner = make_user()
+    harvest = _fair(owner, "Harvest fair")
+    harvester = _fair(owner, "Harvesters parade")
+    _fair(owner, "Hardware expo")
+
+    assert sorted(_ids(TextIndex().search(tokenize("harv")))) == sorted([harvest.id, harvester.id])
+    assert _ids(TextIndex().search(tokenize("harvesters"))) == [harvester.id]
+    # Too short to be indexed or searched.
+    assert tokenize("ha") == []
+
+def test_index_follows_event_create_and_delete(client):
+    owner = make_user()
+    headers = auth_headers(owner.id)
+    _fair(owner, "Pottery market")
+    assert len(text_index.search(tokenize("pottery"))) == 1
+
+    response = client.post("/post_event", json = {
+        "title": "Pottery workshop", "description": "Clay for everyone",
+        "start_time": "2030-05-01T10:00", "end_time": "2030-05-01T18:00",
+        "geometry": {"type": "Point", "coordinates": [25, 45]}, "color": "#1abc9c"
+    }, headers = headers)
+    assert response.status_code == 200, response.get_data(as_text = True)
+    hits = text_index.search(tokenize("clay"))
+    assert len(hits) == 1 and len(text_index.search(tokenize("pottery"))) == 2
+
+    assert client.delete(f"/delete_event/{hits[0][0]}", headers = headers).status_code == 200
+    assert text_index.search(tokenize("clay")) == []
+    assert len(text_index.search(tokenize("pottery"))) == 1
+
+def test_cursor_pages_are_stable(client):
+    owner = make_user()
+    # Equal scores, ranked by id.
+    fairs = [_fair(owner, "Harvest fair") for _ in range(5)]
+    ids = [fair.id for fair in fairs]
+
+    first = client.get("/events/search/text?q=harvest&limit=2").get_json()
+    assert [item["id"] for item in first["items"]] == ids[:2]
+    assert first["total"] == 5
+
+    # A better hit and a deleted one do not shift the next page.
+    _fair(owner, "Harvest harvest")
+    db.session.delete(fairs[0])
+    db.session.commit()
+    text_index.invalidate()
+
+    second = client.get(f"/events/search/text?q=harvest&limit=2&cursor={first['next_cursor']}").get_json()
+    assert [item["id"] for item in second["items"]] == ids[2:4]
+    third = client.get(f"/events/search/text?q=harvest&limit=2&cursor={second['next_cursor']}").get_json()
+    assert [item["id"] for item in third["items"]] == ids[4:] and third["next_cursor"] is None
+
+    assert client.get("/events/search/text?q=harvest&cursor=bogus").status_code == 400
+    assert client.get("/events/search/text?q=ha").status_code == 400
+
+@mysql_only
+def test_mysql_searches_through_the_fulltext_index(client):
+    owner = make_user()
+    harvest = _fair(owner, "Harvest fair")
+    _fair(owner, "Hardware expo")
+
+    issued = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "MATCH" in statement:
+            issued.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/events/search/text?q=harv fair")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert [item["id"] for item in response.get_json()["items"]] == [harvest.id]
+    assert issued
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        statement, parameters = issued[0]
+        cursor.execute("EXPLAIN " + statement, parameters)
+        columns = [column[0] for column in cursor.description]
+        plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+    assert any(row["type"] == "fulltext" and row["key"] == "ix_events_fulltext" for row in plan), plan
@@ -11,14 +11,10 @@ import Graphic from "@arcgis/core/Graphic";
 import Point from "@arcgis/core/geometry/Point";
 import { AuthService } from "src/app/services/auth.service";
 import FeatureLayer from "@arcgis/core/layers/FeatureLayer";
-import FeatureSet from "@arcgis/core/rest/support/FeatureSet";
-import RouteParameters from "@arcgis/core/rest/support/RouteParameters";
-import * as route from "@arcgis/core/rest/route.js";
 import { Router } from '@angular/router';
-import * as locator from "@arcgis/core/rest/locator";
 import { Injectable } from '@angular/core';
 import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { Observable } from 'rxjs';
+import { Observable, of, Subject, Subscriber, Subscription, debounceTime, map, firstValueFrom, timer, exhaustMap, catchError, EMPTY } from 'rxjs';
 import HeatmapRenderer from "@arcgis/core/renderers/HeatmapRenderer";
 import SimpleMarkerSymbol from "@arcgis/core/symbols/SimpleMarkerSymbol";
 import SimpleFillSymbol from "@arcgis/core/symbols/SimpleFillSymbol";
@@ -29,6 +25,7 @@ import { ToastService } from "src/app/services/toast.service";
 import * as geometryEngine from "@arcgis/core/geometry/geometryEngine";
 import { ChartConfiguration, ChartData, ChartType } from 'chart.js';
 import Collection from "@arcgis/core/core/Collection";
+import { decodeEventColumns, EVENT_COLUMNS_MIMETYPE } from "src/app/services/event-columns";
 
 @Injectable({
   providedIn: 'root'
@@ -54,12 +51,23 @@ export class EventService {
     return this.http.delete(`${this.baseUrl}/delete_event/${eventId}`, { headers });
   }
 
+  // Doar evenimentele care nu s-au terminat inca, in formatul columnar (comprimat de server)
   getAllEvents(): Observable<any[]> {
-    return this.http.get<any[]>(`${this.baseUrl}/get_events`);
+    const headers = new HttpHeaders({ 'Accept': EVENT_COLUMNS_MIMETYPE });
+    return this.http.get(`${this.baseUrl}/get_events`, {
+      params: { status: 'upcoming,ongoing' },
+      headers,
+      responseType: 'arraybuffer'
+    }).pipe(map(buffer => decodeEventColumns(buffer)));
   }
 
-  getParticipation(eventId: number, userId: number): Observable<Participation> {
-    return this.http.get<Participation>(`${this.baseUrl}/participation/${eventId}/users/${userId}`)
+  // Statusul userului curent pentru toate evenimentele, intr-un singur request
+  getMyParticipations(): Observable<ParticipationStatuses> {
+    const token = this.authService.getToken();
+    const headers = new HttpHeaders({
+      'Authorization': `Bearer ${token}`
+    });
+    return this.http.get<ParticipationStatuses>(`${this.baseUrl}/participations/me`, { headers });
   }
 
   postParticipation(payload: { user_id: number, event_id: number, status: string }): Observable<any> {
@@ -71,6 +79,91 @@ export class EventService {
 
     return this.http.post(`${this.baseUrl}/post_participation`, payload, { headers });
   }
+
+  // Rutele si geocodarea trec prin backend, care le tine in cache. Sunt publice (limitate per IP),
+  // tokenul se trimite doar daca userul e logat
+  private geoHeaders(): HttpHeaders {
+    const token = this.authService.getToken();
+    return token ? new HttpHeaders({ 'Authorization': `Bearer ${token}` }) : new HttpHeaders();
+  }
+
+  getRoute(stops: number[][]): Observable<GeoRoute> {
+    const param = stops.map(stop => `${stop[0]},${stop[1]}`).join(';');
+    return this.http.get<GeoRoute>(`${this.baseUrl}/geo/route`, { params: { stops: param }, headers: this.geoHeaders() });
+  }
+
+  getRouteToEvent(from: number[], eventId: number): Observable<GeoRoute> {
+    return this.http.get<GeoRoute>(`${this.baseUrl}/geo/route`, {
+      params: { from: `${from[0]},${from[1]}`, event_id: eventId },
+      headers: this.geoHeaders()
+    });
+  }
+
+  geocode(query: string, max = 1): Observable<GeoCandidates> {
+    return this.http.get<GeoCandidates>(`${this.baseUrl}/geo/geocode`, { params: { q: query, max }, headers: this.geoHeaders() });
+  }
+
+  // Schimbarile evenimentelor prin /events/stream (SSE, via LiveHub). Daca serverul refuza stream-ul
+  // (503, prea multi clienti) sau acesta pica, trecem pe /events/changes, cerut periodic.
+  eventUpdates(interval = 5000): Observable<LiveUpdate> {
+    return new Observable<LiveUpdate>(subscriber => {
+      let polling: Subscription | null = null;
+      if (typeof EventSource === 'undefined') {
+        polling = this.pollUpdates(subscriber, null, interval);
+        return () => polling!.unsubscribe();
+      }
+
+      const source = new EventSource(`${this.baseUrl}/events/stream`);
+      let opened = false;
+      let lastId: number | null = null;
+      source.onopen = () => opened = true;
+      LIVE_KINDS.forEach(kind => source.addEventListener(kind, event => {
+        const message = event as MessageEvent;
+        lastId = Number(message.lastEventId);
+        subscriber.next({ kind, data: JSON.parse(message.data) });
+      }));
+      source.onerror = () => {
+        // Un stream deschis se reconecteaza singur (cu Last-Event-ID), altfel a fost refuzat sau a picat
+        if (opened && source.readyState === EventSource.CONNECTING) {
+          return;
+        }
+        source.close();
+        if (polling === null) {
+          polling = this.pollUpdates(subscriber, lastId, interval);
+        }
+      };
+      return () => {
+        source.close();
+        polling?.unsubscribe();
+      };
+    });
+  }
+
+  // Cere /events/changes la fiecare interval ms, incepand dupa schimbarea after (null = de acum)
+  private pollUpdates(subscriber: Subscriber<LiveUpdate>, after: number | null, interval: number): Subscription {
+    let etag: string | null = null;
+    let started = after !== null;
+    return timer(0, interval).pipe(
+      exhaustMap(() => {
+        const params: { [param: string]: number } = after === null ? {} : { after };
+        const headers = etag ? new HttpHeaders({ 'If-None-Match': etag }) : new HttpHeaders();
+        // 304 (nimic nou) si erorile de retea sunt ignorate, se reincearca la urmatorul pas
+        return this.http.get<LiveChanges>(`${this.baseUrl}/events/changes`, { params, headers, observe: 'response' })
+          .pipe(catchError(() => EMPTY));
+      })
+    ).subscribe(response => {
+      const body = response.body!;
+      etag = response.headers.get('ETag');
+      if (started) {
+        if (body.reload) {
+          subscriber.next({ kind: 'reload', data: {} });
+        }
+        body.changes.forEach(change => subscriber.next({ kind: change.kind, data: change.data }));
+      }
+      started = true;
+      after = body.last_id;
+    });
+  }
 }
 
 export interface MapFeature {
@@ -86,6 +179,32 @@ export interface Participation {
   status: "Going" | "Interested" | "Not going";
 }
 
+export type ParticipationStatuses = { [eventId: string]: Participation['status'] | null };
+
+export interface GeoRoute {
+  paths: number[][][];
+  length: number;
+  time: number;
+  directions: { text: string, length: number }[];
+}
+
+export interface GeoCandidates {
+  candidates: { address: string, location: number[], score: number }[];
+}
+
+export interface LiveUpdate {
+  kind: 'created' | 'deleted' | 'participation' | 'reload';
+  data: any;
+}
+
+const LIVE_KINDS: LiveUpdate['kind'][] = ['created', 'deleted', 'participation', 'reload'];
+
+export interface LiveChanges {
+  last_id: number;
+  changes: { id: number, kind: LiveUpdate['kind'], data: any }[];
+  reload: boolean;
+}
+
 type AppMode = 'NONE' | 'ADD_EVENT' | 'ROUTING';
 
 @Component({
@@ -159,6 +278,12 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
   userLocationGraphic: esri.Graphic | null = null;
   startPointName: string = '';
   endPointName: string = '';
+  // Evenimentul destinatie, rutele spre el sunt precalculate de backend
+  endEventId: number | null = null;
+
+  // Actualizari live
+  private liveUpdates?: Subscription;
+  private reloadEvents$ = new Subject<void>();
 
   constructor(
     private authService: AuthService,
@@ -180,6 +305,10 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
     });
 
     this.loadEventsOnMap();
+
+    // Evenimentele noi reincarca lista o singura data pentru o rafala de schimbari
+    this.liveUpdates = this.reloadEvents$.pipe(debounceTime(1000)).subscribe(() => this.loadEventsOnMap());
+    this.liveUpdates.add(this.eventService.eventUpdates().subscribe(update => this.applyLiveUpdate(update)));
   }
 
   ngAfterViewInit() {
@@ -204,6 +333,7 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
   }
 
   ngOnDestroy() {
+    this.liveUpdates?.unsubscribe();
     if (this.view) {
       this.view.container = null;
     }
@@ -629,6 +759,7 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
 
       this.endPointGraphic = graphic;
       this.endPointName = name;
+      this.endEventId = null;
 
       // Am terminat selectia
       this.activeRoutingField = null;
@@ -651,6 +782,7 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
       this.graphicsLayerUserPoints.remove(this.endPointGraphic);
       this.endPointGraphic = null;
       this.endPointName = '';
+      this.endEventId = null;
       this.activeRoutingField = 'end';
     }
     this.removeRoutes();
@@ -662,46 +794,46 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
       this.toast.showToast('Please select both start and destination points', 'error');
       return;
     }
-    const routeUrl = "https://route-api.arcgis.com/arcgis/rest/services/World/Route/NAServer/Route_World";
-    this.calculateRoute(routeUrl);
+    this.calculateRoute();
   }
 
-  // 7. Calcul efectiv (API Call)
-  async calculateRoute(routeUrl: string) {
-    const routeParams = new RouteParameters({
-      // Folosim explicit punctele salvate
-      stops: new FeatureSet({
-        features: [this.startPointGraphic!, this.endPointGraphic!]
-      }),
-      returnDirections: true,
+  // 7. Calcul efectiv (prin backend, rutele identice vin din cache)
+  calculateRoute() {
+    // Folosim explicit punctele salvate
+    const stops = [this.startPointGraphic!, this.endPointGraphic!].map(graphic => {
+      const point = graphic.geometry as Point;
+      return [point.longitude, point.latitude];
     });
 
-    try {
-      const data = await route.solve(routeUrl, routeParams);
-      this.displayRoute(data);
-    } catch (error) {
-      console.error("Error calculating route: ", error);
-      this.toast.showToast('Could not calculate route', 'error');
-    }
+    const route$ = this.endEventId != null
+      ? this.eventService.getRouteToEvent(stops[0], this.endEventId)
+      : this.eventService.getRoute(stops);
+
+    route$.subscribe({
+      next: (data) => this.displayRoute(data),
+      error: (error) => {
+        console.error("Error calculating route: ", error);
+        // 429: prea multe rute cerute de la acest IP
+        this.toast.showToast(error.status === 429 ? 'Too many route requests, try again later' : 'Could not calculate route', 'error');
+      }
+    });
   }
 
   // 8. Afisare ruta si directii
-  displayRoute(data: any) {
+  displayRoute(data: GeoRoute) {
     // Curata ruta veche
     this.removeRoutes();
 
-    for (const result of data.routeResults) {
-      result.route.symbol = { type: "simple-line", color: [5, 150, 255], width: 4 };
-      this.graphicsLayerRoutes.graphics.add(result.route);
-    }
+    this.graphicsLayerRoutes.graphics.add(new Graphic({
+      geometry: new Polyline({ paths: data.paths, spatialReference: { wkid: 4326 } }),
+      symbol: new SimpleLineSymbol({ color: [5, 150, 255], width: 4 })
+    }));
 
     // Afisare directii in panoul lateral
-    if (data.routeResults.length > 0) {
-      this.showDirectionsInPanel(data.routeResults[0].directions.features);
-    }
+    this.showDirectionsInPanel(data.directions);
   }
 
-  showDirectionsInPanel(features: any[]) {
+  showDirectionsInPanel(features: GeoRoute['directions']) {
     const container = document.getElementById('directions-panel');
     if (container) {
       container.innerHTML = '<h4>Directions:</h4>';
@@ -710,7 +842,7 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
       features.forEach((result) => {
         const li = document.createElement('li');
         // Formatare text distanta
-        li.innerHTML = `${result.attributes.text} <small style="color:#bdc3c7;">(${result.attributes.length.toFixed(2)} mi)</small>`;
+        li.innerHTML = `${result.text} <small style="color:#bdc3c7;">(${result.length.toFixed(2)} mi)</small>`;
         li.style.marginBottom = '8px';
         li.style.fontSize = '0.9rem';
         list.appendChild(li);
@@ -732,6 +864,7 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
     this.endPointGraphic = null;
     this.startPointName = '';
     this.endPointName = '';
+    this.endEventId = null;
     this.activeRoutingField = null;
 
     const container = document.getElementById('directions-panel');
@@ -874,92 +1007,97 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
 
         // 3. Generam Heatmap-ul
         this.createHeatmapLayer(events);
-        events.forEach(event => {
-          let graphic: Graphic;
-          const geom = event.geometry;
-          const startDate = new Date(event.start_time).toLocaleString();
-          const endDate = new Date(event.end_time).toLocaleString();
-
-          const navigateAction = {
-            title: "Navighează aici",
-            id: "navigate-to-event",
-            className: "esri-icon-directions",
-            type: "button" as "button"
-          };
-
-          const currentUserId = this.authService.getUserId();
-
-          if (currentUserId == null) {
-            const actions: any[] = [];
-
-            actions.push({
-              title: "Navigate to",
+        const currentUserId = this.authService.getUserId();
+        const statuses$: Observable<ParticipationStatuses> = currentUserId == null
+          ? of({})
+          : this.eventService.getMyParticipations();
+
+        statuses$.subscribe(statuses => {
+          events.forEach(event => {
+            let graphic: Graphic;
+            const geom = event.geometry;
+            const startDate = new Date(event.start_time).toLocaleString();
+            const endDate = new Date(event.end_time).toLocaleString();
+
+            const navigateAction = {
+              title: "Navighează aici",
               id: "navigate-to-event",
               className: "esri-icon-directions",
               type: "button" as "button"
-            });
-            actions.push({
-              title: "View Stats",
-              id: "view-stats",
-              className: "esri-icon-chart", // Iconita de grafic
-              type: "button"
-            });
-            if (event.owner_id && event.owner_id === currentUserId) {
-              actions.push({
-                title: "Delete Event",
-                id: "delete-event",
-                className: "esri-icon-trash",
-                type: "button" as "button"
-              });
-            }
-
-            const popupTemplate = {
-              title: event.title,
-              content: `
-              <div style="font-family: sans-serif; color: #555;">
-                  <b>Description:</b> ${event.description}<br>
-                  <div style="margin-top: 8px; font-size: 0.9em; color: #777;">
-                    <i class="far fa-clock"></i> ${startDate} <br> 
-                    <i class="fas fa-arrow-right"></i> ${endDate}
-                  </div>
-              </div>
-              `,
-              actions: actions // Lista de butoane
             };
 
-            const color = event.color ? this.hexToRgbArray(event.color) : [226, 119, 40];
+            if (currentUserId == null) {
+              const actions: any[] = [];
 
-            if (geom.type === 'Point') {
-              const point = new Point({ longitude: geom.coordinates[0], latitude: geom.coordinates[1] });
-              graphic = new Graphic({
-                geometry: point,
-                symbol: new SimpleMarkerSymbol({ color: color, outline: { color: [255, 255, 255], width: 1 } }),
-                attributes: event,
-                popupTemplate: popupTemplate
-              });
-            } else if (geom.type === 'Polygon') {
-              const polygon = new Polygon({ rings: geom.coordinates });
-              graphic = new Graphic({
-                geometry: polygon,
-                symbol: new SimpleFillSymbol({ color: [...color, 0.5], outline: new SimpleLineSymbol({ color: [255, 255, 255], width: 1 }) }),
-                attributes: event,
-                popupTemplate: popupTemplate
+              actions.push({
+                title: "Navigate to",
+                id: "navigate-to-event",
+                className: "esri-icon-directions",
+                type: "button" as "button"
               });
-            } else { // Polyline / LineString
-              const polyline = new Polyline({ paths: geom.coordinates });
-              graphic = new Graphic({
-                geometry: polyline,
-                symbol: new SimpleLineSymbol({ color: color, width: 2 }),
-                attributes: event,
-                popupTemplate: popupTemplate
+              actions.push({
+                title: "View Stats",
+                id: "view-stats",
+                className: "esri-icon-chart", // Iconita de grafic
+                type: "button"
               });
+              if (event.owner_id && event.owner_id === currentUserId) {
+                actions.push({
+                  title: "Delete Event",
+                  id: "delete-event",
+                  className: "esri-icon-trash",
+                  type: "button" as "button"
+                });
+              }
+
+              const popupTemplate = {
+                title: event.title,
+                content: `
+                <div style="font-family: sans-serif; color: #555;">
+                    <b>Description:</b> ${event.description}<br>
+                    <div style="margin-top: 8px; font-size: 0.9em; color: #777;">
+                      <i class="far fa-clock"></i> ${startDate} <br> 
+                      <i class="fas fa-arrow-right"></i> ${endDate}
+                    </div>
+                </div>
+                `,
+                actions: actions // Lista de butoane
+              };
+
+              const color = event.color ? this.hexToRgbArray(event.color) : [226, 119, 40];
+
+              if (geom.type === 'Point') {
+                const point = new Point({ longitude: geom.coordinates[0], latitude: geom.coordinates[1] });
+                graphic = new Graphic({
+                  geometry: point,
+                  symbol: new SimpleMarkerSymbol({ color: color, outline: { color: [255, 255, 255], width: 1 } }),
+                  attributes: event,
+                  popupTemplate: popupTemplate
+                });
+              } else if (geom.type === 'Polygon') {
+                const polygon = new Polygon({ rings: geom.coordinates });
+                graphic = new Graphic({
+                  geometry: polygon,
+                  symbol: new SimpleFillSymbol({ color: [...color, 0.5], outline: new SimpleLineSymbol({ color: [255, 255, 255], width: 1 }) }),
+                  attributes: event,
+                  popupTemplate: popupTemplate
+                });
+              } else { // Polyline / LineString
+                const polyline = new Polyline({ paths: geom.coordinates });
+                graphic = new Graphic({
+                  geometry: polyline,
+                  symbol: new SimpleLineSymbol({ color: color, width: 2 }),
+                  attributes: event,
+                  popupTemplate: popupTemplate
+                });
+              }
+
+              if (graphic) this.graphicsLayerEvents.add(graphic);
+              return;
             }
 
-            if (graphic) this.graphicsLayerEvents.add(graphic);
-            return;
-          }
+            const res = { status: statuses[event.id] ?? null };
 
-          this.eventService.getParticipation(event.id, currentUserId).subscribe(res => {
             const actions: any[] = [];
 
             actions.push({
@@ -1059,13 +1197,40 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
 
             if (graphic) this.graphicsLayerEvents.add(graphic);
           });
+          this.updateLayerVisibilityByZoom();
         });
-        this.updateLayerVisibilityByZoom();
       },
       error: (err) => console.error("Error loading events:", err)
     });
   }
 
+  applyLiveUpdate(update: LiveUpdate) {
+    if (update.kind === 'created' || update.kind === 'reload') {
+      this.reloadEvents$.next();
+      return;
+    }
+
+    const eventId = update.data.id;
+    if (update.kind === 'deleted') {
+      const removed = this.graphicsLayerEvents.graphics.filter(graphic => graphic.attributes?.id === eventId);
+      this.graphicsLayerEvents.removeMany(removed.toArray());
+      this.allEventsList = this.allEventsList.filter(e => e.id !== eventId);
+    } else {
+      // Statisticile noi ale evenimentului (going, interested, demografice)
+      this.graphicsLayerEvents.graphics.forEach(graphic => {
+        if (graphic.attributes?.id === eventId) {
+          Object.assign(graphic.attributes, update.data);
+        }
+      });
+      const event = this.allEventsList.find(e => e.id === eventId);
+      if (event) {
+        Object.assign(event, update.data);
+      }
+    }
+
+    this.createHeatmapLayer(this.allEventsList);
+  }
+
   createHeatmapLayer(events: any[]) {
     if (this.heatmapLayer) {
       this.map.remove(this.heatmapLayer);
@@ -1216,6 +1381,7 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
 
     // Setam punctul pe harta
     this.updateRoutingPoint('end', centerPoint.latitude, centerPoint.longitude, destName);
+    this.endEventId = selectedFeature.attributes?.id ?? null;
 
     // Setam automat startul la locatia curenta
     setTimeout(() => {
@@ -1274,21 +1440,13 @@ export class MapComponent implements OnInit, OnDestroy, AfterViewInit {
       return;
     }
 
-    // PASUL 2: Geocoding (Daca nu e niciun eveniment)
-    const geocodingUrl = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer";
-
+    // PASUL 2: Geocoding (Daca nu e niciun eveniment), prin backend
     try {
-      const results = await locator.addressToLocations(geocodingUrl, {
-        address: {
-          "SingleLine": this.searchQuery
-        },
-        maxLocations: 1,
-        outFields: ["*"]
-      });
+      const results = (await firstValueFrom(this.eventService.geocode(this.searchQuery, 1))).candidates;
 
       if (results.length > 0) {
         const result = results[0];
-        const location = result.location;
+        const location = new Point({ longitude: result.location[0], latitude: result.location[1] });
 
         this.view.goTo({
           target: location,
@@ -0,0 +1,122 @@
+// Decodorul formatului columnar al feed-ului de evenimente (backend/src/columnar.py)
+
+export const EVENT_COLUMNS_MIMETYPE = 'application/vnd.fairfinder.columns';
+
+interface ColumnSpec {
+  name: string;
+  type: 'int64' | 'int32' | 'uint32' | 'uint16' | 'uint8' | 'float32';
+  offset: number;
+  length: number;
+}
+
+interface ColumnsHeader {
+  count: number;
+  columns: ColumnSpec[];
+  title: string[];
+  description: string[];
+  palette: string[];
+  geometry_types: string[];
+  age_labels: string[];
+  tenths: string[];
+}
+
+const ARRAY_TYPES = {
+  int32: Int32Array,
+  uint32: Uint32Array,
+  uint16: Uint16Array,
+  uint8: Uint8Array,
+  float32: Float32Array
+};
+
+const MAGIC = 'FFC1';
+
+// Coloanele int64 (little endian) citite ca numere, exacte pana la 2^53, fara BigInt
+function int64Column(buffer: ArrayBuffer, offset: number, length: number): Float64Array {
+  const halves = new Int32Array(buffer, offset, length * 2);
+  const values = new Float64Array(length);
+  for (let i = 0; i < length; i++) {
+    values[i] = halves[i * 2 + 1] * 4294967296 + (halves[i * 2] >>> 0);
+  }
+  return values;
+}
+
+// Timpii sunt trimisi ca secunde epoch (int64, si inainte de 1970), ii refacem in formatul ISO al feed-ului JSON
+function isoTime(seconds: number): string {
+  return new Date(seconds * 1000).toISOString().slice(0, 19);
+}
+
+// Refacem geometria GeoJSON din structura parti -> inele -> coordonate
+function buildGeometry(type: string, parts: number[][][]): any {
+  switch (type) {
+    case 'Point': return { type, coordinates: parts[0][0][0] };
+    case 'LineString': return { type, coordinates: parts[0][0] };
+    case 'Polygon': return { type, coordinates: parts[0] };
+    case 'MultiPoint': return { type, coordinates: parts.map(rings => rings[0][0]) };
+    case 'MultiLineString': return { type, coordinates: parts.map(rings => rings[0]) };
+    default: return { type, coordinates: parts };
+  }
+}
+
+export function decodeEventColumns(buffer: ArrayBuffer): any[] {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== MAGIC) {
+    throw new Error(`Unknown feed format: ${magic}`);
+  }
+
+  const headerLength = view.getUint32(4, true);
+  const header: ColumnsHeader = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  const base = Math.ceil((8 + headerLength) / 8) * 8;
+
+  // Vederi direct peste buffer, fara copiere
+  const col: { [name: string]: any } = {};
+  header.columns.forEach(spec => {
+    col[spec.name] = spec.type === 'int64'
+      ? int64Column(buffer, base + spec.offset, spec.length)
+      : new ARRAY_TYPES[spec.type](buffer, base + spec.offset, spec.length);
+  });
+
+  const ageCount = header.age_labels.length;
+  const events: any[] = new Array(header.count);
+  let part = 0;
+  let ring = 0;
+  let coord = 0;
+
+  for (let i = 0; i < header.count; i++) {
+    const parts: number[][][] = [];
+    for (let p = 0; p < col['geometry_parts'][i]; p++, part++) {
+      const rings: number[][] = [];
+      for (let r = 0; r < col['part_rings'][part]; r++, ring++) {
+        const points: any[] = [];
+        for (let c = 0; c < col['ring_coords'][ring]; c++, coord++) {
+          points.push([col['coords'][coord * 2], col['coords'][coord * 2 + 1]]);
+        }
+        rings.push(points);
+      }
+      parts.push(rings);
+    }
+
+    const ageDistribution: { [label: string]: number } = {};
+    header.age_labels.forEach((label, k) => ageDistribution[label] = col['age_distribution'][i * ageCount + k]);
+
+    const event: any = {
+      id: col['id'][i],
+      owner_id: col['owner_id'][i],
+      title: header.title[i],
+      description: header.description[i],
+      start_time: isoTime(col['start_time'][i]),
+      end_time: isoTime(col['end_time'][i]),
+      created_at: isoTime(col['created_at'][i]),
+      geometry: buildGeometry(header.geometry_types[col['geometry_type'][i]], parts),
+      color: header.palette[col['color'][i]],
+      going: col['going'][i],
+      not_going: col['not_going'][i],
+      interested: col['interested'][i],
+      age_distribution: ageDistribution
+    };
+    header.tenths.forEach(field => event[field] = col[field][i] / 10);
+    events[i] = event;
+  }
+
+  return events;
+}